@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Offline benchmarks of the htmlfilters pipeline
+
+Each directory below benchmarks/collections holds the pre-fetched HTML and
+images of the articles of one collection (see vendor.py). Collections can
+also be given as a directory or as a ZIP file of mw-zip, which is vendored
+first. The filter test fixtures are benchmarked as the collection "fixtures".
+For every collection filter_tree and a few hot utils functions are timed. The
+report contains the best time of all repetitions, the time and the change in
+the number of nodes per filter and the growth of the peak resident memory
+while the articles are parsed and filtered. Reports can be saved as a local
+baseline of this machine and later runs compared against it. Articles failing
+to filter make the run fail.
+
+usage: python benchmarks/run.py [--repeat N] [--save] [--compare] [collection|DIR|ZIP ...]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gettext
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from copy import deepcopy
+
+from lxml import etree
+
+from mwlib.pdf import linuxmem, utils
+from mwlib.pdf.collection import Article
+from mwlib.pdf.htmlfilters import misc
+from mwlib.pdf.htmlfilters.profiling import BookProfile, count_nodes
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+collections_dir = os.path.join(benchmark_dir, "collections")
+fixtures_dir = os.path.join(
+    os.path.dirname(benchmark_dir), "mwlib", "pdf", "htmlfilters", "test", "extra"
+)
+baseline_file = os.path.join(benchmark_dir, "baseline.json")
+image_extensions = [".gif", ".jpg", ".png", ".svg"]
+
+
+class article(object):
+    """
+    Metabook item, get_article_count checks the class name
+    """
+
+
+class Images(object):
+    def __init__(self, directory, files):
+        self.directory = directory
+        self.files = files
+
+    def getDiskPath(self, name, size=None):
+        filename = self.files.get(name)
+        return os.path.join(self.directory, filename) if filename else None
+
+
+class Metabook(object):
+    def __init__(self, article_count):
+        self.items = [article() for _ in range(article_count)]
+
+
+class Env(object):
+    """
+    Offline replacement of the wiki environment used by the filters
+    """
+
+    def __init__(self, directory, index):
+        image_dir = os.path.join(directory, index.get("image_dir", "images"))
+        self.images = Images(image_dir, index.get("images", {}))
+        self.metabook = Metabook(max(len(index["articles"]), 2))
+
+
+def fixture_source(html):
+    """
+    Return the source HTML of a filter test fixture
+
+    Some fixtures are the output of earlier filters: links on images carry the
+    href as wiki_href, removed images have no src and the images of gallery
+    boxes lost their link. The source HTML of a wiki always has them.
+    """
+    dom = misc.parse(html)
+    for link in dom.xpath("//a[img][not(@href)][@wiki_href]"):
+        link.set("href", link.attrib.pop("wiki_href"))
+    for box in dom.xpath("//li[contains(@class, 'gallerybox')]/div/div/div[not(a)]"):
+        link = etree.Element("a", {"class": "image", "href": "./File:Missing_image.png"})
+        link.extend(box.findall("img") or [etree.Element("img")])
+        box.insert(0, link)
+    for img in dom.xpath("//img[not(@src)]"):
+        img.set("src", "./Missing_image.png/{}px".format(img.get("width") or 100))
+    return etree.tostring(dom, encoding=unicode, method="html")
+
+
+def load_collection(directory):
+    """
+    Return the environment and the list of (title, html) of a collection
+
+    Collections without index.json are taken as the filter test fixtures: the
+    images are the image files of the directory.
+    """
+    index_fn = os.path.join(directory, "index.json")
+    fixtures = not os.path.exists(index_fn)
+    if fixtures:
+        index = dict(
+            articles=[
+                dict(file=os.path.basename(fn), title=os.path.basename(fn))
+                for fn in sorted(glob.glob(os.path.join(directory, "*.html")))
+            ],
+            image_dir=".",
+            images=dict(
+                (fn, fn)
+                for fn in os.listdir(directory)
+                if os.path.splitext(fn)[1].lower() in image_extensions
+            ),
+        )
+    else:
+        with open(index_fn) as f:
+            index = json.load(f)
+    articles = []
+    for entry in index["articles"]:
+        with open(os.path.join(directory, entry["file"])) as f:
+            html = f.read().decode("utf-8")
+        articles.append((entry["title"], fixture_source(html) if fixtures else html))
+    return Env(directory, index), articles
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def parse_articles(env, articles):
+    parsed = []
+    for idx, (title, html) in enumerate(articles, 1):
+        parsed_article = Article(title=title, html=html, idx=idx, env=env)
+        parsed_article.dom = misc.parse(html)
+        parsed.append(parsed_article)
+    return parsed
+
+
+def stage_peak(func):
+    """
+    Return the result of func and the growth of the peak resident memory in MB while it ran
+    """
+    linuxmem.reset_peak()
+    before = linuxmem.resident()
+    result = func()
+    return result, linuxmem.peak_resident() - before
+
+
+def filter_parsed(parsed, book=None):
+    """
+    Run filter_tree on parsed articles, return the (title, traceback) of failed articles
+    """
+    failures = []
+    for parsed_article in parsed:
+        if book is not None:
+            parsed_article.profile = book.article_profile(parsed_article)
+        try:
+            parsed_article.parse()
+        except Exception:
+            failures.append((parsed_article.title, traceback.format_exc()))
+    return failures
+
+
+def filter_articles(env, articles, book=None):
+    return filter_parsed(parse_articles(env, articles), book)
+
+
+def bench_utils(env, articles, repeat):
+    """
+    Time hot utils functions on the unfiltered DOMs of a collection
+    """
+    doms = [parsed_article.dom for parsed_article in parse_articles(env, articles)]
+    styled = [node for dom in doms for node in dom.iter() if node.get("style")]
+    classed = [node for dom in doms for node in dom.iter() if node.get("class")]
+
+    def node_styles():
+        for node in styled:
+            utils.serialize_node_style(utils.get_node_style(node))
+
+    def node_sizes():
+        for node in styled:
+            utils.get_node_width(node, target_unit="pt")
+            utils.get_node_height(node, target_unit="pt")
+
+    def classes():
+        for dom in doms:
+            copy = deepcopy(dom)
+            with utils.indexed_classes(copy):
+                for node in utils.find_class(copy, "thumb"):
+                    utils.append_class(node, "pp-benchmark")
+                    utils.remove_class(node, "pp-benchmark")
+
+    def serialize():
+        for dom in doms:
+            utils.parse_tree(utils.serialize_tree(dom))
+
+    return OrderedDict(
+        [
+            ("get_node_style", best_of(repeat, node_styles)),
+            ("get_node_size", best_of(repeat, node_sizes)),
+            ("find_class", best_of(repeat, classes)),
+            ("serialize_tree", best_of(repeat, serialize)),
+            ("styled_nodes", len(styled)),
+            ("classed_nodes", len(classed)),
+        ]
+    )
+
+
+def bench_collection(directory, repeat):
+    env, articles = load_collection(directory)
+    nodes = sum(count_nodes(misc.parse(html)) for _, html in articles)
+    parsed, parse_peak = stage_peak(lambda: parse_articles(env, articles))
+    failures, filter_peak = stage_peak(lambda: filter_parsed(parsed))
+    for title, exception in failures:
+        print("{} failed:\n{}".format(title, exception), file=sys.stderr)
+    filter_time = best_of(repeat, lambda: filter_articles(env, articles))
+
+    filters = OrderedDict()
+    for _ in range(repeat):
+        book = BookProfile(sample_rate=1.0)
+        filter_articles(env, articles, book)
+        for name, record in book.filters().items():
+            best = filters.setdefault(name, record)
+            for key in ["wall", "cpu"]:
+                best[key] = min(best[key], record[key])
+    return OrderedDict(
+        [
+            ("articles", len(articles)),
+            ("errors", len(failures)),
+            ("nodes", nodes),
+            ("filter_tree", filter_time),
+            ("peak_growth_mb", OrderedDict([("parse", parse_peak), ("filter", filter_peak)])),
+            ("utils", bench_utils(env, articles, repeat)),
+            ("filters", filters),
+        ]
+    )
+
+
+def find_collections(names):
+    collections = OrderedDict([("fixtures", fixtures_dir)])
+    for directory in sorted(glob.glob(os.path.join(collections_dir, "*"))):
+        if os.path.isdir(directory):
+            collections[os.path.basename(directory)] = directory
+    if not names:
+        return collections
+    selected = OrderedDict()
+    for name in names:
+        if name.endswith(".zip") and os.path.isfile(name):
+            from vendor import vendor  # reading ZIP files needs mwlib
+
+            collection = os.path.splitext(os.path.basename(name))[0]
+            vendor(name, collection)
+            selected[collection] = os.path.join(collections_dir, collection)
+        elif os.path.isdir(name):
+            selected[os.path.basename(os.path.normpath(name))] = name
+        else:
+            selected[name] = collections[name]
+    return selected
+
+
+def timings(result):
+    """
+    Yield (name, seconds) of all timings of a collection result
+    """
+    yield "filter_tree", result["filter_tree"]
+    for name, value in result["utils"].items():
+        if isinstance(value, float):
+            yield "utils." + name, value
+    for name, record in result["filters"].items():
+        yield name, record["wall"]
+
+
+def compare(report, baseline, tolerance, min_delta):
+    """
+    Return the list of timings slower than tolerance times the baseline
+    """
+    regressions = []
+    for collection, result in report["collections"].items():
+        if collection not in baseline["collections"]:
+            continue
+        previous = dict(timings(baseline["collections"][collection]))
+        for name, seconds in timings(result):
+            if name not in previous:
+                continue
+            if seconds > previous[name] * tolerance and seconds - previous[name] > min_delta:
+                regressions.append((collection, name, previous[name], seconds))
+    return regressions
+
+
+def print_report(report, top=10):
+    for collection, result in report["collections"].items():
+        print(
+            "{}: {} articles ({} failed), {} nodes, filter_tree {:.3f}s, "
+            "peak resident +{:.1f}MB parse, +{:.1f}MB filter".format(
+                collection,
+                result["articles"],
+                result["errors"],
+                result["nodes"],
+                result["filter_tree"],
+                result["peak_growth_mb"]["parse"],
+                result["peak_growth_mb"]["filter"],
+            )
+        )
+        for name, value in result["utils"].items():
+            if isinstance(value, float):
+                print("    utils.{:<38} {:.4f}s".format(name, value))
+        slowest = sorted(result["filters"].items(), key=lambda item: -item[1]["wall"])
+        for name, record in slowest[:top]:
+            print(
+                "    {:<44} {:.4f}s {:+d} nodes".format(name, record["wall"], record["nodes_delta"])
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the htmlfilters")
+    parser.add_argument(
+        "collections",
+        nargs="*",
+        help="names, directories or mw-zip ZIP files of the collections to run, all if omitted",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions, the best is reported")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--save", action="store_true", help="store the report as baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=1.3, help="slowdown factor reported as regression"
+    )
+    parser.add_argument(
+        "--min-delta", type=float, default=0.02, help="ignore slowdowns below this many seconds"
+    )
+    args = parser.parse_args(argv)
+    gettext.NullTranslations().install(unicode=True)
+
+    report = OrderedDict([("repeat", args.repeat), ("collections", OrderedDict())])
+    for name, directory in find_collections(args.collections).items():
+        report["collections"][name] = bench_collection(directory, args.repeat)
+    print_report(report)
+    failed = [name for name, result in report["collections"].items() if result["errors"]]
+    if failed:
+        print("FAILED articles in {}".format(", ".join(failed)))
+        return 1
+
+    for filename in [args.output, baseline_file if args.save else None]:
+        if filename:
+            with open(filename, "w") as f:
+                json.dump(report, f, indent=2, separators=(",", ": "))
+            print("wrote {}".format(filename))
+    if args.compare:
+        if not os.path.exists(baseline_file):
+            print("no baseline, store one with --save")
+            return 0
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta)
+        for collection, name, previous, seconds in regressions:
+            print(
+                "REGRESSION {} {}: {:.4f}s -> {:.4f}s".format(collection, name, previous, seconds)
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Vendor the articles of a collection for the offline benchmarks
+
+Reads a ZIP file created by mw-zip and writes the article HTML, the images
+and an index.json to benchmarks/collections/NAME.
+
+usage: python benchmarks/vendor.py COLLECTION.zip [NAME]
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from collections import OrderedDict
+
+from mwlib.wiki import makewiki
+
+from mwlib.pdf.htmlfilters import images, misc
+
+collections_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "collections")
+
+
+def vendor(zip_fn, name):
+    env = makewiki(zip_fn)
+    directory = os.path.join(collections_dir, name)
+    image_dir = os.path.join(directory, "images")
+    if not os.path.exists(image_dir):
+        os.makedirs(image_dir)
+    index = OrderedDict([("articles", []), ("images", OrderedDict())])
+    for item in env.metabook.walk():
+        if item.type != "article":
+            continue
+        try:
+            html = item.wiki.getHTML(item.title, item.revision)["text"]["*"]
+        except (KeyError, TypeError):
+            print("skipping missing article {}".format(item.title.encode("utf-8")))
+            continue
+        filename = "{:03d}.html".format(len(index["articles"]) + 1)
+        with open(os.path.join(directory, filename), "w") as f:
+            f.write(html.encode("utf-8"))
+        index["articles"].append(OrderedDict([("file", filename), ("title", item.title)]))
+
+        for img in misc.parse(html).iter("img"):
+            img_name = images.image_name(img.get("src") or "")
+            path = env.images.getDiskPath(img_name)
+            if not path or img_name in index["images"]:
+                continue
+            image_fn = hashlib.sha1(img_name.encode("utf-8")).hexdigest()
+            image_fn += os.path.splitext(path)[1]
+            shutil.copy(path, os.path.join(image_dir, image_fn))
+            index["images"][img_name] = image_fn
+
+    with open(os.path.join(directory, "index.json"), "w") as f:
+        json.dump(index, f, indent=2, separators=(",", ": "))
+    print(
+        "vendored {} articles and {} images to {}".format(
+            len(index["articles"]), len(index["images"]), directory
+        )
+    )
+
+
+def main(argv):
+    if len(argv) not in (2, 3):
+        sys.exit("Usage: {} COLLECTION.zip [NAME]".format(argv[0]))
+    zip_fn = argv[1]
+    name = argv[2] if len(argv) == 3 else os.path.splitext(os.path.basename(zip_fn))[0]
+    vendor(zip_fn, name)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
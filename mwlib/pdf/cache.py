@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Size bounded on-disk cache shared by concurrent renders
+
+Entries are stored as one file per key below the cache directory. Writes go
+to a temporary file that is renamed into place, so readers never see partial
+entries. Reading an entry updates its mtime; when the cache grows beyond its
+size limit the entries with the oldest mtime are evicted (LRU).
+"""
+
+import errno
+import hashlib
+import os
+import tempfile
+
+from mwlib.log import Log
+
+log = Log("mwlib.pdf.cache")
+
+
+def make_key(*parts):
+    """
+    Hash the string representation of parts into a cache key
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode("utf-8")
+        elif not isinstance(part, str):
+            part = repr(part)
+        digest.update(part)
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+class DiskCache(object):
+    def __init__(self, path, max_size=512 * 1024 * 1024):
+        """
+        :param path: cache directory, created if missing
+        :param max_size: maximum size of all entries in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # approximate, other processes may write to the same cache
+        _makedirs(path)
+
+    def _filename(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """
+        Return the data stored for key or None
+        """
+        fn = self._filename(key)
+        try:
+            with open(fn, "rb") as f:
+                data = f.read()
+            os.utime(fn, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set(self, key, data):
+        fn = self._filename(key)
+        directory = os.path.dirname(fn)
+        try:
+            _makedirs(directory)
+            fd, tmp_fn = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.rename(tmp_fn, fn)
+        except (IOError, OSError) as exc:
+            log.warning("writing cache entry {} failed: {}".format(fn, exc))
+            return
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self.entries())
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.evict()
+
+    def discard(self, key):
+        try:
+            os.unlink(self._filename(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """
+        List (mtime, size, filename) of all entries
+        """
+        result = []
+        for directory, _, filenames in os.walk(self.path):
+            for name in filenames:
+                if name.startswith(".tmp-"):
+                    continue
+                fn = os.path.join(directory, name)
+                try:
+                    stat = os.stat(fn)
+                except OSError:
+                    continue
+                result.append((stat.st_mtime, stat.st_size, fn))
+        return result
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits its size limit
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, fn in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(fn)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+    def log_stats(self, name="cache"):
+        log.info("{} {}: {} hits, {} misses".format(name, self.path, self.hits, self.misses))
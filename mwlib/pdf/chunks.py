@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Split a book into chunks rendered by separate prince processes
+
+A chunk holds the front matter, a group of consecutive articles or the
+appendix. Articles and the appendix articles always start on a new page, so
+chunks paginate independently of each other. What crosses chunk boundaries
+is fixed up with generated CSS:
+
+* the page counter starts at the number of pages of the preceding chunks
+* target-counter(attr(href), page) of links to other chunks (table of
+  contents, image references) is replaced with the page number of the target
+* counter(pages) is replaced with the page count of the book
+* the running footer text of the preceding chunks is set on chunks that
+  don't start with an article setting their own (see carried_footers)
+
+Running footer elements (element(footer) on the pages of the articles) are not
+carried over: every article starts with its footer, chunks never start within
+an article.
+
+Page counts and the pages of link targets are logged by page_refs.js in a
+first round of rendering (see PrincePdfWriter._render_chunks).
+
+Links to other chunks are rendered as links to chunk_link URIs and turned into
+links to the target when the PDFs are merged. merge_pdfs also carries over the
+outlines (bookmarks) and named destinations of the chunks.
+"""
+
+import re
+from copy import deepcopy
+
+from lxml import etree
+from lxml.builder import ElementMaker
+from pyPdf import PdfFileReader, PdfFileWriter
+from pyPdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    NameObject,
+    NumberObject,
+    createStringObject,
+)
+from six import string_types
+
+from mwlib.pdf import utils
+
+E = ElementMaker()
+
+page_ref_attr = "data-pp-page-ref"
+footer_attr = "data-pp-footer-text"  # string-set as footer-text, see css/_page_layout.scss
+chunk_link_prefix = "pp-chunk-link:"
+chunk_link_attr = "data-pp-chunk-link"
+page_count_regex = re.compile(r"^msg\|out\|page-count: (?P<count>\d+)$")
+page_ref_regex = re.compile(r"^msg\|out\|page-ref: (?P<target>.+) (?P<page>\d+)$")
+css_comment_regex = re.compile(r"/\*.*?\*/", re.DOTALL)
+css_rule_regex = re.compile(r"([^{}]+)\{([^{}]*)\}")
+css_content_regex = re.compile(r"content:\s*([^;]+)")
+pseudo_element_regex = re.compile(r"(::?(before|after|marker))$")
+target_counter = "target-counter(attr(href), page)"
+pages_counter = "counter(pages)"
+destination_args = {
+    "/XYZ": ["/Left", "/Top", "/Zoom"],
+    "/FitR": ["/Left", "/Bottom", "/Right", "/Top"],
+    "/FitH": ["/Top"],
+    "/FitBH": ["/Top"],
+    "/FitV": ["/Left"],
+    "/FitBV": ["/Left"],
+}
+
+
+class Chunk(object):
+    def __init__(self, parts):
+        """
+        :param parts: list of (section, nodes), nodes are appended to a copy of section or
+                      directly to the body if section is None
+        """
+        self.parts = parts
+
+    def iter_nodes(self):
+        for _, nodes in self.parts:
+            for node in nodes:
+                yield node
+
+
+def split(root, count):
+    """
+    Split the book into the front matter, count groups of articles and the appendix
+
+    Articles are grouped by their number of nodes.
+    """
+    body = root.find("body")
+    articles = body.find("section[@id='articles']")
+    front_matter = []
+    for node in body:
+        if node is articles:
+            break
+        front_matter.append(node)
+    book_chunks = [Chunk([(None, front_matter)])] if front_matter else []
+
+    sizes = [sum(1 for _ in article.iter()) for article in articles]
+    target = float(sum(sizes)) / max(count, 1)
+    group, group_size = [], 0
+    for article, size in zip(articles, sizes):
+        if group and group_size + size / 2.0 > target:
+            book_chunks.append(Chunk([(articles, group)]))
+            group, group_size = [], 0
+        group.append(article)
+        group_size += size
+    if group:
+        book_chunks.append(Chunk([(articles, group)]))
+
+    appendix = list(body[body.index(articles) + 1 :])
+    if appendix:
+        book_chunks.append(Chunk([(None, appendix)]))
+    return book_chunks
+
+
+def to_html(root, chunk, style=None, pretty_print=True):
+    """
+    Serialize a chunk as a document with the head of root and optional extra CSS
+    """
+    skeleton = etree.Element(root.tag, dict(root.attrib))
+    head = deepcopy(root.find("head"))
+    if style:
+        head.append(E.style(style))
+    skeleton.append(head)
+    body = root.find("body")
+    skeleton_body = etree.SubElement(skeleton, body.tag, dict(body.attrib))
+    for idx, (section, _) in enumerate(chunk.parts):
+        container = skeleton_body
+        if section is not None:
+            container = etree.SubElement(skeleton_body, section.tag, dict(section.attrib))
+        container.append(etree.Comment("pp-chunk-{}".format(idx)))
+    html = utils.tree_to_string(skeleton, pretty_print=pretty_print)
+    for idx, (_, nodes) in enumerate(chunk.parts):
+        content = "".join(
+            etree.tostring(node, pretty_print=pretty_print, encoding="utf-8", method="html")
+            for node in nodes
+        )
+        html = html.replace("<!--pp-chunk-{}-->".format(idx), content, 1)
+    return html
+
+
+def mark_page_refs(book_chunks):
+    """
+    Mark the targets of links to other chunks, return the hrefs of each chunk
+
+    page_refs.js logs the page of marked targets.
+    """
+    targets = {}
+    for idx, chunk in enumerate(book_chunks):
+        for node in chunk.iter_nodes():
+            for target in node.iter():
+                if not isinstance(target.tag, string_types):
+                    continue
+                for name in (target.get("id"), target.get("name")):
+                    if name:
+                        targets.setdefault(name, (idx, target))
+    hrefs = []
+    for idx, chunk in enumerate(book_chunks):
+        chunk_hrefs = set()
+        for node in chunk.iter_nodes():
+            for link in node.iter("a"):
+                href = link.get("href") or ""
+                target = targets.get(href[1:]) if href.startswith("#") else None
+                if target is not None and target[0] != idx:
+                    target[1].set(page_ref_attr, href[1:])
+                    chunk_hrefs.add(href)
+        hrefs.append(sorted(chunk_hrefs))
+    return hrefs
+
+
+def unmark_page_refs(root):
+    for node in root.iter():
+        if isinstance(node.tag, string_types) and page_ref_attr in node.attrib:
+            del node.attrib[page_ref_attr]
+
+
+def chunk_link(href):
+    """
+    URI of a link to another chunk while the chunks are rendered, see merge_pdfs
+    """
+    return chunk_link_prefix + href[1:]
+
+
+def mark_chunk_links(book_chunks, hrefs):
+    """
+    Point the links to other chunks to chunk_link URIs
+
+    Prince drops links to targets missing from the document, URI links are kept
+    and resolved by merge_pdfs.
+
+    :param hrefs: hrefs of links to other chunks of each chunk, see mark_page_refs
+    """
+    for chunk, chunk_hrefs in zip(book_chunks, hrefs):
+        chunk_hrefs = set(chunk_hrefs)
+        for node in chunk.iter_nodes():
+            for link in node.iter("a"):
+                href = link.get("href")
+                if href in chunk_hrefs:
+                    link.set(chunk_link_attr, href)
+                    link.set("href", chunk_link(href))
+
+
+def unmark_chunk_links(root):
+    for link in root.iter("a"):
+        href = link.attrib.pop(chunk_link_attr, None)
+        if href is not None:
+            link.set("href", href)
+
+
+def _sets_footer(node):
+    """
+    Check whether node sets the footer text before any of its content
+    """
+    while node is not None:
+        if node.get(footer_attr) is not None:
+            return True
+        node = next((child for child in node if isinstance(child.tag, string_types)), None)
+    return False
+
+
+def carried_footers(book_chunks):
+    """
+    Return the footer text carried into each chunk, None if the chunk sets its own
+
+    The footer text holds until the next node setting one, chunks not starting with
+    such a node continue with the text of the preceding chunks.
+    """
+    footers, footer = [], None
+    for chunk in book_chunks:
+        nodes = list(chunk.iter_nodes())
+        footers.append(None if nodes and _sets_footer(nodes[0]) else footer)
+        for node in nodes:
+            for child in node.iter():
+                if isinstance(child.tag, string_types) and child.get(footer_attr) is not None:
+                    footer = child.get(footer_attr)
+    return footers
+
+
+def _css_string(text):
+    for char, escaped in [("\\", "\\\\"), ('"', '\\"'), ("\n", "\\A "), ("<", "\\3C ")]:
+        text = text.replace(char, escaped)
+    return '"{}"'.format(text)
+
+
+def read_page_refs(render_log_filename):
+    """
+    Return the page count and the pages of the targets logged by page_refs.js
+    """
+    page_count, pages = 0, {}
+    with open(render_log_filename) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            match = page_count_regex.match(line)
+            if match:
+                page_count = int(match.group("count"))
+            match = page_ref_regex.match(line)
+            if match:
+                pages[match.group("target")] = int(match.group("page"))
+    return page_count, pages
+
+
+def counter_rules(css):
+    """
+    Return (selectors, content) of the rules using target-counter or counter(pages)
+    """
+    rules = []
+    for selectors, declarations in css_rule_regex.findall(css_comment_regex.sub("", css)):
+        match = css_content_regex.search(declarations)
+        if not match:
+            continue
+        content = match.group(1).strip()
+        if target_counter in content or pages_counter in content:
+            selectors = [s.strip() for s in selectors.strip().split(",")]
+            rules.append((selectors, content))
+    return rules
+
+
+def _with_href(selector, href):
+    match = pseudo_element_regex.search(selector)
+    pseudo = match.group(1) if match else ""
+    return '{}[href="{}"]{}'.format(selector[: len(selector) - len(pseudo)], href, pseudo)
+
+
+def chunk_style(rules, first_page, page_count, pages, hrefs, footer=None):
+    """
+    CSS fixing the page numbers and the footer text of a chunk
+
+    :param rules: result of counter_rules
+    :param first_page: number of the first page of the chunk
+    :param page_count: page count of the book
+    :param pages: page number of each link target in the book
+    :param hrefs: hrefs of links to other chunks, rendered as chunk_link URIs
+    :param footer: footer text carried into the chunk, see carried_footers
+    """
+    style = ["body {{ counter-reset: page {}; }}".format(first_page)]
+    if footer is not None:
+        style.append("html {{ string-set: footer-text {}; }}".format(_css_string(footer)))
+    for selectors, content in rules:
+        content = content.replace(pages_counter, '"{}"'.format(page_count))
+        if target_counter not in content:
+            style.append("{} {{ content: {} !important; }}".format(", ".join(selectors), content))
+            continue
+        for href in hrefs:
+            page = pages.get(href[1:])
+            if page is None:
+                continue
+            style.append(
+                "{} {{ content: {} !important; }}".format(
+                    ", ".join(_with_href(selector, chunk_link(href)) for selector in selectors),
+                    content.replace(target_counter, '"{}"'.format(page)),
+                )
+            )
+    return "\n".join(style)
+
+
+def _destination_array(destination):
+    """
+    Explicit destination array of a pyPdf Destination
+    """
+    args = destination_args.get(destination.typ, [])
+    return ArrayObject(
+        [destination.page, NameObject(destination.typ)] + [destination[arg] for arg in args]
+    )
+
+
+def _add_outline_items(writer, parent, outlines):
+    """
+    Add the outline items of outlines below the outline dictionary parent
+
+    :param outlines: nested list of destinations as returned by PdfFileReader.getOutlines,
+                     a list follows the item it holds the children of
+    """
+    items = []
+    for entry in outlines:
+        if isinstance(entry, list):
+            if items:
+                _add_outline_items(writer, items[-1], entry)
+            continue
+        item = DictionaryObject()
+        item[NameObject("/Title")] = createStringObject(entry.title)
+        item[NameObject("/Parent")] = parent
+        item[NameObject("/Dest")] = _destination_array(entry)
+        items.append(writer._addObject(item))
+    for previous, item in zip(items, items[1:]):
+        previous.getObject()[NameObject("/Next")] = item
+        item.getObject()[NameObject("/Prev")] = previous
+    if items:
+        node = parent.getObject()
+        node[NameObject("/First")] = items[0]
+        node[NameObject("/Last")] = items[-1]
+        node[NameObject("/Count")] = NumberObject(len(items))
+
+
+def _chunk_link_actions(page):
+    """
+    Yield the link actions of a page pointing to a chunk_link URI and their targets
+    """
+    for annotation in page.get("/Annots", ArrayObject()).getObject():
+        action = annotation.getObject().get("/A")
+        action = action.getObject() if action is not None else {}
+        uri = action.get("/URI") if action.get("/S") == "/URI" else None
+        if uri is not None and uri.startswith(chunk_link_prefix):
+            yield action, uri[len(chunk_link_prefix) :]
+
+
+def merge_pdfs(filenames, output_filename, pages=None):
+    """
+    Concatenate the pages of the PDF files
+
+    The outlines and named destinations of the files are carried over. Links to
+    chunk_link URIs become links to the named destination of their target or, if
+    there is none, to the page of the target.
+
+    :param pages: page number of each link target in the merged PDF
+    """
+    pages = pages or {}
+    writer = PdfFileWriter()
+    files = [open(fn, "rb") for fn in filenames]
+    try:
+        outlines, destinations, actions = [], {}, []
+        for f in files:
+            reader = PdfFileReader(f)
+            for idx in range(reader.getNumPages()):
+                page = reader.getPage(idx)
+                actions.extend(_chunk_link_actions(page))
+                writer.addPage(page)
+            outlines.extend(reader.getOutlines())
+            for name, destination in reader.getNamedDestinations().items():
+                destinations.setdefault(name, destination)
+        page_refs = writer.getObject(writer._pages)["/Kids"]
+        for action, target in actions:
+            if target in destinations:
+                dest = createStringObject(target)
+            elif 0 < pages.get(target, 0) <= len(page_refs):
+                dest = ArrayObject([page_refs[pages[target] - 1], NameObject("/Fit")])
+            else:
+                continue
+            del action["/URI"]
+            action[NameObject("/S")] = NameObject("/GoTo")
+            action[NameObject("/D")] = dest
+        catalog = writer.getObject(writer._root)
+        if outlines:
+            outline_root = DictionaryObject({NameObject("/Type"): NameObject("/Outlines")})
+            outline_root = writer._addObject(outline_root)
+            _add_outline_items(writer, outline_root, outlines)
+            catalog[NameObject("/Outlines")] = outline_root
+        if destinations:
+            names = ArrayObject()
+            for name in sorted(destinations):
+                names.append(createStringObject(name))
+                names.append(_destination_array(destinations[name]))
+            dests = DictionaryObject({NameObject("/Names"): names})
+            catalog[NameObject("/Names")] = DictionaryObject(
+                {NameObject("/Dests"): writer._addObject(dests)}
+            )
+        with open(output_filename, "wb") as f:
+            writer.write(f)
+    finally:
+        for f in files:
+            f.close()
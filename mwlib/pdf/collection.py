@@ -1,6 +1,7 @@
 from mwlib.log import Log
 
-from .htmlfilters import filter_tree, misc
+from . import utils
+from .htmlfilters import dom_cache, filter_tree, misc
 
 log = Log("mwlib.pdf.collection")
 
@@ -17,11 +18,48 @@ class Article(object):
         self.language = "en"  # FIXME
         self.env = env  # FIXME this is a shit interface
         self.dom = None
+        self.profile = None  # htmlfilters.profiling.ArticleProfile for sampled articles
+        self.filter_cache = None  # htmlfilters.dom_cache.FilterCache
+        self.cache_key = None  # key of the source HTML, set before the HTML is released
+        self.cache_hit = None
+        self.image_files = {}  # local image path -> image name, set by images.fix_image_src
+        self.process_stats = None  # procstats of the external processes of a filter worker
+        self.formulas = None  # formulas left to render, see tex.collecting_formulas
 
     def parse(self):
-        filter_tree(self)
+        if self.filter_cache is None:
+            filter_tree(self)
+            return self.dom
+        key = self.cache_key or self.filter_cache.key(self)
+        anchors = dom_cache.image_anchors(self.dom)
+        dom = self.filter_cache.load(self, key, anchors)
+        self.cache_hit = dom is not None
+        if self.cache_hit:
+            self.dom = dom
+            misc.set_article_position(self)
+        else:
+            filter_tree(self)
+            self.filter_cache.store(self, key, anchors)
         return self.dom
 
+    def __getstate__(self):
+        """
+        Articles are shipped to filter workers without env, wiki and source HTML,
+        the DOM is serialized
+        """
+        state = self.__dict__.copy()
+        state["env"] = None
+        state["html"] = None
+        state.pop("wiki", None)
+        if self.dom is not None:
+            state["dom"] = utils.serialize_tree(self.dom)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.dom is not None:
+            self.dom = utils.parse_tree(self.dom)
+
     @classmethod
     def from_wiki_item(cls, item, env, idx):
         title = item.title
@@ -17,15 +17,26 @@ pt2mm = 25.4 / 72.0
 page_width_pt = 595
 page_height_pt = 842
 
+# CSS page size -> (width, height) in pt, precompiled stylesheets are shipped for these
+# formats (see stylesheets.py)
+page_formats = OrderedDict(
+    [("a4", (595, 842)), ("letter", (612, 792)), ("a5", (420, 595)), ("6in 9in", (432, 648))]
+)
+
 column_count = 12
 
 gutter_width_pt = 16.0
 
 page_margins = [40, 40, 60, 40]
 
-column_width_pt = (
-    (page_width_pt - page_margins[1] - page_margins[3]) - (column_count - 1) * gutter_width_pt
-) / column_count
+
+def get_column_width_pt(page_width):
+    return (
+        (page_width - page_margins[1] - page_margins[3]) - (column_count - 1) * gutter_width_pt
+    ) / column_count
+
+
+column_width_pt = get_column_width_pt(page_width_pt)
 
 columns = OrderedDict()
 for number in range(column_count):
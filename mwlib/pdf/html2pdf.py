@@ -2,27 +2,41 @@
 # -*- coding: utf-8 -*-
 
 import gettext
+import json
+import multiprocessing
+import multiprocessing.pool
 import os
 import re
 import shutil
 import subprocess
 import tempfile
+import threading
 import time
 import urllib
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 
 import lxml
-import sass
 from lxml import etree
 from lxml.builder import ElementMaker
 from mwlib.log import Log
 from mwlib.writer.licensechecker import LicenseChecker
+from six import string_types
 
+from . import chunks
 from . import htmlfilters
 from . import linuxmem
+from . import measure_cache
+from . import procstats
+from . import renderlog
+from . import stylesheets
 from . import utils
 from .collection import Article
-from .config import gutter_width_pt, column_width_pt, page_margins
 from .generators import contributors, table_of_contents, cover
+from .htmlfilters.dom_cache import FilterCache
+from .htmlfilters.profiling import BookProfile
+from .prince import PrinceError, get_pool, prince_cmd
 
 log = Log("mwlib.pdf.html2pdf")
 
@@ -33,15 +47,60 @@ current_dir = os.path.abspath(os.path.dirname(__file__))
 css_dir = os.path.join(current_dir, "css")
 scss_file = os.path.join(css_dir, "base.scss")
 js_file = os.path.join(current_dir, "js", "base.js")
+page_refs_js_file = os.path.join(current_dir, "js", "page_refs.js")
+single_pass_js_file = os.path.join(current_dir, "js", "single_pass.js")
+single_pass_prefix = "dat|single-pass|"
+spool_size = 32 * 1024 * 1024  # documents for pooled prince processes are spooled to disk above
+boxes_prefix = "dat|boxes|"  # Log.data lines of base.js with JSON [boxid, width, height] records
+
+filter_env = None  # env of the book in forked filter workers
+
+
+def _init_filter_worker(env):
+    global filter_env
+    filter_env = env
+
+
+def _filter_article(article):
+    """
+    Filter an article in a worker process, the filtered article is shipped back
+    """
+    article.env = filter_env
+    procstats.reset()
+    with htmlfilters.tex.collecting_formulas(article.formulas):
+        article.parse()
+    article.process_stats = procstats.take()
+    return article
 
 
 class PrincePdfWriter(object):
-    boxid_regex = re.compile(".*? boxid: (?P<boxid>\d+)$")
-    width_regex = re.compile("^msg\|out\|width: (?P<width>(\.|\d)+)$")
-    height_regex = re.compile("^msg\|out\|height: (?P<height>(\.|\d)+)$")
+    pending_per_worker = 4  # bounds the unfiltered DOMs held while workers filter articles
+    render_log = None  # renderlog.RenderLog of the current render stage
+    math_renderer = None  # tex.MathRenderer of the formulas of the book
 
     def __init__(
-        self, env, out_fn, debug=False, crop_marks=False, lang="en",
+        self,
+        env,
+        out_fn,
+        debug=False,
+        crop_marks=False,
+        lang="en",
+        profile_rate=None,
+        workers=1,
+        filter_cache=None,
+        filter_cache_size=512,
+        prince_workers=0,
+        prince_max_jobs=50,
+        render_chunks=1,
+        measure_all=False,
+        stream_measurement=False,
+        measure_cache_dir=None,
+        measure_cache_size=64,
+        single_pass=False,
+        css_cache_dir=None,
+        prune_css=False,
+        subset_fonts=False,
+        math_workers=0,
     ):
         """
         Initialize HTML renderer
@@ -49,15 +108,66 @@ class PrincePdfWriter(object):
         :param out_fn: output filename
         :param debug: debug mode
         :param crop_marks: render crop-marks
+        :param profile_rate: fraction of articles whose filters are profiled, off if None
+        :param workers: number of processes filtering articles
+        :param filter_cache: directory of the filtered article cache, off if None
+        :param filter_cache_size: maximum size of the filtered article cache in MB
+        :param prince_workers: number of pooled prince processes, a new process per pass if 0,
+                               at least one per chunk with render_chunks
+        :param prince_max_jobs: number of jobs after which a pooled prince process is replaced
+        :param render_chunks: number of article groups rendered in parallel, 1 renders the
+                              whole book at once. Outlines, named destinations and links
+                              between the chunks are carried over into the merged PDF,
+                              the document info of the chunks is not.
+        :param measure_all: measure every node, only the nodes used by _post_width_hook otherwise
+        :param stream_measurement: parse the output of the measuring pass while prince runs
+                                   instead of writing it to a render log file
+        :param measure_cache_dir: directory of the box size cache, off if None
+        :param measure_cache_size: maximum size of the box size cache in MB
+        :param single_pass: resize tables within one prince run (see single_pass.js) instead
+                            of measuring them in a separate pass, without render_chunks only
+        :param css_cache_dir: directory of the compiled stylesheets, see stylesheets.py
+        :param prune_css: render with the stylesheet pruned to the rules matching the book
+        :param subset_fonts: render without the font faces for scripts not used by the book
+        :param math_workers: number of formulas rendered in parallel while the articles are
+                             filtered, formulas are rendered by the filter if 0
         """
         self.pdf_output_filename = out_fn
         self.lang = lang
         self.init_l10n(lang)
         self.crop_marks = crop_marks
-        self.css_file = self._compile_sass()
+        self.css_cache_dir = css_cache_dir
+        self.css_file = stylesheets.compiled_css(scss_file, css_cache_dir)
         self.js_file = js_file
+        self.js_config_file = stylesheets.layout_config(css_cache_dir)
         self.debug = debug
         self.articles = []
+        self.memory_stages = OrderedDict()  # stage -> peak resident memory in MB
+        self.stage_times = OrderedDict()  # stage -> wall time in seconds
+        self.render_logs = OrderedDict()  # stage -> renderlog.RenderLog
+        self.filter_profile = BookProfile(profile_rate) if profile_rate else None
+        self.workers = workers
+        self.filter_cache = (
+            FilterCache(filter_cache, filter_cache_size * 1024 * 1024) if filter_cache else None
+        )
+        if prince_workers and render_chunks > 1:
+            # the front matter, the article groups and the appendix are rendered at once
+            prince_workers = max(prince_workers, render_chunks + 2)
+        self.prince_pool = get_pool(prince_workers, prince_max_jobs) if prince_workers else None
+        self.render_chunks = render_chunks
+        self.measure_all = measure_all
+        self.stream_measurement = stream_measurement
+        self.single_pass = single_pass
+        self.prune_css = prune_css
+        self.subset_fonts = subset_fonts
+        self.math_workers = math_workers
+        self.measure_cache = (
+            measure_cache.MeasureCache(
+                measure_cache_dir, measure_cache_size * 1024 * 1024, self.css_file, self.js_file
+            )
+            if measure_cache_dir
+            else None
+        )
         self.env = env
         if self.env is not None:
             self.book = self.env.metabook
@@ -91,51 +201,354 @@ class PrincePdfWriter(object):
         Renders Zip-File
         """
         start_time = time.time()
-        filtered_html = []
-        article_idx = 0
+        procstats.reset()
+        if self.math_workers:
+            self.math_renderer = htmlfilters.tex.MathRenderer(self.math_workers)
 
-        # build Article List and DOM tree
-        for n, item in enumerate(self.env.metabook.walk()):
-            if item.type == "chapter":
-                log.warning("chapter skipped")
-                continue
-            elif item.type == "article":
-                article_idx += 1
-                log.info("Article {}".format(item.title.encode("utf-8")))
-                article = Article.from_wiki_item(item, self.env, article_idx)
-                self._write_image_metadata(article.dom)
-                self.articles.append(article)
-                filtered_html.append(article.parse())
-        root = self._render_front_matter()
-        body = root.find("body")
-        articles = E.section({"id": "articles"})
-        for article_dom in filtered_html:
-            for item in article_dom.find("body").getchildren():
-                articles.append(item)
-        body.append(articles)
-        appendix = E.section({"id": "appendix"})
-        appendix.append(contributors.generate_article_contributors(self.articles))
-        appendix.append(contributors.generate_image_contributors(self.image_metadata))
-        body.append(appendix)
-        self._tag_nodes(root)
+        # build Article List and DOM tree, articles are appended as soon as they are filtered
+        with self._memory_stage("assemble"):
+            root = self._render_front_matter()
+            body = root.find("body")
+            articles = E.section({"id": "articles"})
+            body.append(articles)
+            self._append_articles(articles)
+            if self.math_renderer is not None:
+                self.math_renderer.wait()
+            filter_time = time.time() - start_time
+            log.info("filtered {} articles in {:.2f}".format(len(self.articles), filter_time))
+            if self.filter_cache is not None:
+                hits = len([article for article in self.articles if article.cache_hit])
+                log.info(
+                    "filter cache: {} hits, {} misses".format(hits, len(self.articles) - hits)
+                )
+            if self.filter_profile is not None:
+                self.filter_profile.write(
+                    os.path.join(os.path.dirname(self.pdf_output_filename), "filter_profile.json")
+                )
+            appendix = E.section({"id": "appendix"})
+            appendix.append(contributors.generate_article_contributors(self.articles))
+            appendix.append(contributors.generate_image_contributors(self.image_metadata))
+            body.append(appendix)
 
         # render DOM tree
         if self.debug:
             utils.append_class(root.find("body"), "debug")
             self._dump_html(root, "debug.html")
+        if self.subset_fonts:
+            self.css_file = stylesheets.font_subset_css(self.css_file, root, self.css_cache_dir)
+        if self.prune_css:
+            # the measure cache keeps the key of the full stylesheet, the pruned one is equivalent
+            self.css_file = stylesheets.pruned_css(self.css_file, root, self.css_cache_dir)
 
+        if not (self.single_pass and self.render_chunks == 1 and self._render_single_pass(root)):
+            self._render_two_pass(root)
+        log.info(
+            "rendering {} finished in {:.2f}".format(
+                self.pdf_output_filename, time.time() - start_time
+            )
+        )
+        procstats.log_summary()
+        for stage, render_log in self.render_logs.items():
+            if render_log.runs:
+                log.info("PRINCE {}: {}".format(stage, render_log.summary()))
+        self._write_metrics(time.time() - start_time)
+
+    def _render_two_pass(self, root):
+        """
+        Measure the book, resize its tables and render it again
+        """
+        self._tag_nodes(root)
         # 1st render process
-        render_log_filename = self._render_cmd(root, save_pdf_file=False)
-        self._post_width_hook(root, render_log_filename)
+        with self._memory_stage("measure"):
+            box_records = self._measure_book(root)
+        with self._memory_stage("resize"):
+            self._post_width_hook(root, box_records)
         if self.debug:
             self._dump_html(root, "debug_final.html")
         # 2nd render process
-        self._render_cmd(root, use_js=False)
-        log.info(
-            "rendering {} finished in {:.2f}".format(
-                self.pdf_output_filename, time.time() - start_time
+        with self._memory_stage("render"):
+            if self.render_chunks > 1:
+                self._render_chunks(root)
+            else:
+                self._render_cmd(root, use_js=False)
+
+    def _render_single_pass(self, root):
+        """
+        Render with single_pass.js resizing the tables after the first layout
+
+        Return False if the script did not run, e.g. prince does not support
+        post layout functions. Raise PrinceError if prince failed to render.
+        """
+        with self._memory_stage("render"):
+            render_log_filename = self._run_prince(
+                root,
+                self.pdf_output_filename,
+                use_js=False,
+                scripts=[self.js_config_file, single_pass_js_file],
             )
+        table_count, status, errors = None, None, []
+        with open(render_log_filename) as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.startswith(single_pass_prefix):
+                    table_count = line[len(single_pass_prefix) :].strip()
+                elif line.startswith("msg|err|"):
+                    errors.append(line[len("msg|err|") :])
+                elif line.startswith("fin|"):
+                    status = line[len("fin|") :]
+        pdf_written = (
+            os.path.exists(self.pdf_output_filename)
+            and os.path.getsize(self.pdf_output_filename) > 0
         )
+        if status == "failure" or (status is None and not pdf_written):
+            raise PrinceError(
+                "prince failed to render {}: {}".format(
+                    self.pdf_output_filename, "; ".join(errors) or "no output"
+                )
+            )
+        if table_count is None:
+            for error in errors:
+                log.error("prince: {}".format(error))
+            log.warning("single pass layout failed, rendering in two passes")
+            return False
+        log.info("single pass layout resized {} tables".format(table_count))
+        return True
+
+    def _write_metrics(self, wall):
+        """
+        Write the resources used by the render to metrics.json next to the PDF
+        """
+        metrics = OrderedDict(
+            [
+                ("wall", wall),
+                ("articles", len(self.articles)),
+                ("memory_stages", self.memory_stages),
+                ("stage_times", self.stage_times),
+                ("processes", procstats.snapshot()),
+                (
+                    "render_logs",
+                    OrderedDict(
+                        (stage, render_log.metrics())
+                        for stage, render_log in self.render_logs.items()
+                        if render_log.runs
+                    ),
+                ),
+            ]
+        )
+        fn = os.path.join(os.path.dirname(self.pdf_output_filename), "metrics.json")
+        try:
+            with open(fn, "w") as f:
+                json.dump(metrics, f, indent=2)
+        except (IOError, OSError) as exc:
+            log.warning("writing {} failed: {}".format(fn, exc))
+
+    @contextmanager
+    def _memory_stage(self, name):
+        """
+        Log the peak resident memory of the process during a render stage
+
+        The logs of the prince runs of the stage are collected in render_logs.
+        """
+        linuxmem.reset_peak()
+        start = time.time()
+        self.render_log = self.render_logs.setdefault(name, renderlog.RenderLog())
+        try:
+            yield
+        finally:
+            self.render_log = None
+            self.stage_times[name] = self.stage_times.get(name, 0) + time.time() - start
+            self.memory_stages[name] = linuxmem.peak_resident()
+            log.info(
+                "MEMORY {}: peak {:.2f}MB resident {:.2f}MB".format(
+                    name, self.memory_stages[name], linuxmem.resident()
+                )
+            )
+
+    def _append_articles(self, section):
+        """
+        Move the content of each article into section as soon as it is filtered
+
+        The filtered DOM of an article is released once it is appended.
+        """
+        if self.workers > 1:
+            filtered_articles = self._filter_articles_parallel()
+        else:
+            filtered_articles = self._filter_articles()
+        for article in filtered_articles:
+            for item in article.dom.find("body").getchildren():
+                section.append(item)
+            article.dom = None
+
+    def _iter_articles(self):
+        """
+        Fetch the articles of the book in order and write their image metadata
+
+        The source HTML of an article is released once it is parsed.
+        """
+        article_idx = 0
+        for item in self.env.metabook.walk():
+            if item.type == "chapter":
+                log.warning("chapter skipped")
+                continue
+            elif item.type == "article":
+                article_idx += 1
+                log.info("Article {}".format(item.title.encode("utf-8")))
+                article = Article.from_wiki_item(item, self.env, article_idx)
+                self._write_image_metadata(article.dom)
+                if self.filter_cache is not None:
+                    article.filter_cache = self.filter_cache
+                    article.cache_key = self.filter_cache.key(article)
+                article.html = None
+                if self.math_renderer is not None:
+                    article.formulas = {}
+                if self.filter_profile is not None:
+                    article.profile = self.filter_profile.article_profile(article)
+                self.articles.append(article)
+                yield article
+
+    def _filter_articles(self):
+        for article in self._iter_articles():
+            with htmlfilters.tex.collecting_formulas(article.formulas):
+                article.parse()
+            self._submit_formulas(article)
+            yield article
+
+    def _filter_articles_parallel(self):
+        """
+        Filter articles in a pool of forked worker processes
+
+        Fetching and image metadata stay in this process: the wiki and image
+        databases can't be shared with forked processes and image numbering
+        has to follow the book order. Filtered articles are yielded in book
+        order, at most pending_per_worker articles per worker are in flight.
+        """
+        pool = multiprocessing.Pool(self.workers, _init_filter_worker, (self.env,))
+        max_pending = self.workers * self.pending_per_worker
+        pending = deque()
+        try:
+            for article in self._iter_articles():
+                pending.append((article, pool.apply_async(_filter_article, (article,))))
+                if len(pending) >= max_pending:
+                    yield self._collect_filtered(*pending.popleft())
+            pool.close()
+            while pending:
+                yield self._collect_filtered(*pending.popleft())
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _collect_filtered(self, article, result):
+        filtered = result.get()
+        article.dom = filtered.dom
+        article.image_files = filtered.image_files
+        article.cache_hit = filtered.cache_hit
+        procstats.merge(filtered.process_stats)
+        article.formulas = filtered.formulas
+        self._submit_formulas(article)
+        if article.profile is not None:
+            article.profile.merge(filtered.profile)
+        return article
+
+    def _submit_formulas(self, article):
+        """
+        Render the formulas collected while filtering an article, each formula of the book once
+        """
+        if self.math_renderer is not None:
+            self.math_renderer.submit(article.formulas)
+        article.formulas = None
+
+    def _measure_book(self, root):
+        """
+        Measure the tagged nodes of the book, return [boxid, width, height] records
+
+        With the measure cache only the articles missing in the cache are rendered,
+        the first prince pass is skipped if all articles are cached.
+        """
+        if self.measure_cache is None:
+            if self.render_chunks > 1:
+                return self._render_chunks(root, measure=True)
+            return self._measure(root)
+
+        records, missing, hits = [], [], 0
+        for section, node in measure_cache.segments(root):
+            positions = measure_cache.tagged_positions(node)
+            if not positions:
+                continue
+            key = self.measure_cache.key(section, node, positions)
+            cached = self.measure_cache.load(key, node)
+            if cached is None:
+                missing.append((section, node, key))
+            else:
+                records.extend(cached)
+                hits += 1
+        log.info("measure cache: {} hits, {} misses".format(hits, len(missing)))
+        if not missing:
+            return records
+
+        parts = []
+        for section, node, _ in missing:
+            if parts and parts[-1][0] is section:
+                parts[-1][1].append(node)
+            else:
+                parts.append((section, [node]))
+        measured = self._measure(
+            chunks.to_html(root, chunks.Chunk(parts), pretty_print=self.debug)
+        )
+        sizes = dict((record[0], record) for record in measured)
+        for _, node, key in missing:
+            self.measure_cache.store(key, node, sizes)
+        return records + measured
+
+    def _measure(self, html):
+        """
+        Render html with base.js, return the [boxid, width, height] records it logged
+
+        :param html: HTML string or DOM-tree
+        """
+        if not self.stream_measurement:
+            return self._read_render_log(self._run_prince(html, os.devnull))
+        scripts = [self.js_file]
+        if self.prince_pool is not None:
+            try:
+                _, render_log = self._convert_pooled(html, scripts)
+                return self._read_box_records(self._watch_render_log(render_log.splitlines()))
+            except PrinceError as exc:
+                log.warning("prince pool failed, starting a new prince process: {}".format(exc))
+        return self._stream_subprocess(html, scripts)
+
+    def _stream_subprocess(self, html, scripts):
+        """
+        Parse the output of a new prince process while it renders
+
+        The html is written by a separate thread, prince may fill the stdout pipe
+        before it has read all of its input.
+        """
+        cmd = self._prince_cmd(os.devnull, scripts)
+        log.info("running cmd: {} (streaming stdout)".format(cmd))
+        p = procstats.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        feeder = threading.Thread(target=self._feed, args=(p.stdin, html))
+        feeder.daemon = True
+        feeder.start()
+
+        def lines():
+            for line in iter(p.stdout.readline, ""):
+                if line.startswith("msg|err|"):
+                    log.error("prince: {}".format(line[len("msg|err|") :].rstrip()))
+                yield line
+
+        try:
+            return self._read_box_records(self._watch_render_log(lines()))
+        except Exception:
+            p.kill()
+            raise
+        finally:
+            p.stdout.close()
+            feeder.join()
+            p.wait()
 
     def _render_cmd(self, root, save_pdf_file=True, use_js=True):
         """
@@ -143,8 +556,37 @@ class PrincePdfWriter(object):
         """
         mem_start = linuxmem.memory()
         pdf_filename = self.pdf_output_filename if save_pdf_file else os.devnull
-        cmd = [
-            "prince",
+        stdout_filename = self._run_prince(root, pdf_filename, use_js)
+        mem_end = linuxmem.memory()
+        log.info("MEMORY before {0:.2f}MB after {1:.2f}MB rendering".format(mem_start, mem_end))
+        return stdout_filename
+
+    def _run_prince(self, html, pdf_filename, use_js=True, scripts=()):
+        """
+        Render html with a pooled or a new prince process, return the render log filename
+
+        :param html: HTML string or DOM-tree
+        :param scripts: additional scripts to run
+        """
+        scripts = ([self.js_file] if use_js and self.js_file else []) + list(scripts)
+        stdout_fd, stdout_filename = tempfile.mkstemp(prefix="render_out_", suffix=".log")
+        if self.prince_pool is None or not self._render_pooled(
+            html, stdout_fd, pdf_filename, scripts
+        ):
+            self._render_subprocess(html, stdout_fd, stdout_filename, pdf_filename, scripts)
+        if self.render_log is not None:
+            with open(stdout_filename) as f:
+                self.render_log.feed(f)
+        return stdout_filename
+
+    def _watch_render_log(self, lines):
+        """
+        Collect the prince log lines in the render log of the current stage while they are read
+        """
+        return lines if self.render_log is None else self.render_log.watch(lines)
+
+    def _prince_cmd(self, pdf_filename, scripts):
+        cmd = prince_cmd + [
             "-",
             "-o",
             pdf_filename,
@@ -152,62 +594,169 @@ class PrincePdfWriter(object):
             "print",
             "-s",
             self.css_file,
-            "--no-network",
             "--server",
         ]
-        if use_js and self.js_file:
-            cmd.extend(["--script", self.js_file])
+        for script in scripts:
+            cmd.extend(["--script", script])
+        return cmd
 
-        stdout_fd, stdout_filename = tempfile.mkstemp(prefix="render_out_", suffix=".log")
+    def _render_subprocess(self, html, stdout_fd, stdout_filename, pdf_filename, scripts):
+        cmd = self._prince_cmd(pdf_filename, scripts)
         log.info("running cmd: {} (stdout: {}) ".format(cmd, stdout_filename))
-        p = subprocess.Popen(
+        p = procstats.Popen(
             cmd, stdin=subprocess.PIPE, stdout=stdout_fd, stderr=subprocess.STDOUT
         )
-        p.communicate(utils.tree_to_string(root))
-        mem_end = linuxmem.memory()
-        log.info("MEMORY before {0:.2f}MB after {1:.2f}MB rendering".format(mem_start, mem_end))
-        return stdout_filename
+        self._feed(p.stdin, html)
+        p.wait()
+
+    def _prince_job(self, scripts):
+        job = {
+            "input": {
+                "src": "job-resource:0",
+                "type": "html",
+                "media": "print",
+                "styles": [self.css_file],
+            }
+        }
+        if scripts:
+            job["input"]["scripts"] = scripts
+            job["input"]["javascript"] = True
+        return job
+
+    def _convert_pooled(self, html, scripts):
+        """
+        Run a job in the prince pool, a DOM-tree is serialized to a spooled file first
+        """
+        resource = html
+        if not isinstance(html, string_types):
+            resource = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            self._write_html(html, resource)
+        try:
+            return self.prince_pool.convert(self._prince_job(scripts), [resource])
+        finally:
+            if resource is not html:
+                resource.close()
+
+    def _write_html(self, html, f):
+        """
+        Write an HTML string or serialize a DOM-tree incrementally to the file object f
+
+        DOM-trees are pretty printed in debug mode only.
+        """
+        if isinstance(html, string_types):
+            f.write(html)
+        else:
+            utils.write_tree(html, f, pretty_print=self.debug)
+
+    def _feed(self, stream, html):
+        """
+        Write html to the stdin of prince and close it
+        """
+        try:
+            self._write_html(html, stream)
+        except (IOError, OSError) as exc:
+            log.error("writing to prince failed: {}".format(exc))
+        finally:
+            try:
+                stream.close()
+            except (IOError, OSError):
+                pass
+
+    def _render_pooled(self, html, stdout_fd, pdf_filename, scripts):
+        """
+        Render with a pooled prince process, return False if the pool failed
+        """
+        try:
+            pdf, render_log = self._convert_pooled(html, scripts)
+        except PrinceError as exc:
+            log.warning("prince pool failed, starting a new prince process: {}".format(exc))
+            return False
+        with os.fdopen(stdout_fd, "w") as f:
+            f.write(render_log)
+        if pdf is None:
+            log.error("prince failed to render {}".format(pdf_filename))
+        elif pdf_filename != os.devnull:
+            with open(pdf_filename, "wb") as f:
+                f.write(pdf)
+        return True
+
+    def _render_chunks(self, root, measure=False):
+        """
+        Render the book in chunks on parallel prince processes
+
+        With measure the chunks are rendered with the measuring script and the box
+        records of all chunks are returned. Otherwise the chunks are rendered twice: first
+        to count their pages and to find the pages of link targets, then with page
+        numbers and page references fixed up (see chunks.py). The resulting PDFs
+        are merged into the output file, links to other chunks are resolved when merging.
+        """
+        book_chunks = chunks.split(root, self.render_chunks)
+        threads = multiprocessing.pool.ThreadPool(len(book_chunks))
+        pdf_filenames = []
+        try:
+            if measure:
+                chunk_records = threads.map(
+                    lambda chunk: self._measure(
+                        chunks.to_html(root, chunk, pretty_print=self.debug)
+                    ),
+                    book_chunks,
+                )
+                return [record for records in chunk_records for record in records]
+            hrefs = chunks.mark_page_refs(book_chunks)
+            render_logs = threads.map(
+                lambda chunk: self._run_prince(
+                    chunks.to_html(root, chunk, pretty_print=self.debug),
+                    os.devnull,
+                    use_js=False,
+                    scripts=[page_refs_js_file],
+                ),
+                book_chunks,
+            )
+            chunks.unmark_page_refs(root)
+            first_pages, pages, page_count = [], {}, 0
+            for render_log in render_logs:
+                chunk_page_count, chunk_pages = chunks.read_page_refs(render_log)
+                first_pages.append(page_count + 1)
+                for target, page in chunk_pages.items():
+                    pages[target] = page_count + page
+                page_count += chunk_page_count
+            log.info("rendering {} pages in {} chunks".format(page_count, len(book_chunks)))
+
+            with open(self.css_file) as f:
+                rules = chunks.counter_rules(f.read())
+            footers = chunks.carried_footers(book_chunks)
+            chunks.mark_chunk_links(book_chunks, hrefs)
+            for _ in book_chunks:
+                fd, pdf_filename = tempfile.mkstemp(prefix="render_chunk_", suffix=".pdf")
+                os.close(fd)
+                pdf_filenames.append(pdf_filename)
+
+            def render(idx):
+                style = chunks.chunk_style(
+                    rules, first_pages[idx], page_count, pages, hrefs[idx], footers[idx]
+                )
+                html = chunks.to_html(root, book_chunks[idx], style, self.debug)
+                self._run_prince(html, pdf_filenames[idx], use_js=False)
+
+            threads.map(render, range(len(book_chunks)))
+            chunks.merge_pdfs(pdf_filenames, self.pdf_output_filename, pages)
+        finally:
+            threads.close()
+            threads.join()
+            chunks.unmark_page_refs(root)
+            chunks.unmark_chunk_links(root)
+            for pdf_filename in pdf_filenames:
+                os.unlink(pdf_filename)
 
-    def _post_width_hook(self, root, render_log_filename):
+    def _post_width_hook(self, root, box_records):
         """
         Resize elements based on box sizes determined in previous render process
         """
-        self._parse_render_output(root, render_log_filename)
+        self._parse_render_output(root, box_records)
         htmlfilters.sizetools.fix_nested_widths(root)
         htmlfilters.sizetools.resize_tables(root)
         htmlfilters.sizetools.resize_overwide_tables(root)
 
-    def _compile_sass(self):
-        """
-        compile css from scss
-        """
-        self._write_css_config()
-        css_fn = os.path.splitext(scss_file)[0] + ".css"
-        source_map_fn = css_fn + ".map"
-        compiled_css, source_map = sass.compile(
-            filename=scss_file, source_map_filename=source_map_fn
-        )
-        with open(css_fn, "w") as css_file:
-            css_file.write(compiled_css)
-        with open(source_map_fn, "w") as map_file:
-            map_file.write(source_map)
-
-        log.info("compiled sass {} -> {}".format(scss_file, css_fn))
-        return css_fn
-
-    def _write_css_config(self):
-        with open(os.path.join(css_dir, "_config.scss"), "w") as fn:
-            scss_config = [
-                "$gutter-width: {}pt;".format(gutter_width_pt),
-                "$base-column-width: {}pt;".format(column_width_pt),
-                "@page {",
-                "   size: a4;",
-                "   margin: {};".format(" ".join([str(p) + "pt" for p in page_margins])),
-                "   padding: 0;",
-                "}",
-            ]
-            fn.write("\n".join(scss_config))
-
     def _dump_html(self, root, filename="debug.html"):
         """
         Dump HTML content of root tree into a file
@@ -255,12 +804,19 @@ class PrincePdfWriter(object):
                 tmp_out_fn,  # target
             ]
             print("\n".join(["-" * 40, "CONVERTING TO CMYK", " ".join(cmd)]))
-            ret = subprocess.call(cmd)
+            ret = procstats.Popen(cmd).wait()
             if ret == 0:
                 shutil.move(tmp_out_fn, self.pdf_output_filename)
 
     def _tag_nodes(self, root):
-        for idx, node in enumerate(root.iter()):
+        """
+        Number the nodes whose boxes are measured by base.js
+        """
+        if self.measure_all:
+            nodes = root.iter()
+        else:
+            nodes = htmlfilters.sizetools.measured_nodes(root)
+        for idx, node in enumerate(nodes):
             try:
                 node.set("boxid", str(idx))
             except TypeError:
@@ -269,41 +825,40 @@ class PrincePdfWriter(object):
                 else:
                     log.error("Setting boxid on node {} failed".format(node.tag))
 
-    def _parse_render_output(self, root, render_log_filename):
+    def _parse_render_output(self, root, records):
         """
-        add width and height in pt to root tree boxes based on render log
+        add width and height in pt to root tree boxes based on [boxid, width, height] records
         """
-        widths, heights = [], []
-        id2width, id2height = {}, {}
-        boxid = 0
-        with open(render_log_filename) as f:
-            for line in f:
-                boxid_res = self.boxid_regex.match(line)
-                if boxid_res:
-                    boxid = int(boxid_res.group("boxid"))
-                    if len(widths):
-                        id2width[boxid - 1] = max(widths or [0])
-                    if len(heights):
-                        id2height[boxid - 1] = sum(heights or [0])
-                    widths, heights = [], []
-                width = self.width_regex.match(line)
-                height = self.height_regex.match(line)
-                if width:
-                    width = float(width.group("width"))
-                    widths.append(width)
-                if height:
-                    height = float(height.group("height"))
-                    heights.append(height)
-        id2width[boxid] = max(widths or [0])
-        id2height[boxid] = sum(heights or [0])
+        count = max([record[0] for record in records] or [-1]) + 1
+        widths = array("d", [0]) * count
+        heights = array("d", [0]) * count
+        for boxid, width, height in records:
+            widths[boxid] = width
+            heights[boxid] = height
 
         for node in root.iterdescendants():
             _id = int(node.get("boxid") or -1)
             if _id > -1:
-                node.set("box_width", "{:.2f}".format(id2width.get(_id, 0)))
-                node.set("box_height", "{:.2f}".format(id2height.get(_id, 0)))
+                width = widths[_id] if _id < count else 0
+                height = heights[_id] if _id < count else 0
+                node.set("box_width", "{:.2f}".format(width))
+                node.set("box_height", "{:.2f}".format(height))
                 del node.attrib["boxid"]
 
+    def _read_render_log(self, render_log_filename):
+        """
+        Return the [boxid, width, height] records logged by base.js
+        """
+        with open(render_log_filename) as f:
+            return self._read_box_records(f)
+
+    def _read_box_records(self, lines):
+        records = []
+        for line in lines:
+            if line.startswith(boxes_prefix):
+                records.extend(json.loads(line[len(boxes_prefix) :]))
+        return records
+
     def _write_image_metadata(self, body):
         """
         write image metadata and tag images
@@ -14,78 +14,105 @@ from mwlib.pdf.htmlfilters import (
     special,
     sizetools,
 )
+from mwlib.pdf import utils
+from mwlib.pdf.htmlfilters.engine import Features, run_filters
+
+# tree filters (operate only on the dom-tree)
+# node filters declared with engine.node_filter that follow each other share one traversal
+# filters declaring preconditions with engine.requires are skipped if these are absent
+# the remaining tree filters add, remove or move nodes, change other nodes than the one
+# they match (ancestors, descendants, rows of a table) or depend on the attributes of
+# other nodes (infobox ancestors, low-ppi images), which node filters must not do
+tree_filters = [
+    misc.remove_nodes_and_content,
+    tables.remove_single_cell_tables,
+    sections.remove_empty,
+    misc.transform_width_and_height_attributes_to_style,
+    misc.markup_maps,
+    misc.remove_figure_colon,
+    tables.remove_style_sizes,
+    tables.remove_styles_in_floats,
+    tables.mark_table_header,
+    tables.bold_tablenote_marker,
+    tables.markup_short_tables,
+    images.set_size_attributes,
+    images.strip_height,
+    images.fix_galleries,
+    images.fix_links_on_images,
+    images.remove_images_with_class_remove,
+    misc.rewrite_links,
+    tex.transform2svg,
+    tex.remove_mathml,
+    images.remove_missing,
+    tables.identify_infoboxes,
+    images.set_figure_div_size,
+    tables.remove_infobox_divs,
+    tables.add_infobox_wrapper,
+    infobox.clean_infobox_inner_width,
+    infobox.clean_infobox_padding,
+    infobox.clean_infobox_background_color,
+    tables.improve_table_breaks,
+    tables.remove_multicolumn,
+    tables.remove_explicit_multicolumn,
+    tables.remove_pullquote_margin_styles,
+    tables.markup_floated_tables,
+    tables.remove_styles,
+    images.fix_abspos_overlays,
+    images.scale_inline,
+    images.limit_size,
+    images.fix_thumbs,
+    images.mark_img_container,
+    images.move_caption_below_image,
+    images.remove_img_style_size,
+    images.fix_img_style_size_tmulti,
+    images.fix_image_tables,
+    images.fix_col8_low_ppi,
+    images.add_class_to_infobox_wide_images,
+    images.remove_low_ppi,
+    images.remove_responsive_styles,
+    images.optimize_maps,
+    typography.fix_sizes,
+    typography.add_center_class,
+    typography.remove_p_padding,
+    lists.merge_single_element_lists,
+    lists.mark_inline,
+    blockquotes.remove_container,
+    special.fix_election_charts,
+    misc.clean,
+    sections.change_references_id_to_class,
+]
+
+
+# article filters (usually require access to the env object or other metadata)
+article_filters = [
+    misc.filter_content,
+    misc.add_article_title,
+    lang_tools.map_class_to_style,
+    lang_tools.map_classes,
+    images.fix_image_src,
+    images.check_size,
+]
 
 
 def filter_tree(article):
-    # article filters (usually require access to the env object or other metadata)
-    for filter_function in [
-        misc.filter_content,
-        misc.add_article_title,
-        lang_tools.map_class_to_style,
-        lang_tools.map_classes,
-        images.fix_image_src,
-        images.check_size,
-    ]:
+    with utils.cached_styles():
+        if article.profile is None:
+            _filter_tree(article)
+        else:
+            _profile_filter_tree(article, article.profile)
+
+
+def _filter_tree(article):
+    for filter_function in article_filters:
         filter_function(article)
+    with utils.indexed_classes(article.dom) as class_index:
+        run_filters(article.dom, tree_filters, features=Features(article.dom, class_index))
+
 
-    # tree filters (operate only on the dom-tree)
-    for filter_function in [
-        misc.remove_nodes_and_content,
-        tables.remove_single_cell_tables,
-        sections.remove_empty,
-        misc.transform_width_and_height_attributes_to_style,
-        misc.markup_maps,
-        misc.remove_figure_colon,
-        tables.remove_style_sizes,
-        tables.remove_styles_in_floats,
-        tables.mark_table_header,
-        tables.bold_tablenote_marker,
-        tables.markup_short_tables,
-        images.set_size_attributes,
-        images.strip_height,
-        images.fix_galleries,
-        images.fix_links_on_images,
-        images.remove_images_with_class_remove,
-        misc.rewrite_links,
-        tex.transform2svg,
-        tex.remove_mathml,
-        images.remove_missing,
-        tables.identify_infoboxes,
-        images.set_figure_div_size,
-        tables.remove_infobox_divs,
-        tables.add_infobox_wrapper,
-        infobox.clean_infobox_inner_width,
-        infobox.clean_infobox_padding,
-        infobox.clean_infobox_background_color,
-        tables.improve_table_breaks,
-        tables.remove_multicolumn,
-        tables.remove_explicit_multicolumn,
-        tables.remove_pullquote_margin_styles,
-        tables.markup_floated_tables,
-        tables.remove_styles,
-        images.fix_abspos_overlays,
-        images.scale_inline,
-        images.limit_size,
-        images.fix_thumbs,
-        images.mark_img_container,
-        images.move_caption_below_image,
-        images.remove_img_style_size,
-        images.fix_img_style_size_tmulti,
-        images.fix_image_tables,
-        images.fix_col8_low_ppi,
-        images.add_class_to_infobox_wide_images,
-        images.remove_low_ppi,
-        images.remove_responsive_styles,
-        images.optimize_maps,
-        typography.fix_sizes,
-        typography.add_center_class,
-        typography.remove_p_padding,
-        lists.merge_single_element_lists,
-        lists.mark_inline,
-        blockquotes.remove_container,
-        special.fix_election_charts,
-        misc.clean,
-        sections.change_references_id_to_class,
-    ]:
-        filter_function(article.dom)
-    return
+def _profile_filter_tree(article, profile):
+    with profile.collecting():
+        for filter_function in article_filters:
+            profile.run(filter_function, article, lambda: article.dom)
+        with utils.indexed_classes(article.dom) as class_index:
+            features = Features(article.dom, class_index)
+            run_filters(article.dom, tree_filters, profile, features)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from mwlib.pdf.htmlfilters.engine import requires
 
 
 def only_bq_siblings(node):
@@ -12,6 +13,7 @@ def only_bq_siblings(node):
     return siblings
 
 
+@requires(tags=["blockquote"])
 def remove_container(root):
     for bq in root.xpath("//blockquote[not(ancestor::table)]"):
         while True:
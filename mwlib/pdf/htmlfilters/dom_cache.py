@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Persistent cache of filtered article DOMs
+
+Popular articles show up in many books. The filtered DOM of an article is
+stored under a key built from the source HTML, title and language of the
+article, the filter sources, config.py, the local images and the images removed
+for their license, so an article hits the cache in every book it shows up in.
+
+The parts of a filtered DOM that depend on the book are not part of the key:
+local image paths are stored as references to the image name, the image
+anchors written by the renderer as references to their position in the
+article. Both are resolved again and the article is numbered again with
+misc.set_article_position when an entry is loaded.
+"""
+
+import glob
+import os
+import re
+import zlib
+
+from mwlib.log import Log
+
+from mwlib.pdf import config, utils
+from mwlib.pdf._version import version
+from mwlib.pdf.cache import DiskCache, make_key
+from mwlib.pdf.htmlfilters import images, xpaths
+
+log = Log("mwlib.pdf.htmlfilters.dom_cache")
+
+image_ref_prefix = "pp-cache-image:"
+anchor_ref_prefix = "pp-cache-anchor:"
+anchor_regex = re.compile(r"^image_\d+_\d+$")  # see PrincePdfWriter._write_image_metadata
+
+_pipeline_version = None
+
+
+def pipeline_version():
+    """
+    Hash of the filter sources and utils.py, changes whenever a filter is modified
+    """
+    global _pipeline_version
+    if _pipeline_version is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        sources = [version]
+        filenames = sorted(glob.glob(os.path.join(directory, "*.py")))
+        filenames.append(os.path.join(os.path.dirname(directory), "utils.py"))
+        for fn in filenames:
+            with open(fn, "rb") as f:
+                sources.append(f.read())
+        _pipeline_version = make_key(*sources)
+    return _pipeline_version
+
+
+def config_values():
+    return sorted(
+        (name, value)
+        for name, value in vars(config).items()
+        if not name.startswith("_") and isinstance(value, (int, float, list, dict))
+    )
+
+
+def image_anchors(dom):
+    """
+    Names of the image anchors of an unfiltered DOM in document order
+    """
+    return [node.get("name") for node in dom.iter() if anchor_regex.match(node.get("name") or "")]
+
+
+class FilterCache(object):
+    def __init__(self, path, max_size):
+        """
+        :param path: cache directory
+        :param max_size: maximum cache size in bytes
+        """
+        self.cache = DiskCache(path, max_size)
+
+    def key(self, article):
+        """
+        Build the cache key of an article from its source HTML
+
+        Images are marked for removal by their license (see
+        PrincePdfWriter._write_image_metadata) before the key is built.
+        """
+        image_files, removed = [], set()
+        for img in xpaths.all_img(article.dom):
+            name = images.image_name(img.get("src"))
+            path = article.env.images.getDiskPath(name)
+            size = os.path.getsize(path) if path and os.path.exists(path) else None
+            image_files.append((name, size))
+            if "remove" in (img.get("class") or "").split():
+                removed.add(name)
+        return make_key(
+            pipeline_version(),
+            config_values(),
+            article.language,
+            article.title,
+            getattr(article, "caption", None),
+            image_files,
+            sorted(removed),
+            article.html,
+        )
+
+    def load(self, article, key, anchors):
+        """
+        Return the cached filtered DOM or None
+
+        :param anchors: image anchors of the unfiltered article, see image_anchors
+
+        Entries referring to images or math formulas that are missing on disk are discarded.
+        """
+        data = self.cache.get(key)
+        if data is None:
+            return None
+        dom = utils.parse_tree(zlib.decompress(data))
+        for node in dom.xpath("//*[starts-with(@name, '{}')]".format(anchor_ref_prefix)):
+            position = int(node.get("name")[len(anchor_ref_prefix) :])
+            if position >= len(anchors):
+                log.info("discarding cached article {}: missing image anchor".format(article.idx))
+                self.cache.discard(key)
+                return None
+            node.set("name", anchors[position])
+        image_files = {}
+        for img in dom.iter("img"):
+            src = img.get("src")
+            if not src:
+                continue
+            if src.startswith(image_ref_prefix):
+                name = src[len(image_ref_prefix) :]
+                src = article.env.images.getDiskPath(name)
+                image_files[src] = name
+                img.set("src", src or "")
+            if not src or not os.path.exists(src):
+                log.info("discarding cached article {}: missing {}".format(article.idx, src))
+                self.cache.discard(key)
+                return None
+        article.image_files = image_files
+        return dom
+
+    def store(self, article, key, anchors):
+        """
+        Store the filtered DOM of article
+
+        :param anchors: image anchors of the unfiltered article, see image_anchors
+        """
+        replaced = []
+        for img in article.dom.iter("img"):
+            name = article.image_files.get(img.get("src"))
+            if name is not None:
+                replaced.append((img, "src", img.get("src")))
+                img.set("src", image_ref_prefix + name)
+        positions = dict((name, position) for position, name in enumerate(anchors))
+        for node in article.dom.xpath("//*[@name]"):
+            position = positions.get(node.get("name"))
+            if position is not None:
+                replaced.append((node, "name", node.get("name")))
+                node.set("name", anchor_ref_prefix + str(position))
+        try:
+            data = utils.serialize_tree(article.dom)
+        finally:
+            for node, attr, value in replaced:
+                node.set(attr, value)
+        self.cache.set(key, zlib.compress(data))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Filter engine for the htmlfilters pipeline
+
+Tree filters are called with the root node of an article and usually start
+with a document wide XPath query. Filters that only need to look at single
+nodes can be declared as node filters instead: they register tag, class and
+attribute triggers and consecutive node filters of a pipeline share a single
+traversal of the tree.
+
+Filters can declare cheap preconditions with the requires decorator. A
+Features summary of the article is built once before the tree filters run and
+filters whose preconditions are absent are skipped.
+"""
+
+from lxml import etree
+from six import string_types
+
+# run skipped filters anyway and fail if they change the tree (for tests)
+verify_skipped = False
+
+
+class Requirements(object):
+    """
+    Preconditions of a filter
+
+    Each given group needs at least one match: a tag, a class substring (like
+    `contains(@class, ...)`) and a substring of a style attribute.
+    """
+
+    def __init__(self, tags=None, classes=None, styles=None):
+        self.tags = tuple(tags or ())
+        self.classes = tuple(classes or ())
+        self.styles = tuple(styles or ())
+
+    def satisfied(self, features):
+        if self.tags and not any(tag in features.tags for tag in self.tags):
+            return False
+        if self.classes and not any(features.has_class(cls) for cls in self.classes):
+            return False
+        return not self.styles or any(style in features.styles for style in self.styles)
+
+
+def requires(tags=None, classes=None, styles=None):
+    """
+    Decorator declaring the preconditions of a tree or node filter
+
+    Only declare tags and styles that no earlier filter creates: they are
+    collected once before the tree filters run. Classes are looked up in the
+    active class index (see utils.indexed_classes).
+    """
+
+    def decorator(filter_function):
+        filter_function.requires = Requirements(tags=tags, classes=classes, styles=styles)
+        return filter_function
+
+    return decorator
+
+
+class Features(object):
+    """
+    Tags and inline styles present in an article, collected in one pass
+    """
+
+    def __init__(self, root, class_index=None):
+        """
+        :param class_index: utils.ClassIndex of root, all classes are assumed present if None
+        """
+        tags = set()
+        styles = set()
+        for node in root.iter():
+            tags.add(node.tag)
+            style = node.get("style")
+            if style:
+                styles.add(style)
+        self.tags = tags
+        self.styles = "\n".join(styles)
+        self.class_index = class_index
+
+    def has_class(self, cls):
+        if self.class_index is None:
+            return True
+        return any(cls in token for token in self.class_index.nodes)
+
+
+def applicable(filter_function, features):
+    requirements = getattr(filter_function, "requires", None)
+    return features is None or requirements is None or requirements.satisfied(features)
+
+
+class NodeFilter(object):
+    """
+    Filter function applied to all nodes matching its triggers
+
+    A node filter must not add, remove or move elements and may only change
+    the node it is called with. It may read the structure of the tree but not
+    the attributes of other nodes. This guarantees that running several node
+    filters in one traversal yields the same result as running them one after
+    another.
+    """
+
+    def __init__(self, func, tags=None, classes=None, attributes=None, predicate=None):
+        """
+        :param func: function called with each matching node
+        :param tags: node tags to match, all tags if None
+        :param classes: class substrings (like `contains(@class, ...)`), one has to match
+        :param attributes: attribute names, one has to be present
+        :param predicate: additional check called with the node
+        """
+        self.func = func
+        self.tags = tuple(tags) if tags else None
+        self.classes = tuple(classes or ())
+        self.attributes = tuple(attributes or ())
+        self.predicate = predicate
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        self.__module__ = func.__module__
+
+    def __repr__(self):
+        return "<NodeFilter {}.{}>".format(self.__module__, self.__name__)
+
+    def matches(self, node):
+        if self.classes:
+            node_cls = node.get("class")
+            if not node_cls or not any(cls in node_cls for cls in self.classes):
+                return False
+        if self.attributes and not any(attr in node.attrib for attr in self.attributes):
+            return False
+        return self.predicate is None or self.predicate(node)
+
+    def __call__(self, root):
+        run_filters(root, [self])
+
+
+def node_filter(tags=None, classes=None, attributes=None, predicate=None):
+    """
+    Decorator turning a function operating on a single node into a NodeFilter
+
+    The decorated object can still be called with a root node like any other
+    tree filter.
+    """
+
+    def decorator(func):
+        return NodeFilter(
+            func, tags=tags, classes=classes, attributes=attributes, predicate=predicate
+        )
+
+    return decorator
+
+
+def iter_phases(filters):
+    """
+    Group consecutive node filters into lists, tree filters are yielded as is
+    """
+    phase = []
+    for filter_function in filters:
+        if isinstance(filter_function, NodeFilter):
+            phase.append(filter_function)
+            continue
+        if phase:
+            yield phase
+            phase = []
+        yield filter_function
+    if phase:
+        yield phase
+
+
+def run_phase(root, node_filters, profile=None):
+    """
+    Run node filters in a single traversal of the tree below root
+
+    Nodes are visited in document order, filters are applied in pipeline order.
+    """
+    if profile is not None:
+        profile.count_phase(node_filters)
+    wildcard = [f for f in node_filters if f.tags is None]
+    tags = set()
+    for f in node_filters:
+        tags.update(f.tags or ())
+    dispatch = dict(
+        (tag, [f for f in node_filters if f.tags is None or tag in f.tags]) for tag in tags
+    )
+    for node in root.iter(*([] if wildcard else sorted(tags))):
+        if not isinstance(node.tag, string_types):  # comments and processing instructions
+            continue
+        for f in dispatch.get(node.tag, wildcard):
+            if not f.matches(node):
+                continue
+            if profile is None:
+                f.func(node)
+            else:
+                profile.run_node(f, node)
+
+
+def skip(root, filter_function, profile=None):
+    """
+    Skip a filter whose preconditions are absent
+    """
+    if profile is not None:
+        profile.skip(filter_function)
+    if not verify_skipped:
+        return
+    before = etree.tostring(root)
+    run_filters(root, [filter_function])
+    if etree.tostring(root) != before:
+        raise AssertionError("skipped filter {!r} changed the tree".format(filter_function))
+
+
+def run_filters(root, filters, profile=None, features=None):
+    """
+    Apply tree and node filters to root, preserving their order
+
+    :param profile: optional profiling.ArticleProfile measuring each filter
+    :param features: optional Features of root, filters declaring absent preconditions are skipped
+    """
+    for phase in iter_phases(filters):
+        if isinstance(phase, list):
+            node_filters = []
+            for f in phase:
+                if applicable(f, features):
+                    node_filters.append(f)
+                else:
+                    skip(root, f, profile)
+            if node_filters:
+                run_phase(root, node_filters, profile)
+        elif not applicable(phase, features):
+            skip(root, phase, profile)
+        elif profile is None:
+            phase(root)
+        else:
+            profile.run(phase, root, lambda: root)
@@ -10,6 +10,8 @@ from lxml.builder import ElementMaker
 from mwlib.log import Log
 
 from mwlib.pdf import utils
+from mwlib.pdf.htmlfilters import xpaths
+from mwlib.pdf.htmlfilters.engine import node_filter, requires
 from mwlib.pdf.htmlfilters.sizetools import resize_node_width_to_columns
 from .. import config
 from ..config import column_width_pt
@@ -17,45 +19,63 @@ from ..config import column_width_pt
 log = Log("mwlib.pdf.html2pdf")
 E = ElementMaker()
 number_re = re.compile(r"^(\d+)")
+xpath_number_re = re.compile(r"^\s*-?(\d+(\.\d*)?|\.\d+)\s*$")
+
+max_inline_width = 50
+max_inline_height = 50
 
 
 valid_image_extensions = [".png", ".jpg", ".gif", ".svg", ".jpeg"]
 
 
+def image_name(src):
+    """
+    extract the image name from the src of an image
+    """
+    if os.path.splitext(src)[1] == ".gif":
+        img_name = src.split("/")[-1]
+    else:
+        img_name = src.split("/")[-2]
+    return urllib.unquote(img_name)
+
+
 def fix_image_src(article):
     """
     replace img src with path on local disc
     """
-    for img in article.dom.xpath("//img"):
-        src = img.get("src")
-        if os.path.splitext(src)[1] == ".gif":
-            img_name = src.split("/")[-1]
-        else:
-            img_name = src.split("/")[-2]
-        img_name = urllib.unquote(img_name)
+    for img in xpaths.all_img(article.dom):
+        img_name = image_name(img.get("src"))
         img_disk_path = article.env.images.getDiskPath(img_name)
         if img_disk_path and os.path.exists(img_disk_path):
             img.set("src", img_disk_path)
+            article.image_files[img_disk_path] = img_name
         else:
             img.set("src", "")
             log.debug("No local image source found for `{}`".format(img_name))
 
 
-def set_size_attributes(root):
+def _less_than(value, limit):
+    """
+    compare an attribute value like XPath does: non-numeric values never match
+    """
+    return value is not None and xpath_number_re.match(value) is not None and float(value) < limit
+
+
+@node_filter(tags=["img"])
+def set_size_attributes(img):
     """
     Set width and height attributes on image (deprecated)
     """
-    for img in root.xpath("//img"):
-        variants = ["width", "height"]
-        for variant in variants:
-            if img.get(variant) is None:
-                style = utils.get_node_style(img)
-                value = style.get(variant)
-                try:
-                    value = number_re.match(value).group(0)
-                except Exception:
-                    continue
-                img.set(variant, value)
+    variants = ["width", "height"]
+    for variant in variants:
+        if img.get(variant) is None:
+            style = utils.get_node_style(img)
+            value = style.get(variant)
+            try:
+                value = number_re.match(value).group(0)
+            except Exception:
+                continue
+            img.set(variant, value)
 
 
 def get_img_size(node):
@@ -94,22 +114,19 @@ def remove_missing(root):
     """
     remove missing images
     """
-    for img in root.xpath("//img"):
+    for img in xpaths.all_img(root):
         if not node_has_valid_image_src(img):
             img.getparent().remove(img)
 
 
-def strip_height(root):
-    for img in root.xpath("//img"):
-        if img.get("height"):
-            del img.attrib["height"]
+@node_filter(tags=["img"])
+def strip_height(img):
+    if img.get("height"):
+        del img.attrib["height"]
 
 
 def check_size(article):
-    for img in article.dom.xpath(
-        '//img[not(substring(@src, string-length(@src)-3) = ".svg"'
-        ' or substring(@src, string-length(@src)-3) = ".SVG")]'
-    ):
+    for img in xpaths.img_not_svg(article.dom):
         if not node_has_valid_image_src(img):
             continue
         path = img.get("src")
@@ -132,26 +149,26 @@ def tag_local_images(root, collection):
     input_image_path = collection.get("image_path")
     if input_image_path and os.path.exists(input_image_path):
         input_images = os.listdir(input_image_path)
-        for img in root.xpath("//img"):
+        for img in xpaths.all_img(root):
             file_name = str.split(img.get("_src", ""), "/")[-1]
             if file_name in input_images:
                 utils.append_class(img, "local-image")
 
 
-def scale_inline(root):
-    max_inline_width = 50
-    max_inline_height = 50
-    for img in root.xpath(
-        "//img[@width<{max_inline_width}][@height<{max_inline_height}]".format(**locals())
-    ):
-        w, h = get_img_size(img)
-        img.set("width", str(w / 2))
-        img.set("height", str(h / 2))
-        utils.append_class(img, "inline")
+@node_filter(
+    tags=["img"],
+    predicate=lambda img: _less_than(img.get("width"), max_inline_width)
+    and _less_than(img.get("height"), max_inline_height),
+)
+def scale_inline(img):
+    w, h = get_img_size(img)
+    img.set("width", str(w / 2))
+    img.set("height", str(h / 2))
+    utils.append_class(img, "inline")
 
 
 def limit_size(root):
-    for img in root.xpath('//img[not(contains(@class, "inline"))]'):
+    for img in xpaths.img_without_class(root, cls="inline"):
         w, h = get_img_size(img)
         if w == 0 or h == 0:
             continue
@@ -184,22 +201,23 @@ def limit_size(root):
                     utils.change_node_height(node, h * scale_factor, unit="px")
 
 
-def fix_thumbs(root):
+@node_filter(tags=["div"], classes=["thumbinner"])
+def fix_thumbs(div):
     """
     remove explit width in thumbinner div
     otherwise correct image sizing/positioning is not guaranteed
     """
-    for div in root.xpath('.//div[contains(@class, "thumbinner")]'):
-        utils.remove_node_width(div)
+    utils.remove_node_width(div)
 
 
+@requires(tags=["ul"], classes=["gallery"])
 def fix_galleries(root):
-    for gallery in root.xpath('.//ul[contains(@class, "gallery")]'):
-        for leaf in gallery.xpath(".//*"):
+    for gallery in xpaths.galleries(root):
+        for leaf in xpaths.desc_all(gallery):
             utils.remove_node_width(leaf)
             utils.remove_node_height(leaf)
             utils.remove_node_styles(leaf, "margin")
-        for leaf in gallery.xpath('.//li[contains(@class, "gallerybox")]'):
+        for leaf in xpaths.gallery_boxes(gallery):
             utils.append_class(leaf, "col-4")
             img = leaf[0][0][0][0][0]
             utils.append_class(img, "thumbimage")
@@ -207,27 +225,35 @@ def fix_galleries(root):
             utils.add_node_style(leaf[0][0][0], "background-image", "url({})".format(url))
 
 
-def mark_img_container(root):
+def _is_article_block(node):
+    """
+    node matches //article/div/*
+    """
+    parent = node.getparent()
+    if parent is None or parent.tag != "div":
+        return False
+    grandparent = parent.getparent()
+    return grandparent is not None and grandparent.tag == "article"
+
+
+@node_filter(tags=["div"], classes=["thumb "], predicate=_is_article_block)
+def mark_img_container(img_container):
     """https://de.wikipedia.org/wiki/Chaoyang_%28Shantou%29"""
-    for img_container in root.xpath('//article/div/*[self::div[contains(@class,"thumb ")]]'):
-        utils.append_class(img_container, "pp_figure")
+    utils.append_class(img_container, "pp_figure")
 
 
+@requires(styles=["relative"])
 def fix_abspos_overlays(root):
-    for container in root.xpath(
-        ('//*[contains(@style, "position")' ' and contains(@style, "relative")]')
-    ):
+    for container in xpaths.relative_containers(root):
         w = utils.get_node_width(container, target_unit="px")
         h = utils.get_node_height(container, target_unit="px")
         if not (w and h):
-            img = container.xpath(".//img")
+            img = xpaths.desc_img(container)
             if not img:
                 continue
             img = img[0]
             w, h = get_img_size(img)
-        for node in container.xpath(
-            ('.//*[contains(@style, "position")' ' and contains(@style, "absolute")]')
-        ):
+        for node in xpaths.desc_absolute(container):
             style = utils.get_node_style(node)
             left = style.get("left")
             top = style.get("top")
@@ -250,27 +276,28 @@ def fix_abspos_overlays(root):
                 utils.add_node_style(node, attr, "{}%".format(new_val))
 
 
-def fix_links_on_images(root):
-    for a in root.xpath("//a[img]"):
-        a.attrib["wiki_href"] = a.attrib.get("href")
-        del a.attrib["href"]
+@node_filter(tags=["a"], predicate=lambda a: a.find("img") is not None)
+def fix_links_on_images(a):
+    a.attrib["wiki_href"] = a.attrib.get("href")
+    del a.attrib["href"]
 
 
 def set_figure_div_size(root):
-    for figure_div in root.xpath("//div"):
+    for figure_div in xpaths.all_div(root):
         classes = figure_div.get("class", "").split(" ")
         if "thumb" not in classes:
             continue
-        img_width = figure_div.xpath(".//img/@width")
+        img_width = xpaths.desc_img_width(figure_div)
         if img_width:
             utils.add_node_style(figure_div, "width", img_width[0] + "px")
 
 
+@requires(classes=["thumb"])
 def move_caption_below_image(root):
     """
     move the caption behind / below the image
     """
-    for img_container in root.xpath('//article/div//*[self::div[contains(@class,"thumb ")]]'):
+    for img_container in xpaths.nested_thumbs(root):
         if img_container[0][0].get("class") == "thumbcaption":
             img_container[0].append(img_container[0][0])
 
@@ -279,24 +306,17 @@ def remove_img_style_size(root):
     """
     add class to img container and remove explicit width attributes
     """
-    xpath_conditions = [
-        'contains(@class,"thumb") ',
-        'and not(contains(@class, "tmulti"))',
-        'and not(contains(@class, "thumbinner"))',
-        'and not(contains(@class, "thumbcaption"))',
-        'and not(contains(@class, "thumbimage"))',
-    ]
-    result = root.xpath("//div[{}]".format(" ".join(xpath_conditions)))
-    for img_container in result:
+    for img_container in utils.find_class(root, "thumb", tag="div", exclude=["tmulti"]):
         if "map" in img_container.attrib.get("class", ""):
             continue
-        thumbinner = img_container.xpath('.//*[contains(@class,"thumbinner")]')
+        thumbinner = xpaths.desc_with_class(img_container, cls="thumbinner")
         for node in thumbinner:
             utils.remove_node_styles(node, ["width", "height", "max-width"])
-        if not img_container.xpath(".//img"):
+        imgs = xpaths.desc_img(img_container)
+        if not imgs:
             log.debug("No <img> found in {}".format(etree.tostring(img_container)))
             continue
-        img = img_container.xpath(".//img")[0]
+        img = imgs[0]
         width = utils.get_node_width(img, target_unit="pt")
         utils.remove_node_styles(img, ["width", "height"])
         cols = int(round(width / (column_width_pt * 4)))
@@ -312,73 +332,62 @@ def fix_img_style_size_tmulti(root):
     """
     replace explicit width attributes with col-* classes and percentages
     """
-    xpath_conditions = [
-        'contains(@class,"thumb") ',
-        'and contains(@class, "tmulti")',
-        'and not(contains(@class, "thumbinner"))',
-        'and not(contains(@class, "thumbcaption"))',
-        'and not(contains(@class, "thumbimage"))',
-    ]
-    result = root.xpath("//div[{}]".format(" ".join(xpath_conditions)))
-    for img_container in result:
-        thumbinner = img_container.xpath('.//*[contains(@class, "thumbinner")]')[0]
+    for img_container in utils.find_class(root, "tmulti", tag="div"):
+        if "thumb" not in img_container.get("class").split():
+            continue
+        thumbinner = xpaths.desc_with_class(img_container, cls="thumbinner")[0]
         total_width = utils.get_node_size(thumbinner, attr="max-width", target_unit="pt")
         utils.remove_node_styles(thumbinner, "max-width")
         resize_node_width_to_columns(img_container, total_width)
-        for tsingle in thumbinner.xpath('.//*[contains(@class, "tsingle")]'):
+        for tsingle in xpaths.desc_with_class(thumbinner, cls="tsingle"):
             width = _remove_inner_image_node_width(tsingle, inner_class="thumbimage")
             single_width = width / total_width * 100
             utils.add_node_style(tsingle, "width", "{}%".format(single_width))
 
 
+@requires(tags=["table"], classes=["short-table"])
 def fix_image_tables(root):
-    img_tables = root.xpath(
-        '//table[contains(@class, "short-table") and not(contains(@class, "infobox")) and .//a[contains(@class, "image")]]'
-    )
-    for table in img_tables:
+    for table in xpaths.image_tables(root):
         utils.remove_node_styles(table, "margin")
         utils.append_class(table, "image-table")
         max_widths = {}
-        for row in table.xpath(".//tr"):
-            for n, column in enumerate(row.xpath(".//td")):
-                for img in column.xpath(".//img"):
+        for row in xpaths.desc_tr(table):
+            for n, column in enumerate(xpaths.desc_td(row)):
+                for img in xpaths.desc_img(column):
                     width = utils.get_node_width(img, target_unit="px")
                     max_widths[n] = max(width, max_widths.get(n, 0))
         total_width = sum(max_widths.values())
         if total_width * config.px2pt > config.page_width_pt:
             utils.append_class(table, "wide-image-table")
-            for row in table.xpath(".//tr"):
-                for n, column in enumerate(row.xpath(".//td")):
+            for row in xpaths.desc_tr(table):
+                for n, column in enumerate(xpaths.desc_td(row)):
                     _remove_inner_image_node_width(column, "image")
                     utils.remove_node_styles(column, ["padding-left", "padding", "margin"])
                     utils.add_node_style(
                         column, "width", "{}%".format(max_widths.get(n, 0) / total_width * 100)
                     )
         elif total_width > 0:
-            for img in table.xpath(".//img"):
+            for img in xpaths.desc_img(table):
                 _resize_image_node_width_to_pt(img)
 
 
 def fix_col8_low_ppi(root):
-    xpath_conditions = [
-        'contains(@class, "thumb ")',
-        'and contains(@class, "col-8")',
-        'and //img[contains(@class, "low-ppi")]',
-    ]
-    result = root.xpath("//div[{}]".format(" ".join(xpath_conditions)))
-    for img_container in result:
+    if not utils.find_class(root, "low-ppi", tag="img"):
+        return
+    for img_container in utils.find_class(root, "col-8", tag="div"):
+        if "thumb" not in img_container.get("class").split():
+            continue
         img_container.attrib["class"] = img_container.attrib["class"].replace("col-8", "col-4")
+        utils.index_classes(img_container, deep=False)
 
 
-def remove_low_ppi(root):
-    result = root.xpath('//img[contains(@class, "low-ppi")]')
-    for img in result:
-        utils.remove_class(img, "low-ppi")
+@node_filter(tags=["img"], classes=["low-ppi"])
+def remove_low_ppi(img):
+    utils.remove_class(img, "low-ppi")
 
 
 def remove_responsive_styles(root):
-    result = root.xpath("//style")
-    for node in result:
+    for node in xpaths.all_style(root):
         if "@media" in node.text and "max-width" in node.text:
             utils.remove_node(node)
 
@@ -392,14 +401,15 @@ def _remove_inner_image_node_width(node, inner_class="thumbinner"):
     :return: original width of the image in pt
     """
     utils.remove_node_styles(node, ["width", "height", "max-width"])
-    wrapper_nodes = node.xpath('.//*[contains(@class,"{}")]'.format(inner_class))
+    wrapper_nodes = xpaths.desc_with_class(node, cls=inner_class)
     for wrapper_node in wrapper_nodes:
         utils.remove_node_styles(wrapper_node, ["width", "height", "max-width"])
-    if not node.xpath(".//img"):
+    imgs = xpaths.desc_img(node)
+    if not imgs:
         log.debug("No <img> found in {}. Removing node.".format(etree.tostring(node)))
         utils.remove_node(node)
         return 0
-    img = node.xpath(".//img")[0]
+    img = imgs[0]
     width = utils.get_node_width(img, target_unit="pt")
     utils.remove_node_styles(img, ["width", "height"])
     utils.remove_node_width(img)
@@ -423,18 +433,16 @@ def remove_images_with_class_remove(root):
     """
     images with incompatible licenses are tagged with class="remove"
     """
-    for img in root.xpath('//img[contains(@class, "remove")]'):
+    for img in utils.find_class(root, "remove", tag="img"):
         # case 1: the map in the table:
-        for ancestor in img.xpath(
-            './ancestor::div[@class="noviewer" and @style="position: relative;"]'
-        ):
+        for ancestor in xpaths.map_ancestors(img):
             utils.remove_node(ancestor.getnext())
             utils.remove_node(ancestor)
-        for ancestor in img.xpath('./ancestor::li[contains(@class, "gallerybox")]'):
+        for ancestor in xpaths.ancestor_gallerybox(img):
             utils.remove_node(ancestor)
-        for ancestor in img.xpath('./ancestor::div[contains(@class, "thumb")]'):
+        for ancestor in xpaths.ancestor_thumb(img):
             utils.remove_node(ancestor)
-        for ancestor in img.xpath("./ancestor::tr"):
+        for ancestor in xpaths.ancestor_tr(img):
             removal_is_safe = True
             for node in ancestor.iterdescendants():
                 if len(node.getchildren()) > 1:
@@ -445,22 +453,24 @@ def remove_images_with_class_remove(root):
             utils.remove_node(img)
 
 
+@requires(tags=["img"], classes=["infobox"])
 def add_class_to_infobox_wide_images(root):
     """
     add `infobox-wide` to images wider than 100px in an infobox and remove explicit width
     """
-    for node in root.xpath('//*[contains(@class, "infobox")]//img'):
+    for node in xpaths.infobox_img(root):
         if "width" in node.attrib and int(node.attrib.get("width")) > 100:
             utils.append_class(node, "infobox-img-wide")
             utils.remove_node_width(node)
             utils.remove_node_height(node)
-            for td in node.xpath("./ancestor::td"):
+            for td in xpaths.ancestor_td(node):
                 utils.append_class(td, "contains-img-wide")
         elif "width" in node.attrib and int(node.attrib.get("width")) <= 100:
             node.attrib["width"] = str(int(node.attrib["width"]) / config.px2pt)
 
 
+@requires(classes=["map"])
 def optimize_maps(root):
-    for node in root.xpath('//div[contains(@class, "map")]'):
-        for subnode in node.xpath('.//div[contains(@style, "border")]'):
+    for node in xpaths.div_with_class(root, cls="map"):
+        for subnode in xpaths.desc_bordered_div(node):
             utils.remove_node_styles(subnode, "border")
@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 
 from mwlib.pdf import utils
+from mwlib.pdf.htmlfilters import xpaths
+from mwlib.pdf.htmlfilters.engine import requires
 
 
+@requires(tags=["div"], classes=["infobox"])
 def clean_infobox_inner_width(root):
-    for node in root.xpath('//*[contains(@class, "infobox")]//div[contains(@style, "width")]'):
+    for node in xpaths.infobox_width_divs(root):
         if "width" in utils.get_node_style(node):
             utils.remove_node_styles(node, "width")
 
 
+@requires(classes=["infobox"])
 def clean_infobox_padding(root):
-    for node in root.xpath(
-        '//*[contains(@class, "infobox")]//*[(self::div or self::td or self::th) and @style]'
-    ):
+    for node in xpaths.infobox_padded_cells(root):
         if "padding" in node.attrib["style"]:
             utils.remove_node_styles(
                 node,
@@ -20,6 +22,7 @@ def clean_infobox_padding(root):
             )
 
 
+@requires(tags=["th"], classes=["infobox"])
 def clean_infobox_background_color(root):
-    for node in root.xpath('//*[contains(@class, "infobox")]//th[contains(@style, "background")]'):
+    for node in xpaths.infobox_background_th(root):
         utils.remove_node_styles(node, ["background-color", "background"])
@@ -1,14 +1,20 @@
 #!/usr/bin/env python
+from mwlib.pdf import utils
+from mwlib.pdf.htmlfilters.engine import node_filter, requires
 
 
-def mark_inline(root):
-    pred = "[not(ancestor::ul|ancestor::ol|ancestor::table)]"
-    lsts = root.xpath("//ul{pred}|//ol{pred}".format(pred=pred))
-    for lst in lsts:
-        cls = lst.get("class", "")
-        lst.set("class", "pp_compact_lst " + cls)
+def _is_top_level(lst):
+    return not any(node.tag in ("ul", "ol", "table") for node in lst.iterancestors())
 
 
+@node_filter(tags=["ul", "ol"], predicate=_is_top_level)
+def mark_inline(lst):
+    cls = lst.get("class", "")
+    lst.set("class", "pp_compact_lst " + cls)
+    utils.index_classes(lst, deep=False)
+
+
+@requires(tags=["ul", "ol"])
 def merge_single_element_lists(root):
     def next_mergeable(lst):
         nxt = lst.getnext()
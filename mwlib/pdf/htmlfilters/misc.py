@@ -12,6 +12,8 @@ from tinycss2 import color3
 
 from mwlib.pdf import utils
 from mwlib.pdf.generators.cover import get_article_count
+from mwlib.pdf.htmlfilters import xpaths
+from mwlib.pdf.htmlfilters.engine import node_filter, requires
 
 E = ElementMaker()
 
@@ -21,22 +23,49 @@ def parse(html_data):
 
 
 def add_article_title(article):
-    for node in article.dom.xpath("//article"):
+    for node in xpaths.all_article(article.dom):
         first_node = node.iterchildren().next()
         displaytitle = article.caption if hasattr(article, "caption") else article.title
         first_heading = E.h1(displaytitle)
         first_node.addprevious(first_heading)
         first_heading.append(hash_anchor(article.title))
 
-        article_count = get_article_count(article.env.metabook.items)
         footer = E.div(
             {"class": "footer"},
             E.span(displaytitle, {"class": "title"}),
-            E.span("Article {} of {}".format(article.idx, article_count), {"class": "counter"},),
+            E.span(_counter_text(article), {"class": "counter"},),
         )
         first_heading.addnext(footer)
 
 
+def _counter_text(article):
+    return "Article {} of {}".format(article.idx, get_article_count(article.env.metabook.items))
+
+
+def _position_attrs(article):
+    footer_text = _("{} | Article {} of {}").format(
+        article.title, article.idx, len(article.env.metabook.items)
+    )
+    return {
+        "data-pp-article-num": str(article.idx),
+        "id": "article{}".format(article.idx),
+        "data-pp-footer-text": footer_text,
+    }
+
+
+def set_article_position(article):
+    """
+    Write the position of the article in the book into a filtered DOM
+
+    filter_content and add_article_title number the article, filtered DOMs
+    loaded from the filter cache are numbered again with this function.
+    """
+    for node in xpaths.all_article(article.dom):
+        node.attrib.update(_position_attrs(article))
+    for node in article.dom.xpath('//div[@class="footer"]/span[@class="counter"]'):
+        node.text = _counter_text(article)
+
+
 def hash_anchor(title):
     anchor = E.A(
         {
@@ -66,82 +95,70 @@ def add_pagebreaks(root, article):
 
 # def filter_content(root, article_num=1, title=''):
 def filter_content(article):
-    content_filter = [
-        '//div[@id="mw-content-text"]',
-        '//div[@id="bodyContent"]',
-        "//body",
-        "//",
-    ]
-    for query in content_filter:
-        content = article.dom.xpath(query)
+    for query in xpaths.content_containers:
+        content = query(article.dom)
         if len(content) == 1:
             break
     assert len(content) == 1
-    footer_text = _("{} | Article {} of {}").format(
-        article.title, article.idx, len(article.env.metabook.items)
-    )
-    article_node = E.article(
-        {
-            "data-pp-article-num": str(article.idx),
-            "id": "article{}".format(article.idx),
-            "data-pp-footer-text": footer_text,
-            "class": "pp-chapter",
-        }
-    )
+    attrs = _position_attrs(article)
+    attrs["class"] = "pp-chapter"
+    article_node = E.article(attrs)
     for node in content[0].getchildren():
         article_node.append(node)
     article.dom = E.html(E.head(E.meta({"charset": "utf-8"})), E.body(article_node))
 
 
-def remove_nodes_and_content(root):
-    query_shorthands = {
-        "div": {
-            "@class": [
-                "magnify",
-                "rellink",
-                "printfooter",
-                "dablink",
-                "collapsed",
-                "NavFrame",
-                "mediaContainer",
-                "metadata",
-                "homonymie",
-                "loupe",
-                "bandeau",
-            ],
-            "@id": [
-                "siteSub",
-                "jump-to-nav",
-                "catlinks",
-                "normdaten",
-                "disambig",
-                "spoiler",  # https://sr.wikipedia.org/wiki/CY-208243
-            ],
-        },
-        "table": {
-            "@class": ["ambox", "metadata", "navbox", "navigatiesjabloon"],
-            "@id": ["disambigbox", "commonscat"],
-        },
-        "span": {"@class": ["mw-editsection"], "@id": ["coordinates"]},
-        "ul": {"@id": ["bandeau"], "@class": ["bandeau"]},
-        "*": {
-            "@class": [
-                "noprint",
-                "noexport",
-                "hatnote navigation-not-searchable",
-                "beginnetje",  # https://nl.wikipedia.org/wiki/Tafalisca_bogotensis
-                "UitklapFrame",  # https://nl.wikipedia.org/wiki/Stoodleigh
-                "navigation-only",  # https://fr.wikipedia.org/wiki/Villalval
-                "vedlikehold",  # https://no.wikipedia.org/wiki/Santa_Teresinha
-            ],
-            "@id": ["tpl_Coordinaten", "toc",],  # https://nl.wikipedia.org/wiki/Aldeyjarfoss
-        },
-    }
+removable_node_shorthands = {
+    "div": {
+        "@class": [
+            "magnify",
+            "rellink",
+            "printfooter",
+            "dablink",
+            "collapsed",
+            "NavFrame",
+            "mediaContainer",
+            "metadata",
+            "homonymie",
+            "loupe",
+            "bandeau",
+        ],
+        "@id": [
+            "siteSub",
+            "jump-to-nav",
+            "catlinks",
+            "normdaten",
+            "disambig",
+            "spoiler",  # https://sr.wikipedia.org/wiki/CY-208243
+        ],
+    },
+    "table": {
+        "@class": ["ambox", "metadata", "navbox", "navigatiesjabloon"],
+        "@id": ["disambigbox", "commonscat"],
+    },
+    "span": {"@class": ["mw-editsection"], "@id": ["coordinates"]},
+    "ul": {"@id": ["bandeau"], "@class": ["bandeau"]},
+    "*": {
+        "@class": [
+            "noprint",
+            "noexport",
+            "hatnote navigation-not-searchable",
+            "beginnetje",  # https://nl.wikipedia.org/wiki/Tafalisca_bogotensis
+            "UitklapFrame",  # https://nl.wikipedia.org/wiki/Stoodleigh
+            "navigation-only",  # https://fr.wikipedia.org/wiki/Villalval
+            "vedlikehold",  # https://no.wikipedia.org/wiki/Santa_Teresinha
+        ],
+        "@id": ["tpl_Coordinaten", "toc",],  # https://nl.wikipedia.org/wiki/Aldeyjarfoss
+    },
+}
+
+
+def _removable_nodes_query():
     queries = []
-    for node in query_shorthands:
+    for node in removable_node_shorthands:
         predicates = []
-        for attr in query_shorthands[node]:
-            for filter_attr_val in query_shorthands[node][attr]:
+        for attr in removable_node_shorthands[node]:
+            for filter_attr_val in removable_node_shorthands[node][attr]:
                 predicates.append('contains({attr}, "{filter_attr_val}")'.format(**locals()))
         queries.append("//{node}[{pred}]".format(node=node, pred=" or ".join(predicates)))
 
@@ -156,7 +173,14 @@ def remove_nodes_and_content(root):
             '//span[contains(@class, "haudio")]/parent::*',
         ]
     )
-    for node in root.xpath("|".join(queries)):
+    return "|".join(queries)
+
+
+removable_nodes = xpaths.query("removable_nodes", _removable_nodes_query())
+
+
+def remove_nodes_and_content(root):
+    for node in removable_nodes(root):
         utils.remove_node(node)
 
 
@@ -166,42 +190,45 @@ def strip_tags(root):
     etree.strip_tags(root, *tag_list)
 
 
+strippable_attributes = [
+    "cellpadding",
+    "cellspacing",
+    "align",
+    "size",
+    # https://uk.wikipedia.org/wiki/%D0%A1%D0%B0%D0%BD-%D0%91%D0%B0%D1%80%D1%82%D0%BE%D0%BB%D0%BE%D0%BC%D0%B5%D0%BE-%D0%92%D0%B0%D0%BB%D1%8C-%D0%9A%D0%B0%D0%B2%D0%B0%D1%80%D0%BD%D1%8C%D1%8F
+    "border",
+    "bgcolor",
+    # https://en.wikipedia.org/wiki/Archery_at_the_1988_Summer_Olympics_%E2%80%93_Women%27s_individual
+]
+strippable_nodes = xpaths.query(
+    "strippable_nodes", "//*[{}]".format("|".join(["@" + attr for attr in strippable_attributes]))
+)
+
+
 def strip_attributes(root):
-    attributes = [
-        "cellpadding",
-        "cellspacing",
-        "align",
-        "size",
-        # https://uk.wikipedia.org/wiki/%D0%A1%D0%B0%D0%BD-%D0%91%D0%B0%D1%80%D1%82%D0%BE%D0%BB%D0%BE%D0%BC%D0%B5%D0%BE-%D0%92%D0%B0%D0%BB%D1%8C-%D0%9A%D0%B0%D0%B2%D0%B0%D1%80%D0%BD%D1%8C%D1%8F
-        "border",
-        "bgcolor",
-        # https://en.wikipedia.org/wiki/Archery_at_the_1988_Summer_Olympics_%E2%80%93_Women%27s_individual
-    ]
-    xpath = "//*[{}]".format("|".join(["@" + attr for attr in attributes]))
-    for node in root.xpath(xpath):
-        for attr in attributes:
+    for node in strippable_nodes(root):
+        for attr in strippable_attributes:
             if attr in node.attrib:
                 del node.attrib[attr]
-    for node in root.xpath("//*[not(self::td or self::th)]/@style"):
+    for node in xpaths.styled_non_cells(root):
         if node.is_attribute:
             del node.getparent().attrib["style"]
 
 
-def transform_width_and_height_attributes_to_style(root):
-    attributes = ["width", "height"]
-    for node in root.xpath("//*[{}]".format("|".join("@" + attr for attr in attributes))):
-        for attr in attributes:
-            if attr in node.attrib:
-                value = node.get(attr)
-                del node.attrib[attr]
-                style = parseStyle(node.get("style"))
-                if attr not in style.keys():
-                    if value[-1:] == "%":
-                        style.setProperty(attr, value)
-                        node.attrib["style"] = ";".join([prop.cssText for prop in style])
-                    elif value != "":
-                        style.setProperty(attr, value + "px")
-                        node.attrib["style"] = ";".join([prop.cssText for prop in style])
+@node_filter(attributes=["width", "height"])
+def transform_width_and_height_attributes_to_style(node):
+    for attr in ["width", "height"]:
+        if attr in node.attrib:
+            value = node.get(attr)
+            del node.attrib[attr]
+            style = parseStyle(node.get("style"))
+            if attr not in style.keys():
+                if value[-1:] == "%":
+                    style.setProperty(attr, value)
+                    node.attrib["style"] = ";".join([prop.cssText for prop in style])
+                elif value != "":
+                    style.setProperty(attr, value + "px")
+                    node.attrib["style"] = ";".join([prop.cssText for prop in style])
 
 
 def strip_style_properties_except_width_and_height(root):
@@ -214,7 +241,7 @@ def strip_style_properties_except_width_and_height(root):
     """
     scale_factor = 2 / 3.0
     unit = "pt"
-    for node in root.xpath("//*[@style]"):
+    for node in xpaths.all_styled(root):
         old_style = parseStyle(node.get("style"))
         new_style = CSSStyleDeclaration()
         for p in old_style.getProperties("width", "height"):
@@ -234,11 +261,11 @@ def grey_from_style_frag(frag):
 
 
 def convert_grayscale(root):
-    for attr in ["color", "bgcolor"]:
-        for node in root.xpath("//*[@{}]".format(attr)):
+    for attr, query in [("color", xpaths.all_colored), ("bgcolor", xpaths.all_bgcolored)]:
+        for node in query(root):
             node.set(attr, grey_from_style_frag(node.get(attr)))
 
-    for node in root.xpath("//*[@style]"):
+    for node in xpaths.all_styled(root):
         new_style = []
         for style_frag in node.get("style", "").split(";"):
             if not style_frag.strip():
@@ -286,24 +313,30 @@ def add_soft_hyphens(root):
     map(handle_node_txt, root.iterdescendants())
 
 
-def remove_styles(root):
-    styles = [
-        "-moz-column-count",  # https://de.wikipedia.org/wiki/Decatur_County_%28Indiana%29
-        "column-count",  # https://de.wikipedia.org/wiki/Decatur_County_%28Indiana%29
-        "font",
-        "font-size",
-        "padding",  # https://en.wikipedia.org/wiki/A%26M_Records,_Inc._v._Napster,_Inc.
-    ]
+removable_styles = [
+    "-moz-column-count",  # https://de.wikipedia.org/wiki/Decatur_County_%28Indiana%29
+    "column-count",  # https://de.wikipedia.org/wiki/Decatur_County_%28Indiana%29
+    "font",
+    "font-size",
+    "padding",  # https://en.wikipedia.org/wiki/A%26M_Records,_Inc._v._Napster,_Inc.
+]
+nodes_with_removable_styles = xpaths.query(
+    "nodes_with_removable_styles",
+    "//*[{}]".format(
+        " or ".join(['contains(@style, "{}")'.format(style) for style in removable_styles])
+    ),
+)
 
-    _remove_styles = lambda node: utils.remove_node_styles(node, styles)
 
-    predicate = " or ".join(['contains(@style, "{}")'.format(style) for style in styles])
-    map(_remove_styles, root.xpath("//*[{}]".format(predicate)))
+def remove_styles(root):
+    _remove_styles = lambda node: utils.remove_node_styles(node, removable_styles)
+
+    map(_remove_styles, nodes_with_removable_styles(root))
 
 
-def clean(root):
-    for node in root.xpath("//*[@_src]"):
-        del node.attrib["_src"]
+@node_filter(attributes=["_src"])
+def clean(node):
+    del node.attrib["_src"]
 
 
 def remove_container(root):
@@ -311,13 +344,9 @@ def remove_container(root):
         return node.getnext() is not None or node.getprevious() is not None
 
     removable_container = ["div"]
-    tags = [
-        "ul",
-        "ol",  # https://en.wikipedia.org/wiki/A-List_%28Conservative%29
-        "table",  # https://en.wikipedia.org/wiki/Calosoma_striatius
-    ]
-
-    for node in root.xpath("|".join("//{}".format(tag) for tag in tags)):
+    # candidates: ul, ol (https://en.wikipedia.org/wiki/A-List_%28Conservative%29)
+    # and table (https://en.wikipedia.org/wiki/Calosoma_striatius)
+    for node in xpaths.container_candidates(root):
         if has_siblings(node):
             continue
         check_node = node
@@ -334,7 +363,7 @@ def remove_container(root):
 
 
 def _combine_references(root):
-    ref_nodes = root.xpath('//p[@class="pp_figure_ref"]')
+    ref_nodes = xpaths.figure_refs(root)
     groups = []
     group = []
     for node in ref_nodes:
@@ -363,27 +392,32 @@ def _combine_references(root):
             utils.remove_node(node)
 
 
+figure_classes = [
+    "pp_singlecol",
+    # 'infobox',  # infoboxes are not referenced despite floating
+    "pp_figure",
+    "pp_twocol_span",
+]
+figures = xpaths.query(
+    "figures",
+    ".//*[{}]".format(" or ".join('contains(@class, "{}")'.format(cls) for cls in figure_classes)),
+)
+
+
 def add_figure_numbers(root):
-    classes = [
-        "pp_singlecol",
-        # 'infobox',  # infoboxes are not referenced despite floating
-        "pp_figure",
-        "pp_twocol_span",
-    ]
-    pred = " or ".join('contains(@class, "{}")'.format(cls) for cls in classes)
     total_figures = 0
-    for article in root.xpath("//article"):
+    for article in xpaths.all_article(root):
         figure_num = 0
-        for node in article.xpath(".//*[{}]".format(pred)):
+        for node in figures(article):
             utils.remove_class(node, "infobox")
             figure_num += 1
             total_figures += 1
-            cls = [c for c in classes if c in node.get("class")][0]
+            cls = [c for c in figure_classes if c in node.get("class")][0]
             nr = ".".join([article.get("pp_article_num"), str(figure_num)])
             caption_txt = "Figure {nr} ".format(nr=nr)
             reference = E.p({"class": "pp_figure_ref"}, u"\u21AA " + caption_txt)
             if cls == "pp_figure":
-                caption = node.xpath('.//*[contains(@class, "thumbcaption")]')
+                caption = xpaths.desc_with_class(node, cls="thumbcaption")
                 if caption:
                     node.addnext(reference)
                     caption = caption[0]
@@ -440,20 +474,17 @@ def apply_article_options(root, options=""):
         utils.append_class(article, "nodisplay")
 
 
+@requires(tags=["i"], classes=["thumbcaption"])
 def remove_figure_colon(root):
-    for node in root.xpath(
-        '//div[@class="thumbcaption"]/i[position()=1 and following-sibling::text()[starts-with(self::text(), ":") and position()=1]]'
-    ):
+    for node in xpaths.figure_colons(root):
         node.tail = ""
 
 
 def rebuild_footnotes(root):
-    for node in root.xpath('//sup[@class="reference"]'):
+    for node in xpaths.reference_sups(root):
         p = re.compile(r"cite_ref-([A-Za-z0-9]+)_([0-9])-0")
         ref_id = p.sub(r"cite_note-\1-\2", node.get("id"))
-        ref_nodes = root.xpath(
-            '//ol[@class="references"]/li[@id="{}"]/span[@class="reference-text"]'.format(ref_id)
-        )
+        ref_nodes = xpaths.reference_texts(root, ref_id=ref_id)
         if len(ref_nodes) == 0:
             continue
         footnote = ref_nodes[0]
@@ -467,27 +498,19 @@ def rebuild_footnotes(root):
         if parent.text:
             parent.text = parent.text.rstrip()
 
-    for node in root.xpath('//ol[@class="references"]'):
+    for node in xpaths.reference_lists(root):
         utils.remove_node(node.getprevious())
         utils.remove_node(node)
 
 
-def rewrite_links(root):
-    for node in root.xpath("//a"):
-        if node.get("href") and node.get("title"):
-            link = "#article_{}".format(hashlib.md5(node.get("title").encode("utf-8")).hexdigest())
-            node.set("href", link)
+@node_filter(tags=["a"])
+def rewrite_links(node):
+    if node.get("href") and node.get("title"):
+        link = "#article_{}".format(hashlib.md5(node.get("title").encode("utf-8")).hexdigest())
+        node.set("href", link)
 
 
+@requires(classes=["thumb"], styles=["absolute"])
 def markup_maps(root):
-    target_node = "//div[{}]"
-    conditions = [
-        'contains(@class, "thumb")',
-        'not(contains(@class, "thumbinner"))',
-        'not(contains(@class, "thumbcaption"))',
-        'not(contains(@class, "thumbimage"))',
-        './/div[contains(@style, "relative") and .//div[contains(@style, "absolute")]]',
-    ]
-    '//div[@class="mw-parser-output"]//div[contains(@style, "relative") and .//div[contains(@style, "absolute")]]'
-    for node in root.xpath(target_node.format(" and ".join(conditions))):
+    for node in xpaths.maps(root):
         utils.append_class(node, "map")
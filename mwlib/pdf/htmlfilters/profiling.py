@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Opt-in profiling of the filter pipeline
+
+A BookProfile is created per rendered book. Articles are sampled at the
+configured rate: filter_tree measures every filter run on a sampled article
+(wall time, CPU time, nodes matched and the change in the number of nodes)
+and counts the filters skipped because their preconditions are absent.
+Articles that are not sampled run through the unchanged pipeline.
+"""
+
+import json
+import random
+import resource
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from mwlib.log import Log
+
+from mwlib.pdf.htmlfilters import xpaths
+
+log = Log("mwlib.pdf.htmlfilters.profiling")
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def count_nodes(root):
+    return sum(1 for _ in root.iter())
+
+
+def xpath_results():
+    return sum(results for _, _, results in xpaths.stats.values())
+
+
+def filter_name(filter_function):
+    return "{}.{}".format(filter_function.__module__.rsplit(".", 1)[-1], filter_function.__name__)
+
+
+def _empty_record():
+    return OrderedDict(
+        [
+            ("calls", 0),
+            ("wall", 0.0),
+            ("cpu", 0.0),
+            ("matched", 0),
+            ("nodes_delta", 0),
+            ("skipped", 0),
+        ]
+    )
+
+
+def _add(record, other):
+    for key, value in other.items():
+        record[key] += value
+
+
+class ArticleProfile(object):
+    """
+    Measurements for the filters run on a single article
+    """
+
+    def __init__(self, article):
+        self.title = article.title
+        self.idx = article.idx
+        self.filters = OrderedDict()
+        self.nodes = 0
+
+    def record(self, name, wall, cpu, matched=0, nodes_delta=0, calls=1, skipped=0):
+        record = self.filters.setdefault(name, _empty_record())
+        _add(
+            record,
+            dict(
+                calls=calls,
+                wall=wall,
+                cpu=cpu,
+                matched=matched,
+                nodes_delta=nodes_delta,
+                skipped=skipped,
+            ),
+        )
+
+    @contextmanager
+    def collecting(self):
+        """
+        Enable XPath statistics while the article is filtered
+        """
+        collect_stats = xpaths.collect_stats
+        xpaths.collect_stats = True
+        try:
+            yield self
+        finally:
+            xpaths.collect_stats = collect_stats
+
+    def run(self, filter_function, arg, get_root):
+        """
+        Call filter_function(arg) and record its cost
+
+        :param get_root: returns the current root, article filters may replace it
+        """
+        nodes, matched = count_nodes(get_root()), xpath_results()
+        wall, cpu = time.time(), cpu_time()
+        filter_function(arg)
+        wall, cpu = time.time() - wall, cpu_time() - cpu
+        self.nodes = count_nodes(get_root())
+        self.record(
+            filter_name(filter_function),
+            wall,
+            cpu,
+            matched=xpath_results() - matched,
+            nodes_delta=self.nodes - nodes,
+        )
+
+    def run_node(self, node_filter, node):
+        """
+        Call a node filter for a single node, node filters don't add or remove nodes
+        """
+        wall, cpu = time.time(), cpu_time()
+        node_filter.func(node)
+        self.record(
+            filter_name(node_filter), time.time() - wall, cpu_time() - cpu, matched=1, calls=0
+        )
+
+    def merge(self, other):
+        """
+        Add the measurements of other, e.g. returned from a filter worker
+        """
+        for name, record in other.filters.items():
+            self.record(name, **record)
+        self.nodes = other.nodes
+
+    def skip(self, filter_function):
+        self.record(filter_name(filter_function), 0.0, 0.0, calls=0, skipped=1)
+
+    def skipped(self):
+        return sum(r["skipped"] for r in self.filters.values())
+
+    def count_phase(self, node_filters):
+        for node_filter in node_filters:
+            self.record(filter_name(node_filter), 0.0, 0.0)
+
+    def to_dict(self):
+        return OrderedDict(
+            [
+                ("title", self.title),
+                ("idx", self.idx),
+                ("nodes", self.nodes),
+                ("wall", sum(r["wall"] for r in self.filters.values())),
+                ("cpu", sum(r["cpu"] for r in self.filters.values())),
+                ("skipped", self.skipped()),
+                ("filters", self.filters),
+            ]
+        )
+
+
+class BookProfile(object):
+    """
+    Sample articles of a book and aggregate their filter measurements
+    """
+
+    def __init__(self, sample_rate=1.0, seed=None):
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.articles_total = 0
+        self.articles = []
+
+    def article_profile(self, article):
+        """
+        Return an ArticleProfile if the article is sampled, None otherwise
+        """
+        self.articles_total += 1
+        if self.random.random() >= self.sample_rate:
+            return None
+        profile = ArticleProfile(article)
+        self.articles.append(profile)
+        return profile
+
+    def filters(self):
+        total = OrderedDict()
+        for article in self.articles:
+            for name, record in article.filters.items():
+                _add(total.setdefault(name, _empty_record()), record)
+        return total
+
+    def to_dict(self):
+        return OrderedDict(
+            [
+                ("sample_rate", self.sample_rate),
+                ("articles_total", self.articles_total),
+                ("articles_profiled", len(self.articles)),
+                ("filters_skipped", sum(article.skipped() for article in self.articles)),
+                ("filters", self.filters()),
+                ("articles", [article.to_dict() for article in self.articles]),
+            ]
+        )
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        slowest = sorted(self.filters().items(), key=lambda item: item[1]["wall"], reverse=True)
+        for name, record in slowest[:5]:
+            log.info(
+                "filter {}: {:.4f}s wall, {:.4f}s cpu".format(name, record["wall"], record["cpu"])
+            )
+        log.info(
+            "skipped {} filter runs in {} articles".format(
+                sum(article.skipped() for article in self.articles), len(self.articles)
+            )
+        )
+        log.info("wrote filter profile {}".format(filename))
@@ -4,6 +4,7 @@
 from math import ceil
 
 from mwlib.pdf import utils
+from mwlib.pdf.htmlfilters import xpaths
 from .. import config
 
 
@@ -28,7 +29,7 @@ def remove_node_size_attrs(root):
     :param root: xpath node
     :return:
     """
-    for node in root.xpath("//*[@box_width or @box_height]"):
+    for node in xpaths.sized_nodes(root):
         for attr in ["box_width", "box_height", "box_width_cm", "box_height_cm"]:
             if node.attrib.get(attr):
                 del node.attrib[attr]
@@ -132,7 +133,7 @@ def handle_wide(root, debug=False):
     """
     reg_width = config.reg_width
     ext_width = config.ext_width
-    for node in root.xpath("//article/div/* | //table"):
+    for node in xpaths.wide_candidates(root):
         if node.get("class") == "firstHeading":
             del node.attrib["id"]
         width, height = node_size(node)
@@ -141,6 +142,16 @@ def handle_wide(root, debug=False):
         handle_table_width(node, width)
 
 
+def measured_nodes(root):
+    """
+    nodes whose sizes are used after measuring: the resizable tables and their descendants
+    - fix_nested_widths widens a table to its widest descendant
+    """
+    for table in xpaths.resizable_tables(root):
+        for node in table.iter():
+            yield node
+
+
 def fix_nested_widths(root):
     """
     apply width to parent nodes
@@ -166,19 +177,14 @@ def limit_widths(root):
 
 
 def resize_tables(root):
-    conditions = [
-        'not(contains(@class, "infobox"))',
-        'not(contains(@class, "pullquote"))',
-        "not(ancestor::table)",
-    ]
-    for node in root.xpath("//table[{}]".format(" and ".join(conditions))):
+    for node in xpaths.resizable_tables(root):
         resize_node_width_to_columns(
             node, float(node.attrib.get("box_width")), use_thirds_only=False
         )
 
 
 def remove_node_widths(root):
-    for node in root.xpath("//table|//div|//td|//th"):
+    for node in xpaths.width_nodes(root):
         styles = node.get("style")
         if node.get("width"):
             del node.attrib["width"]
@@ -192,7 +198,7 @@ def remove_node_widths(root):
 
 
 def handle_col_floats(root):
-    for node in root.xpath('//*[contains(@class, "infobox")]'):
+    for node in xpaths.any_with_class(root, cls="infobox"):
         w, h = node_size(node)
         if h < config.min_float_height or (
             h < 2 * config.min_float_height and node_is_floatable(node, w, h)
@@ -225,7 +231,7 @@ def resize_overwide_tables(root):
     """
     scale node to regular width (using CSS transform)
     """
-    for node in root.xpath('//table[contains(@class, "over-wide")]'):
+    for node in xpaths.table_with_class(root, cls="over-wide"):
         width = float(node.attrib.get("box_width"))
         wrapper = node.getparent()
         utils.add_node_style(wrapper, "transform-origin", "0 0")
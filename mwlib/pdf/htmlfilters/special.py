@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from mwlib.pdf import utils
+from mwlib.pdf.htmlfilters.engine import requires
 
 
 # https://en.wikipedia.org/wiki/A.D._Baucau
@@ -37,6 +38,7 @@ def remove_soccer_kits(root):
 
 
 # https://de.wikipedia.org/wiki/Wiesbaden#Stadtverordnetenversammlung
+@requires(classes=["float-right"], styles=["relative"])
 def fix_election_charts(root):
     for node in root.xpath('//div[@class="float-right"]/div[contains(@style, "relative;")]/div'):
         styles = utils.get_node_style(node)
@@ -7,6 +7,8 @@ from lxml import etree
 from lxml.builder import ElementMaker
 
 from mwlib.pdf import utils
+from mwlib.pdf.htmlfilters import xpaths
+from mwlib.pdf.htmlfilters.engine import node_filter, requires
 from .. import config
 
 E = ElementMaker()
@@ -15,7 +17,7 @@ E = ElementMaker()
 def _get_header_row(root):
     header = {}
     col_idx = 0
-    for node in root.xpath(".//tr[1]/th"):
+    for node in xpaths.header_cells(root):
         node.tag = "b"
         header[col_idx] = node
         col_idx += int(node.get("colspan", "1"))
@@ -28,11 +30,11 @@ def remove_multicolumn(root):
     mergable_content = ["ul", "ol"]
     allowed_tags = set(mergable_content + ["div"])
     heading_tags = set(config.h_tags(2, 6))
-    for table in root.xpath("//table[not(.//table) and not(ancestor::table)]"):
+    for table in xpaths.leaf_tables(root):
         # all content must either be: 1) a heading 2) no tag 3) allowed tag
         # a mix of different allowed tags is prohibited!
         content_tags = set(
-            [node.tag for node in table.xpath(".//td/*") if node.tag not in heading_tags]
+            [node.tag for node in xpaths.cell_children(table) if node.tag not in heading_tags]
         )
         if len(content_tags) != 1 or content_tags.pop() not in allowed_tags:
             continue
@@ -40,22 +42,21 @@ def remove_multicolumn(root):
         # make sure that table headers are only present in "headers rows"
         # and not in one column
         horizontal_headers = True
-        for row in table.xpath(".//tr[.//th]"):
+        for row in xpaths.header_rows(table):
             if any(node.tag != "th" for node in row.iterchildren()):
                 horizontal_headers = False
                 break
         if not horizontal_headers:
             continue
 
-        num_cols = len(table.xpath(".//tr/td"))
+        num_cols = len(xpaths.row_cells(table))
         content = []
         for col_idx in range(1, num_cols + 1):
-            for cell in table.xpath(
-                ".//tr/th[position()={0}]|.//tr/td[position()={0}]".format(col_idx)
-            ):
+            for cell in xpaths.column_cells(table, col=col_idx):
                 if cell.tag == "th":
                     header = deepcopy(cell)
                     header.tag = "b"
+                    utils.index_classes(header)
                     content.append(header)
                     continue
                 for node in cell:
@@ -75,27 +76,30 @@ def remove_multicolumn(root):
 
 
 def remove_explicit_multicolumn(root):
-    for multicoltable in root.xpath('//table[contains(@class, "multicol")]'):
-        for cell_content in multicoltable.xpath("./tbody/tr/td/*|./tr/td"):
+    for multicoltable in utils.find_class(root, "multicol", tag="table"):
+        for cell_content in xpaths.multicol_cells(multicoltable):
             for node in reversed(cell_content):
                 multicoltable.addnext(node)
         multicoltable.getparent().remove(multicoltable)
 
 
-def remove_infobox_divs(root):
-    for div in root.xpath('//div[contains(@class,"infobox")]'):
-        for attr in div.keys():
-            del div.attrib[attr]
-        div.set("class", "infobox")
+@requires(tags=["div"], classes=["infobox"])
+@node_filter(tags=["div"], classes=["infobox"])
+def remove_infobox_divs(div):
+    for attr in div.keys():
+        del div.attrib[attr]
+    div.set("class", "infobox")
+    utils.index_classes(div, deep=False)
 
 
+@requires(classes=["infobox"])
 def add_infobox_wrapper(root):
-    for infobox in root.xpath('//*[contains(@class,"infobox")]'):
+    for infobox in xpaths.any_with_class(root, cls="infobox"):
         utils.wrap_node(infobox, "div", dict({"class": "infobox-wrapper"}))
 
 
 def identify_infoboxes(root):
-    for table in root.xpath('//table[not(contains(@class, "infobox"))]'):
+    for table in xpaths.table_without_class(root, cls="infobox"):
         if any("infobox" in val.lower() for val in table.values()):
             utils.append_class(table, "infobox")
 
@@ -103,12 +107,7 @@ def identify_infoboxes(root):
     # tables less than 3 siblings away from article start are considered infoboxes
     # if they are wrapped in container nodes, the containers are stripped if
     # no siblings are present - otherwise the table is *not* marked as an infobox
-    path = (
-        '//h1[@class="firstHeading"]/'
-        "following-sibling::*[position()<3]/"
-        'descendant-or-self::table[not(contains(@class, "infobox"))]'
-    )
-    for table in root.xpath(path):
+    for table in xpaths.leading_tables(root):
         ancestors = [node for node in table.iterancestors() if (node.tag != "article")]
         if any(len(node.getchildren()) != 1 for node in ancestors):
             continue
@@ -119,11 +118,11 @@ def identify_infoboxes(root):
 
 
 def mark_table_header(root):
-    for table in root.xpath("//table"):  # //table[not(descendant::node()[@rowspan>2])]
+    for table in xpaths.all_table(root):  # //table[not(descendant::node()[@rowspan>2])]
         thead = None
         tags = [node.tag for node in table.iterchildren()]
         if "tbody" in tags:
-            start_node = table.xpath("./tbody")[0]
+            start_node = xpaths.child_tbody(table)[0]
         else:
             start_node = table
         for row in start_node.iterchildren():
@@ -143,8 +142,8 @@ def mark_table_header(root):
 
 def improve_table_breaks(root):
     # https://de.wikipedia.org/wiki/Suzy_Batkovic-Brown
-    for table in root.xpath('//table[not(ancestor::table) and not(contains(@class, "infobox"))]'):
-        rows = table.xpath("./tr|./thead/tr|./tbody/tr")
+    for table in xpaths.top_level_tables(root):
+        rows = xpaths.table_rows(table)
         for idx in range(min(len(rows), config.table_no_break_max_lines)):
             utils.append_class(rows[idx], "pp_nobreak_after")
             utils.append_class(rows[-1 * (idx + 1)], "pp_nobreak_before")
@@ -153,8 +152,8 @@ def improve_table_breaks(root):
 # FIXME : we are loosing content here:
 # the text property of the cell needs to be copied as well
 def remove_single_cell_tables(root):
-    for table in root.xpath("//table"):
-        rows = table.xpath("./tr|./thead/tr|./tbody/tr|./tfoot/tr")
+    for table in xpaths.all_table(root):
+        rows = xpaths.all_table_rows(table)
         if len(rows) == 1:
             cells = rows[0].getchildren()
             if len(cells) == 1:
@@ -163,19 +162,19 @@ def remove_single_cell_tables(root):
                 table.getparent().remove(table)
 
 
-def remove_style_sizes(root):
-    for table in root.xpath("//table[@style]"):
-        utils.remove_node_styles(table, ["width", "height"])
-        utils.remove_node_width(table)
-        if table.attrib.get("border"):
-            del table.attrib["border"]
-            utils.append_class(table, "pp_border_table")
+@node_filter(tags=["table"], attributes=["style"])
+def remove_style_sizes(table):
+    utils.remove_node_styles(table, ["width", "height"])
+    utils.remove_node_width(table)
+    if table.attrib.get("border"):
+        del table.attrib["border"]
+        utils.append_class(table, "pp_border_table")
 
 
-def remove_styles_in_floats(root):
-    for table in root.xpath('//table[contains(@class, "table_noCSS")]'):
-        if table.attrib.get("style"):
-            del table.attrib["style"]
+@node_filter(tags=["table"], classes=["table_noCSS"])
+def remove_styles_in_floats(table):
+    if table.attrib.get("style"):
+        del table.attrib["style"]
 
 
 def bold_tablenote_marker(root):
@@ -184,12 +183,7 @@ def bold_tablenote_marker(root):
     :param root:
     :return:
     """
-    xpaths = [
-        '//div[@class="pp-table"]/p[not(@class="pp-table-caption")]',
-        '//p[@class="tablenote-details"]',
-        '//p[@class="tablenote-details"]/br[following-sibling::text()]',
-    ]
-    for p in root.xpath("|".join(xpaths)):
+    for p in xpaths.tablenotes(root):
         if p.tag == "br":
             if p.tail is not None and re.match(r"^\[[0-9a-z]+\]", p.tail.strip()):
                 tablenote = p.tail.strip()
@@ -207,26 +201,27 @@ def bold_tablenote_marker(root):
             for n in p.getchildren():
                 node.append(n)
             p.getparent().replace(p, node)
+            utils.index_classes(node, deep=False)
 
 
-def markup_short_tables(root):
-    for my_table in root.xpath("//table"):
-        if 0 < len(my_table.xpath("descendant::tr")) < 20:
-            utils.append_class(my_table, "short-table")
+@node_filter(tags=["table"])
+def markup_short_tables(my_table):
+    if 0 < len(xpaths.desc_tr(my_table)) < 20:
+        utils.append_class(my_table, "short-table")
 
 
-def remove_pullquote_margin_styles(root):
-    for table in root.xpath('//table[contains(@class, "pullquote")]'):
-        utils.remove_node_styles(table, "margin")
+@node_filter(tags=["table"], classes=["pullquote"])
+def remove_pullquote_margin_styles(table):
+    utils.remove_node_styles(table, "margin")
 
 
-def markup_floated_tables(root):
-    for my_table in root.xpath("//table"):
-        styles = utils.get_node_style(my_table)
-        if "float" in styles and styles["float"] == "right":
-            utils.append_class(my_table, "right-floated-table")
+@node_filter(tags=["table"])
+def markup_floated_tables(my_table):
+    styles = utils.get_node_style(my_table)
+    if "float" in styles and styles["float"] == "right":
+        utils.append_class(my_table, "right-floated-table")
 
 
-def remove_styles(root):
-    for my_table in root.xpath("//table"):
-        utils.remove_node_styles(my_table, ["margin-left", "text-align"])
+@node_filter(tags=["table"])
+def remove_styles(my_table):
+    utils.remove_node_styles(my_table, ["margin-left", "text-align"])
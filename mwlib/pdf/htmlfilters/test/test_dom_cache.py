@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+import gettext
+import os
+import shutil
+
+from mock import MagicMock
+
+from mwlib.pdf import utils
+from mwlib.pdf.collection import Article
+from mwlib.pdf.htmlfilters import misc
+from mwlib.pdf.htmlfilters.dom_cache import FilterCache
+
+extra = os.path.join(os.path.dirname(os.path.realpath(__file__)), "extra")
+
+html = """
+<html><body><div id="mw-content-text">
+    <p style="padding: 2px">Some text</p>
+    <div class="thumb tright"><div class="thumbinner" style="width:222px;">
+        <a href="./File:Bayon.jpg" class="image"><img src="./Bayon_Angkor_Relief1.jpg/220px" width="220" height="165"/></a>
+        <div class="thumbcaption">Relief</div>
+    </div></div>
+</div></body></html>
+"""
+
+
+def _article(image_dir, idx=1, items=(1, 2), anchor="image_1_1"):
+    gettext.NullTranslations().install(unicode=True)
+    env = MagicMock()
+    env.metabook.items = list(items)
+    env.images.getDiskPath = lambda name: os.path.join(image_dir, name)
+    article = Article(title=u"Test", html=html, idx=idx, env=env)
+    article.dom = misc.parse(article.html)
+    article.dom.find(".//img").getparent().set("name", anchor)  # see _write_image_metadata
+    return article
+
+
+def test_filter_cache(tmpdir):
+    image_dir = str(tmpdir.mkdir("images"))
+    shutil.copy(os.path.join(extra, "Bayon_Angkor_Relief1.jpg"), image_dir)
+    filter_cache = FilterCache(str(tmpdir.join("cache")), 1024 * 1024)
+
+    plain = _article(image_dir)
+    plain.parse()
+    expected = utils.tree_to_string(plain.dom)
+
+    first = _article(image_dir)
+    first.filter_cache = filter_cache
+    first.parse()
+    assert first.cache_hit is False
+    assert utils.tree_to_string(first.dom) == expected
+
+    # images are resolved again when an entry is loaded
+    other_dir = str(tmpdir.mkdir("other"))
+    shutil.copy(os.path.join(extra, "Bayon_Angkor_Relief1.jpg"), other_dir)
+    second = _article(other_dir)
+    second.filter_cache = filter_cache
+    second.parse()
+    assert second.cache_hit is True
+    assert utils.tree_to_string(second.dom) == expected.replace(image_dir, other_dir)
+    assert second.image_files == {
+        os.path.join(other_dir, "Bayon_Angkor_Relief1.jpg"): "Bayon_Angkor_Relief1.jpg"
+    }
+    assert filter_cache.cache.hits == 1
+
+    # the same article hits at another position in another book
+    plain = _article(image_dir, idx=3, items=range(5), anchor="image_7_2")
+    plain.parse()
+    third = _article(image_dir, idx=3, items=range(5), anchor="image_7_2")
+    third.filter_cache = filter_cache
+    third.parse()
+    assert third.cache_hit is True
+    assert utils.tree_to_string(third.dom) == utils.tree_to_string(plain.dom)
+    assert 'name="image_7_2"' in utils.tree_to_string(third.dom)
+    assert "Article 3 of 5" in utils.tree_to_string(third.dom)
+
+    # images removed for their license are part of the key
+    removed = _article(image_dir)
+    removed.dom.find(".//img").set("class", "remove")  # see _write_image_metadata
+    removed.filter_cache = filter_cache
+    removed.parse()
+    assert removed.cache_hit is False
+
+
+def test_disk_cache_eviction(tmpdir):
+    filter_cache = FilterCache(str(tmpdir), 250)
+    cache = filter_cache.cache
+    cache.set("a" * 40, b"x" * 100)
+    cache.set("b" * 40, b"x" * 100)
+    os.utime(cache._filename("a" * 40), (0, 0))
+    assert cache.get("b" * 40) is not None
+    cache.set("c" * 40, b"x" * 100)
+    assert cache.get("a" * 40) is None
+    assert cache.get("b" * 40) is not None
+    assert (cache.hits, cache.misses) == (2, 1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+import gettext
+import os
+from contextlib import contextmanager
+
+import mock
+from lxml import etree
+
+from mwlib.pdf import utils
+from mwlib.pdf.collection import Article
+from mwlib.pdf.htmlfilters import engine, images, misc, tables, typography
+from mwlib.pdf.htmlfilters.engine import node_filter
+
+snippet = """
+<html><body><article><div>
+    <table style="width: 100px; float: right; margin-left: 2px" border="1">
+        <tr><td><img src="a.png" style="width: 20px; height: 10px"/></td></tr>
+    </table>
+    <!-- comment -->
+    <div class="thumb tright"><div class="thumbinner" style="width: 102px"></div></div>
+    <p style="padding: 2px; font-size: small">text</p>
+    <table class="pullquote" style="margin: 1em"><tr><td>quote</td></tr></table>
+</div></article></body></html>
+"""
+
+
+def test_node_filter_triggers():
+    visited = []
+
+    @node_filter(tags=["div"], classes=["thumb"], attributes=["style"])
+    def visit(node):
+        visited.append(node.get("class"))
+
+    visit(etree.fromstring(snippet))
+    assert visited == ["thumbinner"]
+
+
+def test_iter_phases():
+    filters = [
+        tables.remove_style_sizes,
+        tables.remove_styles_in_floats,
+        tables.mark_table_header,
+        images.set_size_attributes,
+    ]
+    phases = list(engine.iter_phases(filters))
+    assert phases == [
+        [tables.remove_style_sizes, tables.remove_styles_in_floats],
+        tables.mark_table_header,
+        [images.set_size_attributes],
+    ]
+
+
+def test_fused_filters_match_sequential_run():
+    filters = [
+        tables.remove_style_sizes,
+        tables.markup_short_tables,
+        images.set_size_attributes,
+        images.strip_height,
+        tables.remove_pullquote_margin_styles,
+        tables.markup_floated_tables,
+        tables.remove_styles,
+        images.fix_thumbs,
+        images.mark_img_container,
+        typography.fix_sizes,
+        typography.remove_p_padding,
+    ]
+    sequential = etree.fromstring(snippet)
+    for filter_function in filters:
+        filter_function(sequential)
+    fused = etree.fromstring(snippet)
+    engine.run_filters(fused, filters)
+    assert etree.tostring(fused) == etree.tostring(sequential)
+    assert "pp_figure" in fused.xpath("//div")[1].get("class")
+
+
+def _parse_fixture(name):
+    """
+    Filter the article in the fixture file extra/name
+    """
+    extra = os.path.join(os.path.dirname(os.path.realpath(__file__)), "extra")
+    env = mock.MagicMock()
+    env.metabook.items = [1, 2]
+    env.images.getDiskPath.return_value = None
+    with open(os.path.join(extra, name)) as f:
+        article = Article(title=u"Test", html=f.read(), env=env)
+    article.dom = misc.parse(article.html)
+    article.parse()
+    return article
+
+
+def test_class_index_follows_filters():
+    gettext.NullTranslations().install(unicode=True)
+    unindexed = []
+    indexed_classes = utils.indexed_classes
+
+    @contextmanager
+    def checked_index(root):
+        with indexed_classes(root) as index:
+            yield index
+            unindexed.extend(index.unindexed())
+
+    with mock.patch.object(utils, "indexed_classes", checked_index):
+        for name in [
+            "test_fix_galleries.html",
+            "test_markup_header.html",
+            "test_fix_election_diagram.html",
+        ]:
+            _parse_fixture(name)
+    assert unindexed == []
+
+
+def test_requirements():
+    root = etree.fromstring(snippet)
+    with utils.indexed_classes(root) as class_index:
+        features = engine.Features(root, class_index)
+        assert engine.Requirements(tags=["table"], classes=["thumb"]).satisfied(features)
+        assert engine.Requirements(classes=["inner"], styles=["float"]).satisfied(features)
+        assert not engine.Requirements(tags=["table"], classes=["gallery"]).satisfied(features)
+        assert not engine.Requirements(tags=["math", "blockquote"]).satisfied(features)
+        assert not engine.Requirements(styles=["relative"]).satisfied(features)
+    assert engine.Requirements(classes=["gallery"]).satisfied(engine.Features(root))
+
+
+def test_skipped_filters_dont_change_tree():
+    gettext.NullTranslations().install(unicode=True)
+    with mock.patch.object(engine, "verify_skipped", True):
+        for name in [
+            "test_fix_galleries.html",
+            "test_fix_links_on_images.html",
+            "test_fix_election_diagram.html",
+        ]:
+            _parse_fixture(name)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+import gettext
+import json
+
+from mock import MagicMock
+
+from mwlib.pdf import utils
+from mwlib.pdf.collection import Article
+from mwlib.pdf.htmlfilters import misc, profiling, xpaths
+
+html = """
+<html><body><div id="mw-content-text">
+    <p style="padding: 2px">Some text <a href="./Other">link</a></p>
+    <table border="1"><tr><td>1</td><td>2</td></tr></table>
+    <!-- comment -->
+</div></body></html>
+"""
+
+
+def _article(idx=1):
+    gettext.NullTranslations().install(unicode=True)
+    env = MagicMock()
+    env.metabook.items = [1]
+    article = Article(title=u"Test", html=html, idx=idx, env=env)
+    article.dom = misc.parse(article.html)
+    return article
+
+
+def test_profiled_filter_tree(tmpdir):
+    plain = _article()
+    plain.parse()
+
+    book = profiling.BookProfile(sample_rate=1.0)
+    profiled = _article()
+    profiled.profile = book.article_profile(profiled)
+    profiled.parse()
+    assert utils.tree_to_string(profiled.dom) == utils.tree_to_string(plain.dom)
+    assert not xpaths.collect_stats
+
+    filters = book.filters()
+    assert filters["misc.filter_content"]["calls"] == 1
+    assert filters["misc.remove_nodes_and_content"]["nodes_delta"] == -1  # the comment
+    assert filters["misc.rewrite_links"]["matched"] == 1
+    assert filters["typography.remove_p_padding"]["matched"] == 1
+    assert filters["images.fix_galleries"]["skipped"] == 1
+    assert filters["images.fix_galleries"]["calls"] == 0
+
+    filename = str(tmpdir.join("filter_profile.json"))
+    book.write(filename)
+    with open(filename) as f:
+        data = json.load(f)
+    assert data["articles_profiled"] == 1
+    assert data["filters_skipped"] == data["articles"][0]["skipped"] > 0
+    assert data["articles"][0]["title"] == "Test"
+
+
+def test_sample_rate():
+    book = profiling.BookProfile(sample_rate=0.0)
+    assert book.article_profile(_article()) is None
+    assert book.articles_total == 1
+    assert book.to_dict()["filters"] == {}
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+import hashlib
+import os
+
+import mock
+from lxml import etree
+
+from mwlib.pdf.htmlfilters import tex
+
+formulas_html = """<div>
+<p><img class="tex" alt="a^2"/></p>
+<p><img class="mwe-math-fallback-image-inline" alt="b^2"/><img class="tex" alt="a^2"/></p>
+</div>"""
+
+
+def test_collecting_formulas(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    root = etree.fromstring(formulas_html)
+    formulas = {}
+    with mock.patch.object(tex, "render_formula") as render_formula:
+        with tex.collecting_formulas(formulas):
+            tex.transform2svg(root)
+        assert not render_formula.called
+    keys = [hashlib.md5(tex.clean_tex(src)).hexdigest() for src in ("a^2", "b^2")]
+    assert sorted(formulas) == sorted(keys)
+    assert [img.get("src") for img in root.iter("img")] == [
+        os.path.join("math_formulas", key + ".svg") for key in (keys[0], keys[1], keys[0])
+    ]
+
+    with mock.patch.object(tex, "render_formula") as render_formula:
+        tex.transform2svg(etree.fromstring(formulas_html))
+        assert render_formula.call_count == 3  # the mock writes no svg files
+
+
+def test_math_renderer(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    renderer = tex.MathRenderer(2)
+    with mock.patch.object(tex, "render_formula") as render_formula:
+        render_formula.side_effect = [None, OSError("xelatex not found"), None]
+        renderer.submit({"a": "a^2", "b": "b^2"})
+        renderer.submit({"b": "b^2", "c": "c^2"})
+        renderer.submit(None)
+        renderer.wait()
+    rendered = sorted(args[:2] for args, _ in render_formula.call_args_list)
+    assert rendered == [("a", "a^2"), ("b", "b^2"), ("c", "c^2")]
+    math_dirs = set(args[2] for args, _ in render_formula.call_args_list)
+    assert math_dirs == set([os.path.join(str(tmpdir), "math_formulas")])
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+import pytest
+from lxml import etree
+
+from mwlib.pdf.htmlfilters import xpaths
+
+snippet = """
+<html><body><article>
+    <div class="thumb tright"><div class="thumbinner"><img src="a.png"/></div></div>
+    <table><tr><td>1</td><td>2</td></tr><tr><td>3</td><td>4</td></tr></table>
+</article></body></html>
+"""
+
+
+def test_query_variables():
+    root = etree.fromstring(snippet)
+    assert len(xpaths.div_with_class(root, cls="thumb")) == 2
+    assert len(xpaths.div_with_class(root, cls="thumbinner")) == 1
+    table = xpaths.all_table(root)[0]
+    assert [td.text for td in xpaths.column_cells(table, col=2)] == ["2", "4"]
+
+
+def test_duplicate_query_name():
+    with pytest.raises(ValueError):
+        xpaths.query("all_img", "//img")
+
+
+def test_stats():
+    root = etree.fromstring(snippet)
+    xpaths.reset_stats()
+    xpaths.collect_stats = True
+    try:
+        xpaths.all_img(root)
+        xpaths.all_img(root)
+        xpaths.desc_td(root)
+    finally:
+        xpaths.collect_stats = False
+    report = dict((name, (calls, results)) for name, calls, _, results in xpaths.report())
+    assert report == {"all_img": (2, 2), "desc_td": (1, 4)}
+    xpaths.reset_stats()
@@ -1,20 +1,25 @@
 #!/usr/bin/env python
 
 import hashlib
+import multiprocessing.pool
 import os
 import re
 import shutil
 import subprocess
 import tempfile
+from contextlib import contextmanager
 
 from PIL import Image
 from lxml import etree
 from mwlib.log import Log
 
-from mwlib.pdf import utils
+from mwlib.pdf import procstats, utils
+from mwlib.pdf.htmlfilters.engine import node_filter, requires
 
 log = Log("mwlib.pdf.html2pdf")
 
+math_classes = ("tex", "mwe-math-fallback-image-inline")  # classes of the formula images
+
 
 def clean_tex(tex_src):
     tex_src = tex_src.lstrip().encode("utf-8")  # mwlib
@@ -31,7 +36,7 @@ def clean_math_source(self, node):
     cmd = ["texvc_tex", source.encode("utf-8")]
 
     try:
-        sub = subprocess.Popen(
+        sub = procstats.Popen(
             cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE
         )
     except OSError:
@@ -72,7 +77,7 @@ def math_img_size(node):
 def transform2mathml(root):
     for math_node, tex_src in iter_math(root):
         cmd = ["blahtex", "--texvc-compatible-commands", "--mathml"]
-        p = subprocess.Popen(
+        p = procstats.Popen(
             cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE
         )
 
@@ -93,70 +98,144 @@ def transform2mathml(root):
         math_node.getparent().replace(math_node, math_ml)
 
 
-def transform2svg(root):
-    math_form_dir = os.path.join(os.getcwd(), "math_formulas")
-    if not os.path.exists(math_form_dir):
-        os.makedirs(math_form_dir)
-    cur_dir = os.getcwd()
-    for math_node, tex_src in iter_math(root):
-        tex_src = tex_src.replace(r"\definecolor{bggrey}{RGB}{234,234,234}\pagecolor{bggrey}", "")
-        tex_src = tex_src.replace(r"\definecolor{bgblue}{RGB}{65,193,232}\pagecolor{bgblue}", "")
-
-        for ancestor in math_node.iterancestors():
-            if ancestor.tag == "th":
-                tex_src = r"\color{white}" + tex_src
-
-        fn = hashlib.md5(tex_src).hexdigest()
-
-        # exit if file exists
-        if not os.path.isfile(os.path.join(math_form_dir, fn + ".svg")):
-            tex_doc = "\n".join(
-                [
-                    r"\nonstopmode",
-                    r"\documentclass{article}",
-                    r"\usepackage{cancel}",
-                    r"\usepackage{amsmath}",
-                    r"\usepackage{color}" r"\usepackage{amssymb}",
-                    r"\usepackage{amsthm}",
-                    r"\pagestyle{empty}",
-                    r"\begin{document}",
-                    r"\begin{math}",
-                    r"{}".format(tex_src),
-                    r"\end{math}",
-                    r"\end{document}",
-                ]
-            )
-
-            tempdir = tempfile.mkdtemp()
-            os.chdir(tempdir)
-            with open(os.path.join(tempdir, fn + ".tex"), "w") as f:
-                f.write(tex_doc)
-            p = subprocess.Popen(
-                ["xelatex", "-interaction", "batchmode", "-no-pdf", fn + ".tex"],
+def math_dir():
+    return os.path.join(os.getcwd(), "math_formulas")
+
+
+def render_formula(fn, tex_src, math_form_dir):
+    """
+    Render a formula to math_form_dir/fn.svg with xelatex and dvisvgm
+    """
+    tex_doc = "\n".join(
+        [
+            r"\nonstopmode",
+            r"\documentclass{article}",
+            r"\usepackage{cancel}",
+            r"\usepackage{amsmath}",
+            r"\usepackage{color}" r"\usepackage{amssymb}",
+            r"\usepackage{amsthm}",
+            r"\pagestyle{empty}",
+            r"\begin{document}",
+            r"\begin{math}",
+            r"{}".format(tex_src),
+            r"\end{math}",
+            r"\end{document}",
+        ]
+    )
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tempdir, fn + ".tex"), "w") as f:
+            f.write(tex_doc)
+        p = procstats.Popen(
+            ["xelatex", "-interaction", "batchmode", "-no-pdf", fn + ".tex"],
+            stdout=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=tempdir,
+        )
+        (result, error) = p.communicate()
+        if not error:
+            p = procstats.Popen(
+                ["dvisvgm", "--exact", "--no-fonts", fn + ".xdv"],
                 stdout=subprocess.PIPE,
                 stdin=subprocess.PIPE,
                 stderr=subprocess.PIPE,
+                cwd=tempdir,
             )
             (result, error) = p.communicate()
-            if not error:
-                p = subprocess.Popen(
-                    ["dvisvgm", "--exact", "--no-fonts", fn + ".xdv"],
-                    stdout=subprocess.PIPE,
-                    stdin=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
+            svg_fn = fn + ".svg"
+            shutil.move(os.path.join(tempdir, svg_fn), os.path.join(math_form_dir, svg_fn))
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+
+_formulas = None  # fn -> tex source of the formulas collected by transform2svg
+
+
+@contextmanager
+def collecting_formulas(formulas):
+    """
+    Collect the formulas of transform2svg in formulas instead of rendering them
+
+    The src of the formulas is set anyway, the files have to be rendered with
+    MathRenderer before the book is rendered. Formulas are rendered right away
+    if formulas is None.
+    """
+    global _formulas
+    _formulas = formulas
+    try:
+        yield formulas
+    finally:
+        _formulas = None
+
+
+class MathRenderer(object):
+    """
+    Render the formulas collected from all articles of a book on a pool of threads
+
+    Every formula is rendered once, the threads wait for xelatex and dvisvgm
+    processes.
+    """
+
+    def __init__(self, workers):
+        self.pool = multiprocessing.pool.ThreadPool(workers)
+        self.results = {}  # fn -> AsyncResult
+
+    def submit(self, formulas):
+        math_form_dir = math_dir()
+        for fn, tex_src in (formulas or {}).items():
+            if fn not in self.results:
+                self.results[fn] = self.pool.apply_async(
+                    render_formula, (fn, tex_src, math_form_dir)
                 )
-                (result, error) = p.communicate()
-                shutil.move(fn + ".svg", math_form_dir)
-            os.chdir(cur_dir)
-            if os.path.isdir(tempdir):
-                shutil.rmtree(tempdir)
 
-        math_file = os.path.relpath(os.path.join(math_form_dir, fn + ".svg"))
-        if os.name == "nt":
-            math_file = math_file.replace("\\", "/")
-        math_node.set("src", math_file)
+    def wait(self):
+        """
+        Wait until all formulas are rendered
+        """
+        self.pool.close()
+        try:
+            for fn, result in self.results.items():
+                try:
+                    result.get()
+                except (IOError, OSError, shutil.Error) as exc:
+                    log.error("rendering formula {} failed: {}".format(fn, exc))
+        finally:
+            self.pool.join()
+        log.info("rendered {} formulas".format(len(self.results)))
+
+
+@requires(tags=["img"], classes=list(math_classes))
+@node_filter(tags=["img"], predicate=lambda img: img.get("class") in math_classes)
+def transform2svg(math_node):
+    math_form_dir = math_dir()
+    if not os.path.exists(math_form_dir):
+        os.makedirs(math_form_dir)
+    tex_src = extract_tex(math_node)
+    tex_src = tex_src.replace(r"\definecolor{bggrey}{RGB}{234,234,234}\pagecolor{bggrey}", "")
+    tex_src = tex_src.replace(r"\definecolor{bgblue}{RGB}{65,193,232}\pagecolor{bgblue}", "")
+
+    for ancestor in math_node.iterancestors():
+        if ancestor.tag == "th":
+            tex_src = r"\color{white}" + tex_src
+
+    fn = hashlib.md5(tex_src).hexdigest()
+
+    # exit if file exists
+    if not os.path.isfile(os.path.join(math_form_dir, fn + ".svg")):
+        if _formulas is not None:
+            _formulas[fn] = tex_src
+        else:
+            render_formula(fn, tex_src, math_form_dir)
+
+    math_file = os.path.relpath(os.path.join(math_form_dir, fn + ".svg"))
+    if os.name == "nt":
+        math_file = math_file.replace("\\", "/")
+    math_node.set("src", math_file)
 
 
+@requires(tags=["math"])
 def remove_mathml(root):
     results = root.xpath("//math")
     for node in results:
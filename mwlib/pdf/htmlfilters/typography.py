@@ -1,21 +1,24 @@
 #!/usr/bin/env python
 from mwlib.pdf import utils
-
+from mwlib.pdf.htmlfilters.engine import node_filter
 
 # http://www.mediaevent.de/css/font-size.html
-def fix_sizes(root):
-    font_sizes = [
-        ("xx-small", 3.0 / 5),
-        ("x-small", 3.0 / 4),
-        ("small", 8.0 / 9),
-        ("medium", 1),
-        ("large", 6.0 / 5),
-        ("x-large", 3.0 / 2),
-        ("xx-large", 2.0 / 1),
-    ]
+font_sizes = [
+    ("xx-small", 3.0 / 5),
+    ("x-small", 3.0 / 4),
+    ("small", 8.0 / 9),
+    ("medium", 1),
+    ("large", 6.0 / 5),
+    ("x-large", 3.0 / 2),
+    ("xx-large", 2.0 / 1),
+]
+
+
+@node_filter(predicate=lambda node: "font-size: " in node.get("style", ""))
+def fix_sizes(node):
     for size_name, size_factor in font_sizes:
-        for node in root.xpath('//*[contains(@style, "font-size: {}")]'.format(size_name)):
-            style = node.get("style")
+        style = node.get("style")
+        if "font-size: {}".format(size_name) in style:
             node.set(
                 "style",
                 style.replace(
@@ -24,11 +27,11 @@ def fix_sizes(root):
             )
 
 
-def add_center_class(root):
-    for node in root.xpath('//div[contains(@style, "text-align:center")]'):
-        utils.append_class(node, "center")
+@node_filter(tags=["div"], predicate=lambda node: "text-align:center" in node.get("style", ""))
+def add_center_class(node):
+    utils.append_class(node, "center")
 
 
-def remove_p_padding(root):
-    for node in root.xpath('//p[contains(@style, "padding")]'):
-        utils.remove_node_styles(node, "padding")
+@node_filter(tags=["p"], predicate=lambda node: "padding" in node.get("style", ""))
+def remove_p_padding(node):
+    utils.remove_node_styles(node, "padding")
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Precompiled XPath queries used by the htmlfilters
+
+All queries are compiled once at import time. Values that used to be
+formatted into the query string are passed as XPath variables instead:
+
+    xpaths.div_with_class(root, cls="thumbinner")
+"""
+
+import time
+from collections import OrderedDict
+
+from lxml import etree
+from mwlib.log import Log
+
+log = Log("mwlib.pdf.htmlfilters.xpaths")
+
+registry = OrderedDict()
+stats = OrderedDict()
+collect_stats = False
+
+
+class Query(object):
+    """
+    Named, precompiled XPath query
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.xpath = etree.XPath(path)
+
+    def __repr__(self):
+        return "<Query {}: {}>".format(self.name, self.path)
+
+    def __call__(self, node, **variables):
+        if not collect_stats:
+            return self.xpath(node, **variables)
+        start = time.time()
+        result = self.xpath(node, **variables)
+        record = stats.setdefault(self.name, [0, 0.0, 0])
+        record[0] += 1
+        record[1] += time.time() - start
+        record[2] += len(result) if isinstance(result, list) else 1
+        return result
+
+
+def query(name, path):
+    """
+    Compile and register a query
+    """
+    if name in registry:
+        raise ValueError("XPath query {} is already registered".format(name))
+    registry[name] = Query(name, path)
+    return registry[name]
+
+
+def reset_stats():
+    stats.clear()
+
+
+def report():
+    """
+    Debug helper: list (name, calls, total time, results) sorted by total time
+    """
+    rows = [(name, calls, seconds, results) for name, (calls, seconds, results) in stats.items()]
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def log_report():
+    for name, calls, seconds, results in report():
+        log.info(
+            "xpath {}: {} calls, {:.4f}s, {} results ({})".format(
+                name, calls, seconds, results, registry[name].path
+            )
+        )
+
+
+# generic queries
+all_img = query("all_img", "//img")
+all_div = query("all_div", "//div")
+all_table = query("all_table", "//table")
+all_article = query("all_article", "//article")
+all_style = query("all_style", "//style")
+all_styled = query("all_styled", "//*[@style]")
+desc_all = query("desc_all", ".//*")
+desc_img = query("desc_img", ".//img")
+desc_tr = query("desc_tr", ".//tr")
+desc_td = query("desc_td", ".//td")
+desc_with_class = query("desc_with_class", ".//*[contains(@class, $cls)]")
+any_with_class = query("any_with_class", "//*[contains(@class, $cls)]")
+div_with_class = query("div_with_class", "//div[contains(@class, $cls)]")
+img_without_class = query("img_without_class", "//img[not(contains(@class, $cls))]")
+table_with_class = query("table_with_class", "//table[contains(@class, $cls)]")
+table_without_class = query("table_without_class", "//table[not(contains(@class, $cls))]")
+ancestor_td = query("ancestor_td", "./ancestor::td")
+ancestor_tr = query("ancestor_tr", "./ancestor::tr")
+
+# images
+img_not_svg = query(
+    "img_not_svg",
+    '//img[not(substring(@src, string-length(@src)-3) = ".svg"'
+    ' or substring(@src, string-length(@src)-3) = ".SVG")]',
+)
+galleries = query("galleries", './/ul[contains(@class, "gallery")]')
+gallery_boxes = query("gallery_boxes", './/li[contains(@class, "gallerybox")]')
+relative_containers = query(
+    "relative_containers", '//*[contains(@style, "position") and contains(@style, "relative")]'
+)
+desc_absolute = query(
+    "desc_absolute", './/*[contains(@style, "position") and contains(@style, "absolute")]'
+)
+desc_img_width = query("desc_img_width", ".//img/@width")
+nested_thumbs = query("nested_thumbs", '//article/div//*[self::div[contains(@class,"thumb ")]]')
+image_tables = query(
+    "image_tables",
+    '//table[contains(@class, "short-table") and not(contains(@class, "infobox"))'
+    ' and .//a[contains(@class, "image")]]',
+)
+map_ancestors = query(
+    "map_ancestors", './ancestor::div[@class="noviewer" and @style="position: relative;"]'
+)
+ancestor_gallerybox = query("ancestor_gallerybox", './ancestor::li[contains(@class, "gallerybox")]')
+ancestor_thumb = query("ancestor_thumb", './ancestor::div[contains(@class, "thumb")]')
+infobox_img = query("infobox_img", '//*[contains(@class, "infobox")]//img')
+desc_bordered_div = query("desc_bordered_div", './/div[contains(@style, "border")]')
+
+# tables
+header_cells = query("header_cells", ".//tr[1]/th")
+leaf_tables = query("leaf_tables", "//table[not(.//table) and not(ancestor::table)]")
+cell_children = query("cell_children", ".//td/*")
+header_rows = query("header_rows", ".//tr[.//th]")
+row_cells = query("row_cells", ".//tr/td")
+column_cells = query("column_cells", ".//tr/th[position()=$col]|.//tr/td[position()=$col]")
+multicol_cells = query("multicol_cells", "./tbody/tr/td/*|./tr/td")
+leading_tables = query(
+    "leading_tables",
+    '//h1[@class="firstHeading"]/'
+    "following-sibling::*[position()<3]/"
+    'descendant-or-self::table[not(contains(@class, "infobox"))]',
+)
+child_tbody = query("child_tbody", "./tbody")
+top_level_tables = query(
+    "top_level_tables", '//table[not(ancestor::table) and not(contains(@class, "infobox"))]'
+)
+table_rows = query("table_rows", "./tr|./thead/tr|./tbody/tr")
+all_table_rows = query("all_table_rows", "./tr|./thead/tr|./tbody/tr|./tfoot/tr")
+tablenotes = query(
+    "tablenotes",
+    '//div[@class="pp-table"]/p[not(@class="pp-table-caption")]'
+    '|//p[@class="tablenote-details"]'
+    '|//p[@class="tablenote-details"]/br[following-sibling::text()]',
+)
+
+# misc
+content_containers = [
+    query("content_text", '//div[@id="mw-content-text"]'),
+    query("body_content", '//div[@id="bodyContent"]'),
+    query("body", "//body"),
+]
+styled_non_cells = query("styled_non_cells", "//*[not(self::td or self::th)]/@style")
+all_colored = query("all_colored", "//*[@color]")
+all_bgcolored = query("all_bgcolored", "//*[@bgcolor]")
+container_candidates = query("container_candidates", "//ul|//ol|//table")
+figure_refs = query("figure_refs", '//p[@class="pp_figure_ref"]')
+figure_colons = query(
+    "figure_colons",
+    '//div[@class="thumbcaption"]/i[position()=1 and following-sibling::text()'
+    '[starts-with(self::text(), ":") and position()=1]]',
+)
+reference_sups = query("reference_sups", '//sup[@class="reference"]')
+reference_texts = query(
+    "reference_texts",
+    '//ol[@class="references"]/li[@id=$ref_id]/span[@class="reference-text"]',
+)
+reference_lists = query("reference_lists", '//ol[@class="references"]')
+maps = query(
+    "maps",
+    '//div[contains(@class, "thumb") and not(contains(@class, "thumbinner"))'
+    ' and not(contains(@class, "thumbcaption")) and not(contains(@class, "thumbimage"))'
+    ' and .//div[contains(@style, "relative") and .//div[contains(@style, "absolute")]]]',
+)
+
+# infobox
+infobox_width_divs = query(
+    "infobox_width_divs", '//*[contains(@class, "infobox")]//div[contains(@style, "width")]'
+)
+infobox_padded_cells = query(
+    "infobox_padded_cells",
+    '//*[contains(@class, "infobox")]//*[(self::div or self::td or self::th) and @style]',
+)
+infobox_background_th = query(
+    "infobox_background_th", '//*[contains(@class, "infobox")]//th[contains(@style, "background")]'
+)
+
+# sizetools
+sized_nodes = query("sized_nodes", "//*[@box_width or @box_height]")
+wide_candidates = query("wide_candidates", "//article/div/* | //table")
+resizable_tables = query(
+    "resizable_tables",
+    '//table[not(contains(@class, "infobox")) and not(contains(@class, "pullquote"))'
+    " and not(ancestor::table)]",
+)
+width_nodes = query("width_nodes", "//table|//div|//td|//th")
@@ -1,37 +1,46 @@
 Prince.trackBoxes = true;
 Prince.addEventListener("complete", analyze, false);
 
-function analyze() {
-    var obj = document.getElementsByTagName('html')[0];
-    htmlTree(obj);
-    Log.data("total-page-count", Prince.pageCount);
-}
+// number of [boxid, width, height] records per Log.data line
+var batchSize = 1000;
 
+// scripts run after the document is parsed, before it is laid out
+var loaded = Date.now();
 
-function htmlTree(obj) {
-    var bx = obj.getPrinceBoxes();
-    console.log(obj.tagName + " boxid: " + obj.getAttribute("boxid"));
-    showbox(bx);
-    if (obj.hasChildNodes()) {
-        var child = obj.firstChild;
-        while (child) {
-            if (child.nodeType === 1) {
-                htmlTree(child);
-            }
-            child = child.nextSibling;
-        }
-    }
+function logPhaseTime(phase, start) {
+    Log.data("phase-time", phase + " " + (Date.now() - start) / 1000);
 }
 
-function showbox(bx) {
-    console.log("  #boxes: " + bx.length);
-    for (var j = 0; j < bx.length; j++) {
-        console.log("  box: " + j);
-        console.log("width: " + bx[j]["w"]);
-        console.log("height: " + bx[j]["h"]);
-        // for (var i in bx[j])
-        // {
-        //     console.log("    "+i+": "+bx[j][i]);
-        // }
+// log the maximum width and the sum of the heights of the boxes of every tagged node
+function analyze() {
+    logPhaseTime("layout", loaded);
+    var start = Date.now();
+    var nodes = document.getElementsByTagName("*");
+    var batch = [];
+    for (var i = 0; i < nodes.length; i++) {
+        var boxid = nodes[i].getAttribute("boxid");
+        if (!boxid) {
+            continue;
+        }
+        var boxes = nodes[i].getPrinceBoxes();
+        if (!boxes.length) {
+            continue;
+        }
+        var width = 0;
+        var height = 0;
+        for (var j = 0; j < boxes.length; j++) {
+            width = Math.max(width, boxes[j].w);
+            height += boxes[j].h;
+        }
+        batch.push([parseInt(boxid, 10), width, height]);
+        if (batch.length === batchSize) {
+            Log.data("boxes", JSON.stringify(batch));
+            batch = [];
+        }
+    }
+    if (batch.length) {
+        Log.data("boxes", JSON.stringify(batch));
     }
+    Log.data("total-page-count", Prince.pageCount);
+    logPhaseTime("analyze", start);
 }
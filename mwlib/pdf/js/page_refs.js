@@ -0,0 +1,17 @@
+Prince.trackBoxes = true;
+Prince.addEventListener("complete", logPageRefs, false);
+
+// log the page count and the pages of link targets marked by chunks.mark_page_refs
+function logPageRefs() {
+    console.log("page-count: " + Prince.pageCount);
+    var nodes = document.getElementsByTagName("*");
+    for (var i = 0; i < nodes.length; i++) {
+        var target = nodes[i].getAttribute("data-pp-page-ref");
+        if (target) {
+            var boxes = nodes[i].getPrinceBoxes();
+            if (boxes.length) {
+                console.log("page-ref: " + target + " " + boxes[0].pageNum);
+            }
+        }
+    }
+}
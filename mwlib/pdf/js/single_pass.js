@@ -0,0 +1,161 @@
+// Single pass layout: the table resizing of PrincePdfWriter._post_width_hook
+// (sizetools.fix_nested_widths, resize_tables and resize_overwide_tables) is
+// done after the first layout, prince then lays out the document again.
+// layoutConfig is defined in layout-config-<hash>.js, written by stylesheets.layout_config.
+
+if (typeof Prince !== "undefined") {
+    Prince.trackBoxes = true;
+    Prince.registerPostLayoutFunc(resizeTablesOnce);
+}
+
+var resized = false;
+
+function resizeTablesOnce() {
+    if (resized) {
+        return;
+    }
+    resized = true;
+    var tables = resizableTables(document);
+    for (var i = 0; i < tables.length; i++) {
+        resizeTable(tables[i], subtreeWidth(tables[i]), layoutConfig);
+    }
+    Log.data("single-pass", tables.length);
+}
+
+function isElement(node) {
+    return node.nodeType === 1;
+}
+
+function tagName(node) {
+    return node.tagName.toLowerCase();
+}
+
+// xpaths.resizable_tables
+function resizableTables(doc) {
+    var result = [];
+    var tables = doc.getElementsByTagName("table");
+    for (var i = 0; i < tables.length; i++) {
+        var cls = tables[i].getAttribute("class") || "";
+        if (cls.indexOf("infobox") !== -1 || cls.indexOf("pullquote") !== -1) {
+            continue;
+        }
+        var nested = false;
+        for (var p = tables[i].parentNode; p && isElement(p); p = p.parentNode) {
+            if (tagName(p) === "table") {
+                nested = true;
+                break;
+            }
+        }
+        if (!nested) {
+            result.push(tables[i]);
+        }
+    }
+    return result;
+}
+
+// widest box of the node and its descendants, see sizetools.fix_nested_widths
+function subtreeWidth(node) {
+    var width = 0;
+    var boxes = node.getPrinceBoxes();
+    for (var i = 0; i < boxes.length; i++) {
+        width = Math.max(width, boxes[i].w);
+    }
+    for (var child = node.firstChild; child; child = child.nextSibling) {
+        if (isElement(child)) {
+            width = Math.max(width, subtreeWidth(child));
+        }
+    }
+    return width;
+}
+
+// utils.get_node_style
+function parseStyle(style) {
+    var declarations = [];
+    var parts = (style || "").split(";");
+    for (var i = 0; i < parts.length; i++) {
+        var idx = parts[i].indexOf(":");
+        if (idx !== -1) {
+            declarations.push([
+                parts[i].slice(0, idx).trim().toLowerCase(),
+                parts[i].slice(idx + 1).trim()
+            ]);
+        }
+    }
+    return declarations;
+}
+
+// utils.serialize_node_style
+function serializeStyle(declarations) {
+    var parts = [];
+    for (var i = 0; i < declarations.length; i++) {
+        parts.push(declarations[i][0] + ":" + declarations[i][1]);
+    }
+    return parts.join(";");
+}
+
+// utils.add_node_style
+function addStyle(node, name, value) {
+    var declarations = parseStyle(node.getAttribute("style"));
+    for (var i = 0; i < declarations.length; i++) {
+        if (declarations[i][0] === name) {
+            declarations[i][1] = value;
+            node.setAttribute("style", serializeStyle(declarations));
+            return;
+        }
+    }
+    declarations.push([name, value]);
+    node.setAttribute("style", serializeStyle(declarations));
+}
+
+// utils.remove_node_width
+function removeWidth(node) {
+    var style = node.getAttribute("style");
+    if (style) {
+        var declarations = parseStyle(style).filter(function(declaration) {
+            return declaration[0] !== "width";
+        });
+        if (declarations.length) {
+            node.setAttribute("style", serializeStyle(declarations));
+        } else {
+            node.removeAttribute("style");
+        }
+    }
+    if (node.getAttribute("width")) {
+        node.removeAttribute("width");
+    }
+}
+
+// utils.append_class
+function appendClass(node, cls) {
+    var current = node.getAttribute("class");
+    node.setAttribute("class", current ? current + " " + cls : cls);
+}
+
+// sizetools.resize_node_width_to_columns with use_thirds_only=False and
+// sizetools.resize_overwide_tables
+function resizeTable(node, width, config) {
+    removeWidth(node);
+    for (var i = 0; i < config.columns.length; i++) {
+        if (config.columns[i] > width) {
+            appendClass(node, "col-" + (i + 1));
+            return;
+        }
+    }
+    if (width > config.toleratedOverWidth) {
+        appendClass(node, "rotated-table");
+        return;
+    }
+    var wrapper = node.ownerDocument.createElement("div");
+    wrapper.setAttribute("class", "over-wide-wrapper");
+    node.parentNode.insertBefore(wrapper, node);
+    wrapper.appendChild(node);
+    appendClass(node, "over-wide");
+    addStyle(wrapper, "transform-origin", "0 0");
+    var scale = config.columns[config.columns.length - 1] / width;
+    addStyle(wrapper, "transform", "scale(" + scale.toFixed(2) + ") ");
+}
+
+if (typeof module !== "undefined") {
+    module.exports = {resizableTables: resizableTables, resizeTable: resizeTable,
+                      subtreeWidth: subtreeWidth};
+}
@@ -34,6 +34,24 @@ def resident():
     return _readproc('VmRSS:')
 
 
+def peak_resident():
+    '''Return peak resident memory usage in MB.
+    '''
+    return _readproc('VmHWM:')
+
+
+def reset_peak():
+    '''Reset the peak resident memory usage to the current usage.
+
+    Needs Linux 4.0 or later, otherwise the peak covers the whole process lifetime.
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (IOError, OSError):
+        pass
+
+
 def stacksize():
     '''Return stack size in MB.
     '''
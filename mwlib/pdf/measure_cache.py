@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Persistent cache of measured box sizes
+
+The measuring pass only determines box sizes. They depend on the HTML of an
+article, the compiled CSS, the measuring script, the page geometry in
+config.py, the prince version and the installed fonts, not on the rest of the
+book: articles start on a new page. Sizes are cached for every article and for
+the other children of the body (front matter, appendix).
+
+Boxids differ between books, cached sizes refer to the position of a node
+in its article.
+"""
+
+import json
+import os
+import re
+import subprocess
+
+from lxml import etree
+from six import string_types
+
+from mwlib.pdf import prince
+from mwlib.pdf._version import version
+from mwlib.pdf.cache import DiskCache, make_key
+from mwlib.pdf.htmlfilters.dom_cache import config_values
+
+boxid_attr_regex = re.compile(r' boxid="\d+"')
+font_dirs = [
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    "/Library/Fonts",
+    os.path.expanduser("~/.fonts"),
+    os.path.expanduser("~/.local/share/fonts"),
+    os.path.expanduser("~/Library/Fonts"),
+]
+
+
+def prince_version():
+    """
+    Output of prince --version, None if prince can't be run
+    """
+    try:
+        p = subprocess.Popen(
+            [prince.prince_cmd[0], "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except OSError:
+        return None
+    out, _ = p.communicate()
+    return out if p.returncode == 0 else None
+
+
+def fonts_fingerprint():
+    """
+    Paths, sizes and modification times of the files in the font directories
+    """
+    fonts = []
+    for directory in font_dirs:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                path = os.path.join(dirpath, fn)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                fonts.append((path, stat.st_size, int(stat.st_mtime)))
+    return fonts
+
+
+def segments(root):
+    """
+    List the parts of the book measured independently as (section, node)
+
+    section is the articles section of an article and None for the other body children.
+    """
+    result = []
+    for child in root.find("body"):
+        if not isinstance(child.tag, string_types):
+            continue
+        if child.get("id") == "articles":
+            result.extend(
+                (child, article) for article in child if isinstance(article.tag, string_types)
+            )
+        else:
+            result.append((None, child))
+    return result
+
+
+def tagged_positions(node):
+    """
+    Positions of the nodes with a boxid below node
+    """
+    return [idx for idx, descendant in enumerate(node.iter()) if descendant.get("boxid")]
+
+
+class MeasureCache(object):
+    def __init__(self, path, max_size, css_filename, js_filename):
+        """
+        :param path: cache directory
+        :param max_size: maximum cache size in bytes
+        :param css_filename: compiled stylesheet of the book
+        :param js_filename: measuring script
+        """
+        self.cache = DiskCache(path, max_size)
+        sources = [version, config_values(), prince_version(), fonts_fingerprint()]
+        for fn in (css_filename, js_filename):
+            with open(fn, "rb") as f:
+                sources.append(f.read())
+        self.style_key = make_key(*sources)
+
+    def key(self, section, node, positions):
+        """
+        Build the cache key of a tagged segment
+        """
+        html = etree.tostring(node, encoding="utf-8", with_tail=False)
+        return make_key(
+            self.style_key,
+            section.get("id") if section is not None else None,
+            positions,
+            boxid_attr_regex.sub("", html),
+        )
+
+    def load(self, key, node):
+        """
+        Return the cached [boxid, width, height] records of the nodes below node or None
+        """
+        data = self.cache.get(key)
+        if data is None:
+            return None
+        nodes = list(node.iter())
+        return [
+            [int(nodes[idx].get("boxid")), width, height]
+            for idx, width, height in json.loads(data)
+        ]
+
+    def store(self, key, node, sizes):
+        """
+        Store the sizes of the nodes below node
+
+        :param sizes: dict boxid -> [boxid, width, height]
+        """
+        records = []
+        for idx, descendant in enumerate(node.iter()):
+            boxid = descendant.get("boxid")
+            if boxid and int(boxid) in sizes:
+                records.append([idx] + list(sizes[int(boxid)][1:]))
+        self.cache.set(key, json.dumps(records))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Pool of long-lived Prince processes
+
+Prince started with --control reads jobs from stdin and writes the results
+to stdout as chunks: a three letter tag, the length of the data, a newline,
+the data and another newline. A job chunk holds the JSON job description,
+followed by one dat chunk per job resource. Prince answers with a pdf chunk
+(if the job succeeded) and a log chunk with the structured log, the same
+msg|... lines written in --server mode.
+
+Warm processes don't need to look up fonts and licenses again for every
+render. Processes are recycled after max_jobs jobs and replaced when they
+died. A pool whose processes fail to start is disabled. Callers fall back to
+a one-shot prince subprocess on PrinceError.
+"""
+
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from mwlib.log import Log
+
+from mwlib.pdf import procstats
+
+log = Log("mwlib.pdf.prince")
+
+prince_cmd = ["prince", "--no-network"]
+
+
+class PrinceError(Exception):
+    pass
+
+
+class PrinceProcess(object):
+    """
+    A prince process in control mode running one job at a time
+    """
+
+    def __init__(self, cmd=None):
+        self.cmd = list(cmd or prince_cmd) + ["--control"]
+        try:
+            self.process = subprocess.Popen(
+                self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+        except OSError as exc:
+            raise PrinceError("starting {} failed: {}".format(self.cmd, exc))
+        self.jobs = 0
+        try:
+            tag, self.version = self._read_chunk()
+            if tag != "ver":
+                raise PrinceError("unexpected {} chunk instead of the version".format(tag))
+        except PrinceError:
+            self.close()
+            raise
+
+    def _write_chunk(self, tag, data):
+        if hasattr(data, "read"):
+            data.seek(0, os.SEEK_END)
+            self.process.stdin.write("{} {}\n".format(tag, data.tell()))
+            data.seek(0)
+            shutil.copyfileobj(data, self.process.stdin)
+        else:
+            self.process.stdin.write("{} {}\n".format(tag, len(data)))
+            self.process.stdin.write(data)
+        self.process.stdin.write("\n")
+
+    def _read_chunk(self):
+        header = self.process.stdout.readline()
+        try:
+            tag, length = header.split()
+            length = int(length)
+        except ValueError:
+            raise PrinceError("invalid chunk header {!r}".format(header))
+        data = self.process.stdout.read(length)
+        if len(data) != length or self.process.stdout.read(1) != "\n":
+            raise PrinceError("truncated {} chunk".format(tag))
+        return tag, data
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def convert(self, job, resources):
+        """
+        Run a job, return the PDF (None if the job failed) and the log
+
+        :param job: job description, job-resource:N refers to resources[N]
+        :param resources: list of byte strings or files
+        """
+        job = dict(job, **{"job-resource-count": len(resources)})
+        self.jobs += 1
+        pid = self.process.pid
+        procstats.reset_peak(pid)
+        user, system, _ = procstats.sample(pid)
+        started = time.time()
+        try:
+            return self._convert(job, resources)
+        finally:
+            end_user, end_system, max_rss = procstats.sample(pid)
+            procstats.record(
+                "prince", time.time() - started, end_user - user, end_system - system, max_rss
+            )
+
+    def _convert(self, job, resources):
+        try:
+            self._write_chunk("job", json.dumps(job))
+            for data in resources:
+                self._write_chunk("dat", data)
+            self.process.stdin.flush()
+            pdf = None
+            while True:
+                tag, data = self._read_chunk()
+                if tag == "pdf":
+                    pdf = data
+                elif tag == "log":
+                    return pdf, data
+                elif tag == "err":
+                    raise PrinceError(data)
+                else:
+                    raise PrinceError("unexpected {} chunk".format(tag))
+        except (IOError, OSError) as exc:
+            raise PrinceError("prince process {} failed: {}".format(self.process.pid, exc))
+
+    def close(self):
+        if self.alive():
+            try:
+                self._write_chunk("end", "")
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+        try:
+            self.process.stdout.close()
+        except (IOError, OSError):
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class PrincePool(object):
+    """
+    Reuse up to size prince processes, a process is replaced after max_jobs jobs
+    """
+
+    def __init__(self, size=1, max_jobs=50, cmd=None):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.cmd = cmd
+        self.idle = []
+        self.disabled = False
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(size)
+
+    def _acquire(self):
+        with self.lock:
+            while self.idle:
+                process = self.idle.pop()
+                if process.alive():
+                    return process
+                log.warning("prince process {} died".format(process.process.pid))
+                process.close()
+        try:
+            return PrinceProcess(self.cmd)
+        except PrinceError:
+            self.disabled = True
+            raise
+
+    def _release(self, process):
+        if process.jobs >= self.max_jobs or not process.alive():
+            process.close()
+            return
+        with self.lock:
+            self.idle.append(process)
+
+    def convert(self, job, resources):
+        """
+        Run a job in a pooled process, see PrinceProcess.convert
+        """
+        if self.disabled:
+            raise PrinceError("prince pool is disabled")
+        with self.slots:
+            process = self._acquire()
+            try:
+                result = process.convert(job, resources)
+            except Exception:
+                process.close()
+                raise
+            self._release(process)
+            return result
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for process in idle:
+            process.close()
+
+
+_pools = {}
+
+
+def get_pool(size=1, max_jobs=50):
+    """
+    Return the pool of this process, pools are kept alive across books
+    """
+    key = (size, max_jobs)
+    if key not in _pools:
+        _pools[key] = PrincePool(size=size, max_jobs=max_jobs)
+    return _pools[key]
+
+
+@atexit.register
+def close_pools():
+    for pool in _pools.values():
+        pool.close()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Resource accounting of the external processes spawned while rendering
+
+Processes started with procstats.Popen are reaped with os.wait4, which
+returns their peak resident memory and CPU times. Long-lived processes, the
+pooled prince processes, are sampled from /proc around every job instead:
+their peak resident memory is reset before the job (clear_refs) and read
+from VmHWM afterwards.
+
+The numbers are aggregated per command for the current render. Filter
+workers ship their numbers back with the filtered article.
+"""
+
+import errno
+import os
+import subprocess
+import threading
+import time
+
+from mwlib.log import Log
+
+log = Log("mwlib.pdf.procstats")
+
+_fields = ("count", "wall", "user", "sys", "max_rss")
+
+_lock = threading.Lock()
+_stats = {}  # command -> dict of _fields
+
+
+def record(name, wall, user, system, max_rss):
+    """
+    Add a finished process or job
+
+    :param max_rss: peak resident memory in MB
+    """
+    with _lock:
+        entry = _stats.setdefault(name, dict.fromkeys(_fields, 0))
+        entry["count"] += 1
+        entry["wall"] += wall
+        entry["user"] += user
+        entry["sys"] += system
+        entry["max_rss"] = max(entry["max_rss"], max_rss)
+
+
+def merge(stats):
+    """
+    Add the numbers returned by take() in another process
+    """
+    with _lock:
+        for name, other in (stats or {}).items():
+            entry = _stats.setdefault(name, dict.fromkeys(_fields, 0))
+            for field in ("count", "wall", "user", "sys"):
+                entry[field] += other[field]
+            entry["max_rss"] = max(entry["max_rss"], other["max_rss"])
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def take():
+    """
+    Return the numbers per command and reset them
+    """
+    global _stats
+    with _lock:
+        stats, _stats = _stats, {}
+    return stats
+
+
+def snapshot():
+    with _lock:
+        return dict((name, dict(entry)) for name, entry in _stats.items())
+
+
+def log_summary():
+    for name, entry in sorted(snapshot().items()):
+        log.info(
+            "PROCESS {}: {} runs, {:.2f}s wall, {:.2f}s user, {:.2f}s sys, "
+            "peak {:.2f}MB resident".format(
+                name, entry["count"], entry["wall"], entry["user"], entry["sys"], entry["max_rss"]
+            )
+        )
+
+
+def command_name(args):
+    if isinstance(args, (list, tuple)):
+        return os.path.basename(args[0])
+    return os.path.basename(args.split()[0])
+
+
+class Popen(subprocess.Popen):
+    """
+    subprocess.Popen recording the resources of the process when it is reaped
+    """
+
+    def __init__(self, args, *popen_args, **popen_kwargs):
+        self.started = time.time()
+        self.command_name = command_name(args)
+        subprocess.Popen.__init__(self, args, *popen_args, **popen_kwargs)
+
+    def _reap(self, options):
+        if self.returncode is not None:
+            return self.returncode
+        while True:
+            try:
+                pid, status, rusage = os.wait4(self.pid, options)
+                break
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno == errno.ECHILD:  # reaped elsewhere, the exit status is lost
+                    log.warning("{} ({}) was reaped elsewhere".format(self.command_name, self.pid))
+                    return None
+                raise
+        if pid == self.pid:
+            self._handle_exitstatus(status)
+            record(
+                self.command_name,
+                time.time() - self.started,
+                rusage.ru_utime,
+                rusage.ru_stime,
+                rusage.ru_maxrss / 1024.0,  # kB on Linux
+            )
+        return self.returncode
+
+    def poll(self):
+        return self._reap(os.WNOHANG)
+
+    def wait(self):
+        return self._reap(0)
+
+
+_clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def sample(pid):
+    """
+    Return user and system CPU seconds and the peak resident memory in MB of a process
+    """
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            # the command in field 2 may contain spaces, it ends with the last ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/{}/status".format(pid)) as f:
+            hwm = [line.split()[1] for line in f if line.startswith("VmHWM:")]
+    except (IOError, OSError, IndexError):
+        return 0.0, 0.0, 0.0
+    user, system = [float(value) / _clock_ticks for value in fields[11:13]]
+    return user, system, float(hwm[0]) / 1024.0 if hwm else 0.0
+
+
+def reset_peak(pid):
+    """
+    Reset the peak resident memory of a process, see linuxmem.reset_peak
+    """
+    try:
+        with open("/proc/{}/clear_refs".format(pid), "w") as f:
+            f.write("5")
+    except (IOError, OSError):
+        pass
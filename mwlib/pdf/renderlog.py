@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Metrics from the structured log prince writes in --server and --control mode
+
+msg|<type>|<location>|<text> lines carry the messages of prince (older
+versions write msg|<type>|<text>), dat|<name>|<value> lines the data logged
+by the scripts with Log.data, see js/base.js. The warnings are counted and
+the missing fonts and images are collected to correlate slow renders with
+the features of the book.
+"""
+
+import re
+import threading
+from collections import Counter, OrderedDict
+
+message_types = {"wrn": "warnings", "err": "errors", "inf": "infos", "out": "output"}
+
+no_font_regex = re.compile(r"no font for (.+?) character", re.I)
+font_regex = re.compile(r"(?:can't|unable to|failed to) (?:find|load|open) font\S*\s*(.*)", re.I)
+image_regex = re.compile(
+    r"can't open input file|failed to load image|unsupported image|not a valid image", re.I
+)
+location_regex = re.compile(r":\d+(?::\d+)?:?$")  # line and column of html locations
+
+max_listed = 20  # most frequent warnings, fonts and images listed in the metrics
+
+
+class RenderLog(object):
+    """
+    Aggregate the logs of the prince runs of one render stage
+
+    Lines may be fed by several threads, e.g. of the chunked rendering.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.messages = Counter()  # message type -> count
+        self.warnings = Counter()  # text -> count
+        self.missing_fonts = Counter()
+        self.missing_images = Counter()
+        self.page_count = 0
+        self.phase_times = Counter()  # phase -> seconds summed over the runs
+
+    def feed(self, lines):
+        """
+        Parse the log of one prince run
+        """
+        for _ in self.watch(lines):
+            pass
+
+    def watch(self, lines):
+        """
+        Parse the log of one prince run while the returned generator yields its lines
+        """
+        with self.lock:
+            self.runs += 1
+        for line in lines:
+            self.parse_line(line)
+            yield line
+
+    def parse_line(self, line):
+        parts = line.rstrip("\n").split("|", 2)
+        if len(parts) < 3:
+            return
+        with self.lock:
+            if parts[0] == "msg":
+                self._parse_message(parts[1], parts[2])
+            elif parts[0] == "dat":
+                self._parse_data(parts[1], parts[2])
+
+    def _parse_message(self, kind, body):
+        location, sep, text = body.partition("|")
+        if not sep:
+            location, text = "", body
+        self.messages[message_types.get(kind, kind)] += 1
+        if kind not in ("wrn", "err"):
+            return
+        self.warnings[text] += 1
+        match = no_font_regex.search(text) or font_regex.search(text)
+        if match:
+            self.missing_fonts[match.group(1) or text] += 1
+        elif image_regex.search(text):
+            self.missing_images[location_regex.sub("", location) or text] += 1
+
+    def _parse_data(self, name, value):
+        if name == "total-page-count":
+            self.page_count += int(value)
+        elif name == "phase-time":
+            phase, _, seconds = value.partition(" ")
+            self.phase_times[phase] += float(seconds)
+
+    def metrics(self):
+        with self.lock:
+            return OrderedDict(
+                [
+                    ("runs", self.runs),
+                    ("page_count", self.page_count),
+                    ("messages", dict(self.messages)),
+                    ("phase_times", dict(self.phase_times)),
+                    ("warnings", OrderedDict(self.warnings.most_common(max_listed))),
+                    ("missing_fonts", OrderedDict(self.missing_fonts.most_common(max_listed))),
+                    ("missing_images", OrderedDict(self.missing_images.most_common(max_listed))),
+                ]
+            )
+
+    def summary(self):
+        return (
+            "{} runs, {} pages, {} warnings, {} errors, {} missing fonts, {} missing images"
+        ).format(
+            self.runs,
+            self.page_count,
+            self.messages["warnings"],
+            self.messages["errors"],
+            len(self.missing_fonts),
+            len(self.missing_images),
+        )
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# ~ -*- coding:utf-8 -*-
+
+"""
+Compiled stylesheet and layout script cached outside of the package directory
+
+base.scss imports the page geometry of config.py as "config". The compiled
+CSS is stored in a cache directory under a hash of all SCSS sources and the
+geometry, so it is compiled once and shared by renders and processes. Files
+are written to a temporary file which is renamed into place: concurrent
+renders never read partial files and the package may be installed read-only.
+
+For the page formats of config.page_formats the stylesheet is precompiled
+at build time (make stylesheets) into css/compiled, which is shipped with
+the package. Geometries found in its index are not compiled at render time.
+
+A stylesheet can be pruned for a book: rules whose selectors need a tag,
+class or id the book does not contain are dropped, prince does not match
+them against every element. Likewise the @font-face rules whose
+unicode-range covers no character of the book are dropped, prince does not
+look up their fonts.
+"""
+
+import errno
+import glob
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+from collections import OrderedDict
+
+import sass
+import tinycss2
+from mwlib.log import Log
+from six import string_types
+
+from mwlib.pdf._version import version
+from mwlib.pdf.cache import make_key
+from mwlib.pdf.config import (
+    columns,
+    get_column_width_pt,
+    gutter_width_pt,
+    page_formats,
+    page_height_pt,
+    page_margins,
+    page_width_pt,
+    tolerated_over_width,
+)
+
+log = Log("mwlib.pdf.stylesheets")
+
+default_cache_dir = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "mwlib.pdf",
+)
+precompiled_dir = os.path.join(os.path.dirname(__file__), "css", "compiled")
+precompiled_index = "index.json"  # {source key: stylesheet filename}
+unicode_range_regex = re.compile(r"U\+([0-9a-f?]+)(?:-([0-9a-f]+))?", re.I)
+
+# classes added after the book is assembled, by _post_width_hook or single_pass.js
+layout_classes = ["col-{}".format(number + 1) for number in range(len(columns))] + [
+    "rotated-table",
+    "over-wide",
+    "over-wide-wrapper",
+]
+
+
+def page_size(width, height):
+    """
+    Return the CSS page size of a page format
+    """
+    for size, dimensions in page_formats.items():
+        if tuple(dimensions) == (width, height):
+            return size
+    return "{}pt {}pt".format(width, height)
+
+
+def config_scss(width=None, height=None):
+    """
+    Return the "config" import of base.scss for a page format, the one of config.py if None
+    """
+    width, height = width or page_width_pt, height or page_height_pt
+    return "\n".join(
+        [
+            "$gutter-width: {}pt;".format(gutter_width_pt),
+            "$base-column-width: {}pt;".format(get_column_width_pt(width)),
+            "@page {",
+            "   size: {};".format(page_size(width, height)),
+            "   margin: {};".format(" ".join([str(p) + "pt" for p in page_margins])),
+            "   padding: 0;",
+            "}",
+        ]
+    )
+
+
+def layout_config_js():
+    """
+    Define the layoutConfig used by single_pass.js
+    """
+    layout_config = OrderedDict(
+        [("columns", list(columns.values())), ("toleratedOverWidth", tolerated_over_width)]
+    )
+    return "var layoutConfig = {};\n".format(json.dumps(layout_config))
+
+
+def _cache_dir(cache_dir):
+    cache_dir = cache_dir or default_cache_dir
+    try:
+        os.makedirs(cache_dir)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            fallback = tempfile.mkdtemp(prefix="mwlib.pdf-")
+            log.warning("creating {} failed, using {}: {}".format(cache_dir, fallback, exc))
+            return fallback
+    return cache_dir
+
+
+def _write_atomic(fn, data):
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(fn), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.rename(tmp_fn, fn)
+
+
+def _scss_sources(scss_file):
+    css_dir = os.path.dirname(scss_file)
+    result = []
+    for fn in sorted(glob.glob(os.path.join(css_dir, "*.scss"))):
+        with open(fn) as f:
+            result.append((os.path.basename(fn), f.read()))
+    return result
+
+
+def source_key(scss_file, scss_config):
+    """
+    Hash the SCSS sources and the "config" import
+    """
+    return make_key(scss_config, _scss_sources(scss_file))
+
+
+def _compile(scss_file, scss_config, **kwargs):
+    def import_config(path):
+        if path == "config":
+            return [("_config.scss", scss_config)]
+        return None
+
+    return sass.compile(filename=scss_file, importers=[(0, import_config)], **kwargs)
+
+
+def _precompiled(key):
+    try:
+        with open(os.path.join(precompiled_dir, precompiled_index)) as f:
+            filename = json.load(f).get(key)
+    except (IOError, OSError, ValueError):
+        return None
+    return os.path.join(precompiled_dir, filename) if filename else None
+
+
+def compiled_css(scss_file, cache_dir=None):
+    """
+    Return the filename of the compiled scss_file
+
+    The precompiled stylesheet is used if it matches, otherwise it is compiled
+    unless it is cached.
+
+    :param cache_dir: directory of the compiled stylesheets, default_cache_dir if None
+    """
+    scss_config = config_scss()
+    key = source_key(scss_file, scss_config)
+    css_fn = _precompiled(key)
+    if css_fn is not None:
+        log.info("using precompiled sass {}".format(css_fn))
+        return css_fn
+    cache_dir = _cache_dir(cache_dir)
+    key = make_key(version, sass.libsass_version, key)
+    css_fn = os.path.join(cache_dir, "{}-{}.css".format(os.path.basename(scss_file)[:-5], key))
+    if os.path.exists(css_fn):
+        log.info("using compiled sass {}".format(css_fn))
+        return css_fn
+    source_map_fn = css_fn + ".map"
+    compiled, source_map = _compile(scss_file, scss_config, source_map_filename=source_map_fn)
+    # the map first: a cached stylesheet always has its map
+    _write_atomic(source_map_fn, source_map)
+    _write_atomic(css_fn, compiled)
+    log.info("compiled sass {} -> {}".format(scss_file, css_fn))
+    return css_fn
+
+
+def layout_config(cache_dir=None):
+    """
+    Return the filename of the script defining layoutConfig
+    """
+    cache_dir = _cache_dir(cache_dir)
+    script = layout_config_js()
+    fn = os.path.join(cache_dir, "layout-config-{}.js".format(make_key(script)))
+    if not os.path.exists(fn):
+        _write_atomic(fn, script)
+    return fn
+
+
+def precompile(scss_file, output_dir=precompiled_dir):
+    """
+    Compile scss_file for every page format of config.page_formats into output_dir
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    index = {}
+    name = os.path.basename(scss_file)[:-5]
+    for size, (width, height) in page_formats.items():
+        scss_config = config_scss(width, height)
+        css_fn = os.path.join(output_dir, "{}-{}.css".format(name, size.replace(" ", "-")))
+        _write_atomic(css_fn, _compile(scss_file, scss_config))
+        index[source_key(scss_file, scss_config)] = os.path.basename(css_fn)
+        log.info("precompiled sass {} ({}) -> {}".format(scss_file, size, css_fn))
+    _write_atomic(
+        os.path.join(output_dir, precompiled_index), json.dumps(index, indent=2, sort_keys=True)
+    )
+
+
+def vocabulary(root):
+    """
+    Return the set of ("tag", name), ("class", name) and ("id", name) of a document
+    """
+    result = set(("class", cls) for cls in layout_classes)
+    result.add(("tag", "div"))
+    for node in root.iter():
+        if not isinstance(node.tag, string_types):
+            continue
+        result.add(("tag", node.tag.lower()))
+        result.update(("class", cls) for cls in (node.get("class") or "").split())
+        if node.get("id"):
+            result.add(("id", node.get("id")))
+    return result
+
+
+def _selectors(prelude):
+    """
+    Split the prelude of a rule into (tokens, requirements) per selector
+
+    The requirements are the tags, classes and ids a document needs for the
+    selector to match. Arguments of pseudo-classes like :not() and attribute
+    selectors are not required.
+    """
+    result = []
+    tokens, requirements = [], set()
+    prev = None
+    for token in prelude + [None]:
+        if token is None or token.type == "literal" and token.value == ",":
+            if tokens:
+                result.append((tokens, requirements))
+            tokens, requirements, prev = [], set(), None
+            continue
+        tokens.append(token)
+        if token.type == "hash" and token.is_identifier:
+            requirements.add(("id", token.value))
+        elif token.type == "ident":
+            if prev is not None and prev.type == "literal" and prev.value == ".":
+                requirements.add(("class", token.value))
+            elif (
+                prev is None
+                or prev.type == "whitespace"
+                or prev.type == "literal"
+                and prev.value in (">", "+", "~")
+            ):
+                requirements.add(("tag", token.lower_value))
+        prev = token
+    return result
+
+
+def _prune_rules(rules, vocabulary, stats):
+    result = []
+    for rule in rules:
+        if rule.type == "qualified-rule":
+            stats[1] += 1
+            selectors = [
+                tokens
+                for tokens, requirements in _selectors(rule.prelude)
+                if requirements <= vocabulary
+            ]
+            if not selectors:
+                continue
+            stats[0] += 1
+            prelude = ",".join(tinycss2.serialize(tokens).strip() for tokens in selectors)
+            result.append("{} {{{}}}".format(prelude, tinycss2.serialize(rule.content)))
+        elif rule.type == "at-rule" and rule.lower_at_keyword in ("media", "supports"):
+            content = _prune_rules(
+                tinycss2.parse_rule_list(rule.content, skip_comments=True, skip_whitespace=True),
+                vocabulary,
+                stats,
+            )
+            if content:
+                prelude = tinycss2.serialize(rule.prelude).strip()
+                result.append(
+                    "@{} {} {{\n{}\n}}".format(rule.at_keyword, prelude, "\n".join(content))
+                )
+        elif rule.type != "error":
+            result.append(rule.serialize())
+    return result
+
+
+def prune(css, vocabulary):
+    """
+    Return css without the rules that cannot match a document with vocabulary
+
+    :param vocabulary: result of vocabulary()
+    """
+    stats = [0, 0]  # kept and total rules
+    rules = tinycss2.parse_stylesheet(css, skip_comments=True, skip_whitespace=True)
+    pruned = "\n".join(_prune_rules(rules, vocabulary, stats)) + "\n"
+    log.info("pruned css: kept {} of {} rules".format(*stats))
+    return pruned
+
+
+def _selector_vocabulary(css):
+    result = set()
+
+    def collect(rules):
+        for rule in rules:
+            if rule.type == "qualified-rule":
+                for _, requirements in _selectors(rule.prelude):
+                    result.update(requirements)
+            elif rule.type == "at-rule" and rule.lower_at_keyword in ("media", "supports"):
+                collect(tinycss2.parse_rule_list(rule.content, skip_comments=True))
+
+    collect(tinycss2.parse_stylesheet(css, skip_comments=True, skip_whitespace=True))
+    return result
+
+
+def pruned_css(css_file, root, cache_dir=None):
+    """
+    Return the filename of css_file pruned for the document root
+
+    The pruned stylesheet is cached under a hash of the stylesheet and the part
+    of the vocabulary of the document it uses.
+    """
+    with io.open(css_file, encoding="utf-8") as f:
+        css = f.read()
+    used = sorted(vocabulary(root) & _selector_vocabulary(css))
+    cache_dir = _cache_dir(cache_dir)
+    name = os.path.basename(css_file)[:-4]
+    fn = os.path.join(cache_dir, "{}-pruned-{}.css".format(name, make_key(css, used)))
+    if os.path.exists(fn):
+        log.info("using pruned css {}".format(fn))
+        return fn
+    _write_atomic(fn, prune(css, set(used)))
+    return fn
+
+
+def unicode_ranges(font_face):
+    """
+    Return the (first, last) code points of the unicode-range of a @font-face rule
+
+    An empty list stands for all code points.
+    """
+    for declaration in tinycss2.parse_declaration_list(
+        font_face.content, skip_comments=True, skip_whitespace=True
+    ):
+        if declaration.type == "declaration" and declaration.lower_name == "unicode-range":
+            value = tinycss2.serialize(declaration.value)
+            return [
+                (int(first.replace("?", "0"), 16), int(last or first.replace("?", "f"), 16))
+                for first, last in unicode_range_regex.findall(value)
+            ]
+    return []
+
+
+def code_points(root, css=""):
+    """
+    Return the code points of the text of a document and of a stylesheet (generated content)
+    """
+    result = set(ord(char) for char in css)
+    for text in root.itertext():
+        result.update(ord(char) for char in text)
+    return result
+
+
+def _font_face_needed(rule, used):
+    ranges = unicode_ranges(rule)
+    return not ranges or any(first <= point <= last for point in used for first, last in ranges)
+
+
+def font_subset_css(css_file, root, cache_dir=None):
+    """
+    Return the filename of css_file without the @font-face rules not needed by root
+
+    A font face is needed if its unicode-range covers a character of the book,
+    faces without unicode-range are always kept. With prince-no-fallback in the
+    font stacks the fonts of the dropped faces would not be used by the book
+    anyway. The stylesheet is cached per set of needed faces.
+    """
+    with io.open(css_file, encoding="utf-8") as f:
+        css = f.read()
+    rules = tinycss2.parse_stylesheet(css, skip_comments=True, skip_whitespace=True)
+    used = code_points(root, css)
+    font_faces = set(
+        idx
+        for idx, rule in enumerate(rules)
+        if rule.type == "at-rule" and rule.lower_at_keyword == "font-face"
+    )
+    needed = set(idx for idx in font_faces if _font_face_needed(rules[idx], used))
+    cache_dir = _cache_dir(cache_dir)
+    name = os.path.basename(css_file)[:-4]
+    fn = os.path.join(cache_dir, "{}-fonts-{}.css".format(name, make_key(css, sorted(needed))))
+    if os.path.exists(fn):
+        log.info("using font subset css {}".format(fn))
+        return fn
+    _write_atomic(
+        fn,
+        "\n".join(
+            rule.serialize()
+            for idx, rule in enumerate(rules)
+            if rule.type != "error" and (idx in needed or idx not in font_faces)
+        )
+        + "\n",
+    )
+    log.info("font subset css: kept {} of {} font faces".format(len(needed), len(font_faces)))
+    return fn
+
+
+if __name__ == "__main__":
+    precompile(*sys.argv[1:])
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+import os
+import re
+import tempfile
+
+from lxml import etree
+from pyPdf import PdfFileReader, PdfFileWriter
+from pyPdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    NameObject,
+    NumberObject,
+    createStringObject,
+)
+
+from .. import chunks, html2pdf
+
+book_html = """
+<html><head><meta charset="utf-8"/></head><body>
+<section id="title_page"><ul><li id="total_pages"> pages</li></ul></section>
+<section id="front_matter"><article id="table_of_contents"><ol>
+    <li><a href="#a1">One</a></li><li><a href="#a2">Two</a></li><li><a href="#a3">Three</a></li>
+</ol></article></section>
+<section id="articles">
+    <article><h1 id="a1">One</h1><p>text</p></article>
+    <article><h1 id="a2">Two</h1><p>text</p><a name="image_1_1"><img src="x.png"/></a></article>
+    <article><h1 id="a3">Three</h1><p>text</p></article>
+</section>
+<section id="appendix"><article>
+    <a class="img_reference" href="#image_1_1">see page</a>
+</article></section>
+</body></html>
+"""
+
+css = """
+/* comment { content: counter(pages) } */
+a.img_reference[href]::after {
+  content: " " target-counter(attr(href), page); }
+#front_matter #table_of_contents ol li A[href]::after, .toc A[href]::after {
+  content: leader(" . ") target-counter(attr(href), page);
+  font-weight: 300; }
+@page articles {
+  @bottom-right {
+    content: counter(page); } }
+.cover li#total_pages::before {
+  content: counter(pages); }
+"""
+
+
+def _book():
+    return etree.fromstring(book_html)
+
+
+def test_split():
+    root = _book()
+    book_chunks = chunks.split(root, 2)
+    assert [len(list(chunk.iter_nodes())) for chunk in book_chunks] == [2, 2, 1, 1]
+    assert book_chunks[1].parts[0][0].get("id") == "articles"
+
+    html = chunks.to_html(root, book_chunks[2], style="body { counter-reset: page 3; }")
+    chunk_root = etree.HTML(html)
+    assert [node.get("id") for node in chunk_root.find("body")] == ["articles"]
+    assert chunk_root.find("body/section/article/h1").text == "Three"
+    assert chunk_root.find("head/style").text == "body { counter-reset: page 3; }"
+    assert len(root.find("body/section[@id='articles']")) == 3  # the book is unchanged
+
+
+def test_page_ref_style():
+    root = _book()
+    book_chunks = chunks.split(root, 3)
+    hrefs = chunks.mark_page_refs(book_chunks)
+    assert hrefs == [["#a1", "#a2", "#a3"], [], [], [], ["#image_1_1"]]
+    assert root.find(".//a[@name='image_1_1']").get(chunks.page_ref_attr) == "image_1_1"
+    chunks.unmark_page_refs(root)
+    assert root.find(".//a[@name='image_1_1']").get(chunks.page_ref_attr) is None
+
+    rules = chunks.counter_rules(css)
+    assert len(rules) == 3
+    style = chunks.chunk_style(rules, 5, 12, {"image_1_1": 7}, ["#image_1_1"])
+    assert style.splitlines() == [
+        "body { counter-reset: page 5; }",
+        'a.img_reference[href][href="pp-chunk-link:image_1_1"]::after '
+        '{ content: " " "7" !important; }',
+        '#front_matter #table_of_contents ol li A[href][href="pp-chunk-link:image_1_1"]::after, '
+        '.toc A[href][href="pp-chunk-link:image_1_1"]::after '
+        '{ content: leader(" . ") "7" !important; }',
+        '.cover li#total_pages::before { content: "12" !important; }',
+    ]
+
+
+def test_carried_footers():
+    root = _book()
+    for idx, article in enumerate(root.find("body/section[@id='articles']"), 1):
+        article.set(chunks.footer_attr, 'Article "{}"'.format(idx))
+    book_chunks = chunks.split(root, 3)
+    # the appendix article sets no footer text, the one of the last article holds
+    assert chunks.carried_footers(book_chunks) == [None, None, None, None, 'Article "3"']
+    style = chunks.chunk_style([], 9, 10, {}, [], 'Article "3"')
+    assert style.splitlines() == [
+        "body { counter-reset: page 9; }",
+        'html { string-set: footer-text "Article \\"3\\""; }',
+    ]
+
+
+def _name_dict(**items):
+    """
+    PDF dictionary of items, the values of Type, Subtype and S are names
+    """
+    names = ("Type", "Subtype", "S")
+    return DictionaryObject(
+        (NameObject("/" + key), NameObject("/" + value) if key in names else value)
+        for key, value in items.items()
+    )
+
+
+def _pdf(filename, pages, uris=(), names=()):
+    """
+    Blank PDF with links to uris and a named destination and an outline item for
+    each of names on the first page
+    """
+    writer = PdfFileWriter()
+    for _ in range(pages):
+        writer.addBlankPage(100, 100)
+    first_page = writer.getObject(writer._pages)["/Kids"][0]
+    first_page.getObject()[NameObject("/Annots")] = ArrayObject(
+        _name_dict(
+            Type="Annot",
+            Subtype="Link",
+            Rect=ArrayObject([NumberObject(0)] * 4),
+            A=_name_dict(S="URI", URI=createStringObject(uri)),
+        )
+        for uri in uris
+    )
+    if names:
+        dest = ArrayObject([first_page, NameObject("/Fit")])
+        dests = ArrayObject()
+        for name in sorted(names):
+            dests.extend([createStringObject(name), dest])
+        outlines = writer._addObject(_name_dict(Type="Outlines"))
+        items = [
+            writer._addObject(
+                _name_dict(Title=createStringObject(name), Parent=outlines, Dest=dest)
+            )
+            for name in names
+        ]
+        for previous, item in zip(items, items[1:]):
+            previous.getObject()[NameObject("/Next")] = item
+            item.getObject()[NameObject("/Prev")] = previous
+        outlines.getObject().update(
+            _name_dict(First=items[0], Last=items[-1], Count=NumberObject(len(items)))
+        )
+        catalog = writer.getObject(writer._root)
+        catalog[NameObject("/Outlines")] = outlines
+        catalog[NameObject("/Names")] = _name_dict(Dests=_name_dict(Names=dests))
+    with open(filename, "wb") as f:
+        writer.write(f)
+
+
+def _link_targets(reader, page):
+    """
+    Return the targets of the links on a page as page indexes or destination names
+    """
+    page_indexes = dict(
+        (reader.getPage(idx).indirectRef.idnum, idx) for idx in range(reader.getNumPages())
+    )
+    targets = []
+    for annotation in reader.getPage(page).get("/Annots", []):
+        action = annotation.getObject()["/A"]
+        assert action["/S"] == "/GoTo"
+        dest = action["/D"]
+        targets.append(page_indexes[dest[0].idnum] if isinstance(dest, list) else dest)
+    return targets
+
+
+def test_merge_pdfs(tmpdir):
+    filenames = [str(tmpdir.join("{}.pdf".format(idx))) for idx in range(3)]
+    _pdf(filenames[0], 2, uris=["pp-chunk-link:a2", "pp-chunk-link:a3"])
+    _pdf(filenames[1], 2, names=["a2", "a2_1"])
+    _pdf(filenames[2], 1)
+    output_filename = str(tmpdir.join("book.pdf"))
+    chunks.merge_pdfs(filenames, output_filename, {"a2": 3, "a3": 5})
+
+    with open(output_filename, "rb") as f:
+        reader = PdfFileReader(f)
+        assert reader.getNumPages() == 5
+        # a2 is a named destination, a3 has none and links to its page
+        assert _link_targets(reader, 0) == ["a2", 4]
+        dests = reader.getNamedDestinations()
+        assert sorted(dests) == ["a2", "a2_1"]
+        assert dests["a2"].page.idnum == reader.getPage(2).indirectRef.idnum
+        outlines = reader.getOutlines()
+        assert [item.title for item in outlines] == ["a2", "a2_1"]
+        assert outlines[0].page.idnum == reader.getPage(2).indirectRef.idnum
+
+
+def test_render_chunks(tmpdir):
+    """
+    Every article and the front matter take two pages
+    """
+    rendered = []
+
+    def run_prince(html, pdf_filename, use_js=True, scripts=()):
+        pages = 2 * max(html.count("<article"), 1)
+        fd, log_filename = tempfile.mkstemp(dir=str(tmpdir))
+        with os.fdopen(fd, "w") as f:
+            if scripts == [html2pdf.page_refs_js_file]:
+                f.write("msg|out|page-count: {}\n".format(pages))
+                for target in re.findall(r'data-pp-page-ref="([^"]+)"', html):
+                    f.write("msg|out|page-ref: {} 2\n".format(target))
+        if pdf_filename != os.devnull:
+            body = html.split("<body")[1]
+            _pdf(pdf_filename, pages, re.findall(r'href="(pp-chunk-link:[^"]+)"', body))
+            rendered.append(html)
+        return log_filename
+
+    writer = html2pdf.PrincePdfWriter.__new__(html2pdf.PrincePdfWriter)
+    writer.render_chunks = 3
+    writer.debug = False
+    writer.pdf_output_filename = str(tmpdir.join("book.pdf"))
+    writer.css_file = str(tmpdir.join("book.css"))
+    tmpdir.join("book.css").write(css)
+    writer._run_prince = run_prince
+    root = _book()
+    writer._render_chunks(root)
+
+    with open(writer.pdf_output_filename, "rb") as f:
+        reader = PdfFileReader(f)
+        assert reader.getNumPages() == 10
+        # the links of the table of contents point to the first pages of the articles
+        assert _link_targets(reader, 0) == [3, 5, 7]
+    # the chunks are rendered in parallel, the style of every chunk mentions the toc
+    toc = [html for html in rendered if 'id="table_of_contents"' in html][0].split("<body")[0]
+    assert "counter-reset: page 1;" in toc
+    assert 'A[href][href="pp-chunk-link:a2"]::after' in toc
+    assert '"6" !important' in toc  # page 2 of the chunk starting at page 5
+    assert '#total_pages::before { content: "10" !important; }' in toc
+    assert not root.xpath("//*[@{}]".format(chunks.page_ref_attr))
+    assert root.xpath("//a/@href")[:3] == ["#a1", "#a2", "#a3"]
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+import gettext
+import pickle
+import sys
+
+import mock
+from lxml import etree
+
+from .. import html2pdf, utils
+from ..collection import Article
+from ..htmlfilters import misc, sizetools
+
+article_html = """
+<html><body><div id="mw-content-text">
+    <p>Article {nr}</p>
+    <a href="./File:Img{nr}.jpg" title="File:Img{nr}.jpg"><img src="./Img{nr}.jpg"/></a>
+    <a href="./File:Shared.jpg" title="File:Shared.jpg"><img src="./Shared.jpg"/></a>
+</div></body></html>
+"""
+
+
+def _item(nr):
+    item = mock.MagicMock()
+    item.type = "article"
+    item.title = "Article {}".format(nr)
+    item.displaytitle = None
+    item.wiki.getHTML.return_value = {"text": {"*": article_html.format(nr=nr)}}
+    item.wiki.getURL.return_value = "https://example.org/{}".format(nr)
+    item.wiki.getSource.return_value = None
+    item.wiki.getAuthors.return_value = ["Author {}".format(nr)]
+    return item
+
+
+def _writer(workers):
+    gettext.NullTranslations().install(unicode=True)
+    writer = html2pdf.PrincePdfWriter.__new__(html2pdf.PrincePdfWriter)
+    writer.env = mock.MagicMock()
+    writer.env.metabook.items = list(range(4))
+    writer.env.metabook.walk.return_value = [_item(nr) for nr in range(4)]
+    writer.env.images.getDiskPath.return_value = None
+    writer.imgDB = writer.env.images
+    writer.imgDB.getDescriptionURL.return_value = "https://example.org/image"
+    writer.imgDB.getContributors.return_value = ["Photographer"]
+    writer.license_checker = mock.MagicMock()
+    writer.license_checker.getLicenseDisplayName.return_value = "CC"
+    writer.license_checker.displayImage.return_value = True
+    writer.articles = []
+    writer.image_metadata = {}
+    writer.img_count = 0
+    writer.filter_profile = None
+    writer.filter_cache = None
+    writer.workers = workers
+    return writer
+
+
+def test_article_pickling():
+    article = Article(title="Title", html=article_html.format(nr=1), idx=3, env=mock.MagicMock())
+    article.dom = misc.parse(article.html)
+    shipped = pickle.loads(pickle.dumps(article, pickle.HIGHEST_PROTOCOL))
+    assert shipped.env is None and shipped.html is None
+    assert (shipped.title, shipped.idx) == ("Title", 3)
+    assert etree.tostring(shipped.dom) == etree.tostring(article.dom)
+
+
+def _assemble(writer):
+    section = etree.Element("section")
+    writer._append_articles(section)
+    return utils.tree_to_string(section)
+
+
+def test_parallel_filtering_is_deterministic():
+    sequential = _writer(workers=1)
+    sequential_html = _assemble(sequential)
+    parallel = _writer(workers=2)
+    parallel.pending_per_worker = 1
+    parallel_html = _assemble(parallel)
+
+    assert [a.idx for a in parallel.articles] == [1, 2, 3, 4]
+    assert parallel.image_metadata == sequential.image_metadata
+    assert parallel.image_metadata["File:Shared.jpg"][6] == 4
+    assert parallel_html == sequential_html
+    assert sequential_html.count("<article") == 4
+
+
+def test_articles_are_released():
+    writer = _writer(workers=1)
+    _assemble(writer)
+    assert all(article.dom is None and article.html is None for article in writer.articles)
+    assert [article.title for article in writer.articles] == [
+        "Article {}".format(nr) for nr in range(4)
+    ]
+
+
+def test_parse_render_output(tmpdir):
+    render_log = tmpdir.join("render.log")
+    render_log.write(
+        "msg|out|unrelated output\n"
+        "dat|boxes|[[1, 100.5, 20], [2, 50, 10.25]]\n"
+        "msg|wrn|some warning\n"
+        "dat|boxes|[[4, 30, 5]]\n"
+        "dat|total-page-count|1\n"
+    )
+    root = misc.parse("<html><body><div><p>a</p><p>b</p></div><p>c</p></body></html>")
+    writer = html2pdf.PrincePdfWriter.__new__(html2pdf.PrincePdfWriter)
+    writer.measure_all = True
+    writer._tag_nodes(root)
+    writer._parse_render_output(root, writer._read_render_log(str(render_log)))
+
+    sizes = [(node.tag, node.get("box_width"), node.get("box_height")) for node in root.iter()]
+    assert sizes == [
+        ("html", None, None),
+        ("body", "100.50", "20.00"),
+        ("div", "50.00", "10.25"),
+        ("p", "0.00", "0.00"),
+        ("p", "30.00", "5.00"),
+        ("p", "0.00", "0.00"),
+    ]
+
+
+# data-w is the width reported by the fake measurement
+book_html = """
+<html><body><section id="articles">
+<article><h1>One</h1><div>
+    <p data-w="900">wide text outside of tables</p>
+    <table data-w="200"><tr><td data-w="300"><table data-w="540"><tr><td>x</td></tr></table>
+    </td></tr></table>
+    <table class="infobox" data-w="800"><tr><td>info</td></tr></table>
+</div></article>
+<article><h1>Two</h1><div>
+    <table data-w="150" width="500"><tr><td data-w="120"><p>y</p></td></tr></table>
+    <table data-w="450"><tr><td><span data-w="40">z</span></td></tr></table>
+    <table data-w="2000"><tr><td>huge</td></tr></table>
+</div></article>
+</section></body></html>
+"""
+
+
+def _measure(measure_all):
+    root = misc.parse(book_html)
+    writer = html2pdf.PrincePdfWriter.__new__(html2pdf.PrincePdfWriter)
+    writer.measure_all = measure_all
+    writer._tag_nodes(root)
+    records = [
+        [int(node.get("boxid")), float(node.get("data-w") or 10), 12]
+        for node in root.iter()
+        if node.get("boxid")
+    ]
+    writer._post_width_hook(root, records)
+    sizetools.remove_node_size_attrs(root)
+    root.attrib.pop("boxid", None)
+    return utils.tree_to_string(root), len(records)
+
+
+def test_selective_measurement_is_equivalent():
+    full, full_count = _measure(True)
+    selective, selective_count = _measure(False)
+    assert selective == full
+    assert selective_count < full_count
+    assert "col-" in full and "over-wide" in full and "rotated-table" in full
+
+
+# writes more output than a pipe holds before reading the rest of its input
+fake_prince = b"""
+import sys
+sys.stdin.readline()
+for _ in range(5000):
+    sys.stdout.write("msg|out|" + "x" * 100 + "\\n")
+sys.stdout.write("dat|boxes|[[1, 10, 2]]\\n")
+sys.stdout.write("msg|err|broken image\\n")
+sys.stdout.write("dat|boxes|[[2, %d, 3]]\\n" % len(sys.stdin.read()))
+"""
+
+
+def test_stream_measurement(tmpdir):
+    script = tmpdir.join("prince.py")
+    script.write(fake_prince)
+    writer = html2pdf.PrincePdfWriter.__new__(html2pdf.PrincePdfWriter)
+    writer.stream_measurement = True
+    writer.prince_pool = None
+    writer.js_file = html2pdf.js_file
+    writer.css_file = "base.css"
+    html = "<html>\n" + "<p>text</p>" * 100000
+    with mock.patch.object(html2pdf, "prince_cmd", [sys.executable, str(script)]):
+        assert writer._measure(html) == [[1, 10, 2], [2, len(html) - 7, 3]]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+import mock
+from lxml import etree
+
+from .. import html2pdf, measure_cache
+from ..htmlfilters import misc
+
+# data-w is the width reported by the fake measurement
+article_html = """
+<article><h1>{title}</h1><p>text</p>
+    <table data-w="{width}"><tr><td data-w="20">cell</td></tr></table>
+</article>
+"""
+
+
+def _book(*articles):
+    html = "<html><head></head><body><section id='title_page'><h1>Book</h1></section>"
+    html += "<section id='articles'>"
+    html += "".join(article_html.format(title=title, width=width) for title, width in articles)
+    html += "<article><h1>Without tables</h1><p>text</p></article>"
+    html += "</section></body></html>"
+    return misc.parse(html)
+
+
+class FakeMeasureWriter(html2pdf.PrincePdfWriter):
+    def __init__(self, cache_dir, css_fn):
+        self.measure_all = False
+        self.debug = False
+        self.measured = []
+        self.measure_cache = measure_cache.MeasureCache(
+            cache_dir, 1024 * 1024, css_fn, html2pdf.js_file
+        )
+
+    def _measure(self, html):
+        root = etree.HTML(html)
+        self.measured.append([node.text for node in root.iter("h1")])
+        return [
+            [int(node.get("boxid")), float(node.get("data-w") or 10), 12]
+            for node in root.iter()
+            if node.get("boxid")
+        ]
+
+
+def _sizes(writer, root):
+    writer._tag_nodes(root)
+    writer._parse_render_output(root, writer._measure_book(root))
+    return [(node.get("data-w"), node.get("box_width")) for node in root.iter("table", "td")]
+
+
+def test_measure_cache(tmpdir):
+    css_fn = tmpdir.join("book.css")
+    css_fn.write("body { width: 10cm; }")
+    writer = FakeMeasureWriter(str(tmpdir.join("cache")), str(css_fn))
+    assert _sizes(writer, _book(("A", 100), ("B", 200))) == [
+        ("100", "100.00"),
+        ("20", "20.00"),
+        ("200", "200.00"),
+        ("20", "20.00"),
+    ]
+    assert writer.measured == [["A", "B"]]
+
+    # boxids are shifted by the new article
+    sizes = _sizes(writer, _book(("C", 300), ("A", 100), ("B", 200)))
+    assert sizes[0] == ("300", "300.00") and sizes[2:] == [
+        ("100", "100.00"),
+        ("20", "20.00"),
+        ("200", "200.00"),
+        ("20", "20.00"),
+    ]
+    assert writer.measured == [["A", "B"], ["C"]]
+
+    _sizes(writer, _book(("B", 200), ("C", 300)))
+    assert len(writer.measured) == 2  # all articles are cached
+
+    css_fn.write("body { width: 12cm; }")
+    writer = FakeMeasureWriter(str(tmpdir.join("cache")), str(css_fn))
+    _sizes(writer, _book(("B", 200)))
+    assert writer.measured == [["B"]]
+
+
+def test_style_key(tmpdir):
+    css_fn = tmpdir.join("book.css")
+    css_fn.write("body { width: 10cm; }")
+    font_fn = tmpdir.join("fonts", "serif.ttf")
+    font_fn.write("glyphs", ensure=True)
+
+    def style_key():
+        cache = measure_cache.MeasureCache(
+            str(tmpdir.join("cache")), 1024 * 1024, str(css_fn), html2pdf.js_file
+        )
+        return cache.style_key
+
+    with mock.patch.object(measure_cache, "font_dirs", [str(tmpdir.join("fonts"))]):
+        with mock.patch.object(measure_cache, "prince_version", return_value=b"Prince 12"):
+            key = style_key()
+            assert style_key() == key
+            font_fn.write("other glyphs")
+            assert style_key() != key
+            key = style_key()
+        with mock.patch.object(measure_cache, "prince_version", return_value=b"Prince 13"):
+            assert style_key() != key
+
+
+def test_prince_version_without_prince():
+    with mock.patch.object(measure_cache.prince, "prince_cmd", ["/nonexistent/prince"]):
+        assert measure_cache.prince_version() is None
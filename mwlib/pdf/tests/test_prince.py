@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+import sys
+
+import pytest
+
+from .. import prince, procstats
+
+# speaks the control protocol, the PDF is the input reversed
+fake_prince = b"""
+import json, os, sys
+
+def write(tag, data):
+    sys.stdout.write("%s %d\\n%s\\n" % (tag, len(data), data))
+    sys.stdout.flush()
+
+def read():
+    tag, length = sys.stdin.readline().split()
+    data = sys.stdin.read(int(length))
+    sys.stdin.read(1)
+    return tag, data
+
+write("ver", "fake 1.0")
+while True:
+    tag, data = read()
+    if tag == "end":
+        break
+    job = json.loads(data)
+    resources = [read()[1] for _ in range(job["job-resource-count"])]
+    if resources[0] == "crash":
+        sys.exit(1)
+    if resources[0] != "fail":
+        write("pdf", resources[0][::-1])
+    write("log", "msg|out|pid: %d\\nfin|success\\n" % os.getpid())
+"""
+
+
+@pytest.fixture
+def pool(tmpdir):
+    script = tmpdir.join("prince.py")
+    script.write(fake_prince)
+    pool = prince.PrincePool(size=1, max_jobs=2, cmd=[sys.executable, str(script)])
+    yield pool
+    pool.close()
+
+
+def _pid(render_log):
+    return render_log.splitlines()[0].split(": ")[1]
+
+
+def test_pool_reuses_and_recycles_processes(pool):
+    job = {"input": {"src": "job-resource:0", "type": "html"}}
+    pdf, first = pool.convert(job, [b"<html/>"])
+    assert pdf == b">/lmth<"
+    assert pool.convert(job, [b"fail"])[0] is None
+    pdf, third = pool.convert(job, [b"<p/>"])
+    assert pdf == b">/p<"
+    assert _pid(first) != _pid(third)  # recycled after max_jobs
+
+
+def test_pool_replaces_crashed_processes(pool):
+    job = {"input": {"src": "job-resource:0"}}
+    with pytest.raises(prince.PrinceError):
+        pool.convert(job, [b"crash"])
+    assert pool.convert(job, [b"ok"])[0] == b"ko"
+    assert not pool.disabled
+
+
+def test_pool_is_disabled_if_prince_fails_to_start():
+    pool = prince.PrincePool(cmd=[sys.executable, "-c", "import sys; sys.exit(2)"])
+    with pytest.raises(prince.PrinceError):
+        pool.convert({}, [b""])
+    assert pool.disabled
+    with pytest.raises(prince.PrinceError):
+        pool.convert({}, [b""])
+
+
+def test_pool_reads_file_resources(pool, tmpdir):
+    resource = tmpdir.join("book.html")
+    resource.write(b"<html/>")
+    with resource.open("rb") as f:
+        assert pool.convert({}, [f])[0] == b">/lmth<"
+
+
+def test_pool_records_jobs(pool):
+    procstats.reset()
+    pool.convert({}, [b"<html/>"])
+    pool.convert({}, [b"<html/>"])
+    stats = procstats.take()["prince"]
+    assert stats["count"] == 2
+    assert stats["max_rss"] > 0
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+import os
+import subprocess
+import sys
+
+from .. import procstats
+
+# allocates about 64MB and burns some CPU
+child = "data = b'x' * (64 * 1024 * 1024); sum(range(2000000))"
+
+
+def test_popen_records_resources():
+    procstats.reset()
+    p = procstats.Popen([sys.executable, "-c", child], stdout=subprocess.PIPE)
+    p.communicate()
+    assert p.returncode == 0
+    assert p.poll() == 0
+    stats = procstats.take()
+    entry = stats[os.path.basename(sys.executable)]
+    assert entry["count"] == 1
+    assert entry["max_rss"] > 60
+    assert entry["user"] + entry["sys"] > 0
+    assert entry["wall"] >= entry["user"]
+    assert procstats.snapshot() == {}
+
+    procstats.merge(stats)
+    procstats.merge(stats)
+    assert procstats.snapshot()[os.path.basename(sys.executable)]["count"] == 2
+
+
+def test_sample():
+    user, system, max_rss = procstats.sample(os.getpid())
+    assert user > 0 and max_rss > 0
+    assert procstats.sample(-1) == (0.0, 0.0, 0.0)
+
+
+def test_reaped_elsewhere():
+    procstats.reset()
+    p = procstats.Popen([sys.executable, "-c", "pass"])
+    os.waitpid(p.pid, 0)
+    assert p.wait() is None
+    assert p.returncode is None
+    assert procstats.take() == {}
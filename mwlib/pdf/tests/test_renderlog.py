@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+from .. import renderlog
+
+measure_log = """msg|inf||loading document
+msg|wrn|file:///tmp/book.html:12:|no font for Devanagari character U+0915, fallback to '?'
+msg|wrn|file:///tmp/book.html:30:|no font for Devanagari character U+0916, fallback to '?'
+msg|wrn|file:///tmp/images/a.png|can't open input file: No such file or directory
+msg|err|unsupported image format
+dat|boxes|[[1, 10, 2]]
+dat|phase-time|layout 1.5
+dat|total-page-count|12
+dat|phase-time|analyze 0.25
+fin|success
+"""
+
+
+def test_render_log():
+    render_log = renderlog.RenderLog()
+    assert list(render_log.watch(measure_log.splitlines(True))) == measure_log.splitlines(True)
+    render_log.feed(["msg|wrn||some warning\n", "dat|total-page-count|3\n", "malformed\n"])
+
+    metrics = render_log.metrics()
+    assert metrics["runs"] == 2
+    assert metrics["page_count"] == 15
+    assert metrics["messages"] == {"infos": 1, "warnings": 4, "errors": 1}
+    assert metrics["phase_times"] == {"layout": 1.5, "analyze": 0.25}
+    assert metrics["missing_fonts"] == {"Devanagari": 2}
+    assert metrics["missing_images"] == {
+        "file:///tmp/images/a.png": 1,
+        "unsupported image format": 1,
+    }
+    assert list(metrics["warnings"].values()) == [1, 1, 1, 1, 1]
+    assert render_log.summary() == (
+        "2 runs, 15 pages, 4 warnings, 1 errors, 1 missing fonts, 2 missing images"
+    )
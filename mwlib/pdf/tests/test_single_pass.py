@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+import json
+import os
+import subprocess
+from collections import OrderedDict
+
+import pytest
+from lxml import etree
+
+from .. import config, html2pdf
+from ..htmlfilters import misc, sizetools
+from ..prince import PrinceError
+from .test_html2pdf import book_html
+
+# minimal DOM for single_pass.js, getPrinceBoxes reports data-w as box width
+dom_shim = """
+var fs = require("fs");
+var singlePass = require(process.argv[2]);
+
+function Element(data, parent, doc) {
+    this.nodeType = 1;
+    this.tagName = data.tag;
+    this.attributes = data.attrib;
+    this.parentNode = parent;
+    this.ownerDocument = doc;
+    var self = this;
+    this.children = (data.children || []).map(function(child) {
+        return new Element(child, self, doc);
+    });
+}
+Element.prototype = {
+    get firstChild() { return this.children[0] || null; },
+    get nextSibling() {
+        var siblings = this.parentNode ? this.parentNode.children : [];
+        return siblings[siblings.indexOf(this) + 1] || null;
+    },
+    getAttribute: function(name) {
+        return name in this.attributes ? this.attributes[name] : null;
+    },
+    setAttribute: function(name, value) { this.attributes[name] = String(value); },
+    removeAttribute: function(name) { delete this.attributes[name]; },
+    getPrinceBoxes: function() {
+        return [{w: parseFloat(this.getAttribute("data-w") || "10")}];
+    },
+    getElementsByTagName: function(tag) {
+        var result = [];
+        (function walk(node) {
+            node.children.forEach(function(child) {
+                if (child.tagName === tag) {
+                    result.push(child);
+                }
+                walk(child);
+            });
+        })(this);
+        return result;
+    },
+    insertBefore: function(node, reference) {
+        node.parentNode = this;
+        this.children.splice(this.children.indexOf(reference), 0, node);
+    },
+    appendChild: function(node) {
+        var siblings = node.parentNode.children;
+        siblings.splice(siblings.indexOf(node), 1);
+        node.parentNode = this;
+        this.children.push(node);
+    },
+    toJSON: function() {
+        return {tag: this.tagName, attrib: this.attributes, children: this.children};
+    }
+};
+
+var doc = {createElement: function(tag) { return new Element({tag: tag, attrib: {}}, null, doc); }};
+var root = new Element(JSON.parse(fs.readFileSync(0, "utf8")), null, doc);
+var layoutConfig = JSON.parse(process.argv[3]);
+singlePass.resizableTables(root).forEach(function(table) {
+    singlePass.resizeTable(table, singlePass.subtreeWidth(table), layoutConfig);
+});
+process.stdout.write(JSON.stringify(root));
+"""
+
+
+def _to_json(node):
+    return {
+        "tag": node.tag,
+        "attrib": dict(node.attrib),
+        "children": [_to_json(child) for child in node],
+    }
+
+
+def _from_json(data):
+    node = etree.Element(data["tag"], **data["attrib"])
+    node.extend(_from_json(child) for child in data["children"])
+    return node
+
+
+def _normalized(root):
+    sizetools.remove_node_size_attrs(root)
+    for node in root.iter():
+        node.text = node.tail = None
+        node.attrib.pop("boxid", None)
+        if node.get("style") is not None:
+            node.set("style", ";".join(sorted(node.get("style").split(";"))))
+        attrib = sorted(node.attrib.items())
+        node.attrib.clear()
+        node.attrib.update(attrib)
+    return etree.tostring(root)
+
+
+def _two_pass(root):
+    writer = html2pdf.PrincePdfWriter.__new__(html2pdf.PrincePdfWriter)
+    writer.measure_all = False
+    writer._tag_nodes(root)
+    records = [
+        [int(node.get("boxid")), float(node.get("data-w") or 10), 12]
+        for node in root.iter()
+        if node.get("boxid")
+    ]
+    writer._post_width_hook(root, records)
+    return _normalized(root)
+
+
+def _single_pass(root, tmpdir):
+    shim = tmpdir.join("shim.js")
+    shim.write(dom_shim)
+    layout_config = {
+        "columns": list(config.columns.values()),
+        "toleratedOverWidth": config.tolerated_over_width,
+    }
+    p = subprocess.Popen(
+        ["node", str(shim), html2pdf.single_pass_js_file, json.dumps(layout_config)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    out, _ = p.communicate(json.dumps(_to_json(root)).encode("utf-8"))
+    assert p.returncode == 0
+    return _normalized(_from_json(json.loads(out.decode("utf-8"))))
+
+
+def _has_node():
+    try:
+        return subprocess.call(["node", "--version"], stdout=subprocess.PIPE) == 0
+    except OSError:
+        return False
+
+
+@pytest.mark.skipif(not _has_node(), reason="node is not installed")
+def test_single_pass_is_equivalent(tmpdir):
+    single = _single_pass(misc.parse(book_html), tmpdir)
+    assert single == _two_pass(misc.parse(book_html))
+    assert b"col-" in single and b"over-wide" in single and b"rotated-table" in single
+
+
+def _fixture(name):
+    """
+    Parse a filtered article of the filter tests, data-w is 5pt per character of text
+    """
+    extra = os.path.join(os.path.dirname(html2pdf.__file__), "htmlfilters", "test", "extra")
+    with open(os.path.join(extra, name)) as f:
+        root = misc.parse(f.read())
+    etree.strip_tags(root, etree.Comment, etree.ProcessingInstruction)
+    for node in root.iter():
+        node.attrib.pop("boxid", None)  # left over from the render the fixture was saved from
+        node.set("data-w", str(5 * len(node.xpath("normalize-space()"))))
+    return root
+
+
+@pytest.mark.skipif(not _has_node(), reason="node is not installed")
+@pytest.mark.parametrize("name", ["test_image_table.html", "test_markup_header.html"])
+def test_single_pass_is_equivalent_on_articles(tmpdir, name):
+    single = _single_pass(_fixture(name), tmpdir)
+    assert single == _two_pass(_fixture(name))
+    assert single != _normalized(_fixture(name))  # tables were resized
+
+
+def _render_single_pass(tmpdir, render_log, pdf=b"%PDF"):
+    def run_prince(html, pdf_filename, use_js=True, scripts=()):
+        if pdf:
+            tmpdir.join("book.pdf").write(pdf, mode="wb")
+        tmpdir.join("render.log").write(render_log)
+        return str(tmpdir.join("render.log"))
+
+    writer = html2pdf.PrincePdfWriter.__new__(html2pdf.PrincePdfWriter)
+    writer.pdf_output_filename = str(tmpdir.join("book.pdf"))
+    writer.js_config_file = None
+    writer.memory_stages, writer.stage_times, writer.render_logs = {}, {}, OrderedDict()
+    writer._run_prince = run_prince
+    return writer._render_single_pass(misc.parse(book_html))
+
+
+def test_single_pass_fallback(tmpdir):
+    assert _render_single_pass(tmpdir, "dat|single-pass|3\nfin|success\n") is True
+    # prince without post layout functions renders without running the script
+    assert _render_single_pass(tmpdir, "msg|err||not supported\nfin|success\n") is False
+    with pytest.raises(PrinceError):
+        _render_single_pass(tmpdir, "msg|err||bad input\nfin|failure\n")
+    tmpdir.join("book.pdf").remove()
+    with pytest.raises(PrinceError):
+        _render_single_pass(tmpdir, "", pdf=None)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+import io
+import os
+
+import mock
+
+from .. import config, html2pdf, stylesheets
+from ..htmlfilters import misc
+
+
+def test_compiled_css_is_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr(stylesheets, "precompiled_dir", str(tmpdir.join("compiled")))
+    cache_dir = str(tmpdir.join("cache"))
+    css_fn = stylesheets.compiled_css(html2pdf.scss_file, cache_dir)
+    assert os.path.dirname(css_fn) == cache_dir
+    assert os.path.exists(css_fn + ".map")
+    with io.open(css_fn, encoding="utf-8") as f:
+        assert "margin: {}pt".format(config.page_margins[0]) in f.read()
+
+    with mock.patch.object(stylesheets.sass, "compile") as compile_sass:
+        assert stylesheets.compiled_css(html2pdf.scss_file, cache_dir) == css_fn
+        assert not compile_sass.called
+    name = os.path.basename(css_fn)
+    assert sorted(os.listdir(cache_dir)) == [name, name + ".map"]
+
+    with mock.patch.object(stylesheets, "page_margins", [10, 10, 10, 10]):
+        other_fn = stylesheets.compiled_css(html2pdf.scss_file, cache_dir)
+    assert other_fn != css_fn
+    with io.open(other_fn, encoding="utf-8") as f:
+        assert "margin: 10pt 10pt 10pt 10pt" in f.read()
+
+
+def test_precompiled_css(tmpdir, monkeypatch):
+    precompiled_dir = str(tmpdir.join("compiled"))
+    monkeypatch.setattr(stylesheets, "precompiled_dir", precompiled_dir)
+    monkeypatch.setattr(stylesheets, "page_formats", {"a4": (595, 842), "letter": (612, 792)})
+    stylesheets.precompile(html2pdf.scss_file, precompiled_dir)
+    assert sorted(os.listdir(precompiled_dir)) == ["base-a4.css", "base-letter.css", "index.json"]
+    with io.open(os.path.join(precompiled_dir, "base-letter.css"), encoding="utf-8") as f:
+        assert "size: letter;" in f.read()
+
+    with mock.patch.object(stylesheets.sass, "compile") as compile_sass:
+        css_fn = stylesheets.compiled_css(html2pdf.scss_file, str(tmpdir.join("cache")))
+        assert css_fn == os.path.join(precompiled_dir, "base-a4.css")
+        assert not compile_sass.called
+
+    # unknown geometries are compiled at render time
+    with mock.patch.object(stylesheets, "page_width_pt", 600):
+        css_fn = stylesheets.compiled_css(html2pdf.scss_file, str(tmpdir.join("cache")))
+    assert os.path.dirname(css_fn) == str(tmpdir.join("cache"))
+    with io.open(css_fn, encoding="utf-8") as f:
+        assert "size: 600pt 842pt;" in f.read()
+
+
+def test_layout_config(tmpdir):
+    fn = stylesheets.layout_config(str(tmpdir))
+    assert stylesheets.layout_config(str(tmpdir)) == fn
+    with open(fn) as f:
+        assert f.read() == stylesheets.layout_config_js()
+
+
+prune_css = """@charset "UTF-8";
+@page { size: a4; }
+p, .missing { margin: 0; }
+div.infobox > table td { color: red; }
+.gallery li:not(.missing) { float: left; }
+#toc a[href]::after, math mi { content: "x"; }
+@media print { .missing { color: blue; } p.lead { color: green; } }
+"""
+
+
+def test_prune(tmpdir):
+    root = misc.parse(
+        "<html><body><div id='toc'><a href='#x'>x</a></div>"
+        "<div class='infobox'><table><tr><td>a</td></tr></table></div>"
+        "<p class='lead'>text</p></body></html>"
+    )
+    pruned = stylesheets.prune(prune_css, stylesheets.vocabulary(root))
+    assert pruned == (
+        '@charset "UTF-8";\n'
+        "@page { size: a4; }\n"
+        "p { margin: 0; }\n"
+        "div.infobox > table td { color: red; }\n"
+        '#toc a[href]::after { content: "x"; }\n'
+        "@media print {\n"
+        "p.lead { color: green; }\n"
+        "}\n"
+    )
+
+    css_file = tmpdir.join("base.css")
+    css_file.write(prune_css)
+    pruned_fn = stylesheets.pruned_css(str(css_file), root, str(tmpdir.join("cache")))
+    assert io.open(pruned_fn, encoding="utf-8").read() == pruned
+    with mock.patch.object(stylesheets, "prune") as prune:
+        assert stylesheets.pruned_css(str(css_file), root, str(tmpdir.join("cache"))) == pruned_fn
+        assert not prune.called
+
+
+font_css = """body { font-family: pp-serif, prince-no-fallback; }
+@font-face { font-family: pp-serif; unicode-range: U+3000-4DFF, U+4E00-9FCC; src: local("CJK"); }
+@font-face { font-family: pp-serif; unicode-range: U+09??; src: prince-lookup("Devanagari"); }
+@font-face { font-family: pp-serif; unicode-range: U+0400-04FF; src: prince-lookup("Cyrillic"); }
+@font-face { font-family: pp-serif; src: local("Charis SIL"); }
+li::before { content: "Ж"; }
+"""
+
+
+def test_font_subset_css(tmpdir):
+    css_file = tmpdir.join("base.css")
+    css_file.write_text(font_css, "utf-8")
+    root = misc.parse("<html><body><p>Hindi: क</p></body></html>")
+    fn = stylesheets.font_subset_css(str(css_file), root, str(tmpdir))
+    with io.open(fn, encoding="utf-8") as f:
+        css = f.read()
+    fonts = [line.split('"')[1] for line in css.splitlines() if "@font-face" in line]
+    assert fonts == ["Devanagari", "Cyrillic", "Charis SIL"]  # Cyrillic for the bullet
+    assert css.startswith("body { font-family: pp-serif, prince-no-fallback; }")
+
+    root = misc.parse("<html><body><p>中文 ख</p></body></html>")
+    assert stylesheets.font_subset_css(str(css_file), root, str(tmpdir)) != fn
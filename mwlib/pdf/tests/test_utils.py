@@ -3,6 +3,8 @@
 
 from __future__ import unicode_literals, print_function
 
+import io
+
 import mock
 import pytest
 from lxml import etree
@@ -243,3 +245,83 @@ def test_remove_node_height():
     with mock.patch("mwlib.pdf.utils.change_node_height"):
         utils.remove_node_height(tree)
         utils.change_node_height.assert_called_once_with(tree, None)
+
+
+def test_serialize_tree():
+    tree = etree.HTML("<div><p>text <i>x</i></p><!-- c --><p></p></div>")
+    tree.find(".//i").tail = ""
+    tree.find(".//p").text = ""
+    restored = utils.parse_tree(utils.serialize_tree(tree))
+    assert utils.tree_to_string(restored) == utils.tree_to_string(tree)
+    assert restored.find(".//i").tail == ""
+    assert utils.parse_tree(utils.serialize_tree(etree.fromstring("<p/>"))).tag == "p"
+
+
+def test_write_tree():
+    tree = etree.HTML(
+        "<html><head><meta charset='utf-8'><style>a > b {}</style></head>"
+        "<body>text<section><p>wörld<img src='x'><br><span>a</span></p><!-- c --></section>"
+        "tail<p>last</p></body></html>"
+    )
+    f = io.BytesIO()
+    utils.write_tree(tree, f)
+    assert f.getvalue() == utils.tree_to_string(tree, pretty_print=False)
+
+
+def test_class_index():
+    tree = etree.fromstring(
+        '<div><div class="thumb tright"><div class="thumbinner"/></div>'
+        '<div class="thumb tmulti"/><p class="thumb"/></div>'
+    )
+    fallback = [node.get("class") for node in utils.find_class(tree, "thumb", tag="div")]
+    assert fallback == ["thumb tright", "thumb tmulti"]
+    with utils.indexed_classes(tree) as index:
+        indexed = [node.get("class") for node in utils.find_class(tree, "thumb", tag="div")]
+        assert indexed == fallback
+        assert len(utils.find_class(tree, "thumb", exclude=["tmulti"])) == 2
+
+        # updates through utils
+        inner = index.find("thumbinner")[0]
+        utils.append_class(inner, "thumb")
+        utils.remove_class(tree[1], "thumb")
+        wrapper = utils.wrap_node(tree[2], "div", {"class": "thumb wrapper"})
+        assert [node.get("class") for node in index.find("thumb")] == [
+            "thumb tright",
+            "thumbinner thumb",
+            "thumb wrapper",
+            "thumb",
+        ]
+
+        # removed nodes and classes set without utils are skipped
+        tree.remove(wrapper)
+        tree[0].set("class", "tright")
+        assert [node.get("class") for node in index.find("thumb")] == ["thumbinner thumb"]
+        assert index.unindexed() == []
+        tree.append(etree.Element("span", {"class": "new"}))
+        assert index.unindexed() == [tree[-1]]
+
+        # nodes inserted after indexing are found in document order
+        later = etree.Element("p", {"class": "late"})
+        tree.insert(1, later)
+        utils.index_classes(later)
+        assert index.find("late") == [later]
+        earlier = etree.Element("p", {"class": "late"})
+        tree.insert(1, earlier)
+        utils.index_classes(earlier)
+        assert index.find("late") == [earlier, later]
+    assert utils.class_index is None
+
+
+def test_cached_styles():
+    node = etree.fromstring('<div style="width: 10px; color: red"/>')
+    uncached = utils.get_node_style(node)
+    with utils.cached_styles() as cache:
+        style = utils.get_node_style(node)
+        assert style == uncached
+        style["width"] = "20px"
+        assert utils.get_node_style(node) == uncached
+        utils.add_node_style(node, "height", "5px")
+        assert "height:5px" in node.get("style")
+        assert utils.get_node_style(node)["height"] == "5px"
+        assert len(cache) == 2
+    assert utils.style_cache is None
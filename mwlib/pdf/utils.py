@@ -4,6 +4,8 @@
 import gzip
 import json
 import re
+from collections import defaultdict
+from contextlib import contextmanager
 
 import tinycss2
 from lxml import etree
@@ -29,19 +31,79 @@ def iter_articles(articlelist_fn):
         yield article_info
 
 
-def tree_to_string(tree, use_doctype_html=False):
+def tree_to_string(tree, use_doctype_html=False, pretty_print=True):
     """
     Transform DOM-tree to HTML
     """
     return etree.tostring(
         tree,
-        pretty_print=True,
+        pretty_print=pretty_print,
         encoding="utf-8",
         method="html",
         doctype="<!DOCTYPE html>" if use_doctype_html else None,
     )
 
 
+def write_tree(tree, f, pretty_print=False):
+    """
+    Write DOM-tree as HTML to the file object f without building the document in memory
+
+    The children of the body are serialized one by one, lxml flushes its output
+    buffer to f while serializing.
+    """
+    with etree.htmlfile(f, encoding="utf-8") as xf:
+        with xf.element(tree.tag, dict(tree.attrib)):
+            if tree.text:
+                xf.write(tree.text)
+            for child in tree:
+                if child.tag != "body":
+                    xf.write(child, pretty_print=pretty_print)
+                    continue
+                with xf.element(child.tag, dict(child.attrib)):
+                    if child.text:
+                        xf.write(child.text)
+                    for node in child:
+                        xf.write(node, pretty_print=pretty_print)
+                if child.tail:
+                    xf.write(child.tail)
+
+
+xml_parser = etree.XMLParser(huge_tree=True)
+
+
+def serialize_tree(tree):
+    """
+    Serialize DOM-tree for worker processes and caches, see parse_tree
+
+    XML serialization drops empty text nodes which change the pretty printed
+    HTML, their positions are kept in a header line.
+    """
+    empty = []
+    for idx, node in enumerate(tree.iter()):
+        if node.text == "":
+            empty.append("{}t".format(idx))
+        if node.tail == "":
+            empty.append("{}a".format(idx))
+    return " ".join(empty) + "\n" + etree.tostring(tree, encoding="utf-8")
+
+
+def parse_tree(data):
+    """
+    Restore DOM-tree serialized with serialize_tree
+    """
+    header, xml = data.split("\n", 1)
+    tree = etree.fromstring(xml, xml_parser)
+    if header:
+        nodes = list(tree.iter())
+        for position in header.split(" "):
+            node = nodes[int(position[:-1])]
+            if position[-1] == "t":
+                node.text = ""
+            else:
+                node.tail = ""
+    return tree
+
+
 def print_tree_segment(tree, xpath=""):
     """
     Print flattened tree
@@ -86,6 +148,7 @@ def wrap_node(node, wrapper_tag, wrapper_attrib={}):
     wrapper.append(node)
     wrapper.tail = node.tail
     node.tail = None
+    index_classes(wrapper, deep=False)
     return wrapper
 
 
@@ -150,13 +213,41 @@ def _width_in_cm(length_str):
     return convert_length(length_str, "cm")
 
 
-def get_node_style(node):
-    styles = tinycss2.parse_declaration_list(node.get("style", ""))
-    return dict(
+def _parse_style(style):
+    return [
         (d.lower_name, "".join([v.serialize() for v in d.value]).strip())
-        for d in styles
+        for d in tinycss2.parse_declaration_list(style)
         if d.type == "declaration"
-    )
+    ]
+
+
+style_cache = None  # parsed style attributes while cached_styles is active
+
+
+@contextmanager
+def cached_styles():
+    """
+    Cache parsed style attributes by their value, e.g. while filtering an article
+
+    Changed styles are still written to the style attribute immediately:
+    XPath queries and filters read the attribute directly.
+    """
+    global style_cache
+    previous, style_cache = style_cache, {}
+    try:
+        yield style_cache
+    finally:
+        style_cache = previous
+
+
+def get_node_style(node):
+    style = node.get("style", "")
+    if style_cache is None:
+        return dict(_parse_style(style))
+    declarations = style_cache.get(style)
+    if declarations is None:
+        declarations = style_cache[style] = _parse_style(style)
+    return dict(declarations)
 
 
 def serialize_node_style(node_style_dict):
@@ -187,12 +278,174 @@ def get_node_height(node, target_unit="px"):
     return get_node_size(node, attr="height", target_unit=target_unit)
 
 
+class ClassIndex(object):
+    """
+    Index of class tokens to the nodes of a tree
+
+    The index is built once and kept up to date by append_class, remove_class,
+    wrap_node and index_classes while it is active (see indexed_classes).
+    Queries return nodes in document order and skip nodes that were removed
+    from the tree or lost the class in the meantime.
+
+    Document order is kept as a sequence number per node, assigned when the tree
+    is indexed. Nodes added later are numbered when they are first queried: right
+    after the node preceding them, before the nodes added after that node earlier.
+    Nodes moved within the tree keep their number.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.nodes = defaultdict(dict)
+        self.order = {}  # node -> sequence number, a tuple
+        self.last_added = 0  # added nodes count down, see _sequence
+        for position, node in enumerate(root.iter()):
+            self.order[node] = (position,)
+        self.add_tree(root)
+
+    def add(self, node):
+        for token in (node.get("class") or "").split():
+            self.nodes[token][node] = None
+
+    def add_tree(self, node, deep=True):
+        for descendant in node.iter() if deep else [node]:
+            if isinstance(descendant.tag, string_types):
+                self.add(descendant)
+
+    def discard(self, node, token):
+        self.nodes.get(token, {}).pop(node, None)
+
+    def _attached(self, node):
+        while node is not self.root:
+            node = node.getparent()
+            if node is None:
+                return False
+        return True
+
+    @staticmethod
+    def _preceding(node):
+        """
+        Return the element preceding node in document order
+        """
+        previous = node.getprevious()
+        while previous is not None and not isinstance(previous.tag, string_types):
+            previous = previous.getprevious()
+        if previous is None:
+            return node.getparent()
+        while True:
+            children = [child for child in previous if isinstance(child.tag, string_types)]
+            if not children:
+                return previous
+            previous = children[-1]
+
+    def _sequence(self, node):
+        """
+        Return the sequence number of node, number the nodes added since indexing
+        """
+        added = []
+        while node is not None and node not in self.order:
+            added.append(node)
+            node = self._preceding(node)
+        if node is None:
+            return None
+        preceding = self.order[node]
+        self.last_added -= len(added)
+        for offset, added_node in enumerate(reversed(added)):
+            self.order[added_node] = preceding + (self.last_added + offset,)
+        return self.order[added[0]] if added else preceding
+
+    def find(self, cls, tag=None, exclude=()):
+        """
+        Return nodes having the class token cls in document order
+
+        :param tag: only return nodes with this tag
+        :param exclude: skip nodes having any of these class tokens
+        """
+        result = []
+        for node in list(self.nodes.get(cls, ())):
+            if tag is not None and node.tag != tag:
+                continue
+            tokens = (node.get("class") or "").split()
+            if cls not in tokens:
+                self.discard(node, cls)
+                continue
+            if any(token in tokens for token in exclude):
+                continue
+            if self._attached(node):
+                result.append((self._sequence(node), node))
+        result.sort(key=lambda item: item[0])
+        return [node for _, node in result]
+
+    def unindexed(self):
+        """
+        Debug helper: nodes of the tree with classes missing in the index
+        """
+        return [
+            node
+            for node in self.root.iter()
+            if isinstance(node.tag, string_types)
+            and any(
+                node not in self.nodes.get(token, ())
+                for token in (node.get("class") or "").split()
+            )
+        ]
+
+
+class_index = None  # ClassIndex of the tree currently being filtered
+class_token_xpath = etree.XPath(
+    "descendant-or-self::*"
+    '[contains(concat(" ", normalize-space(@class), " "), concat(" ", $cls, " "))]'
+)
+
+
+@contextmanager
+def indexed_classes(root):
+    """
+    Activate a ClassIndex of root
+    """
+    global class_index
+    previous, class_index = class_index, ClassIndex(root)
+    try:
+        yield class_index
+    finally:
+        class_index = previous
+
+
+def index_classes(node, deep=True):
+    """
+    Add new nodes to the active class index
+
+    Call this after creating or copying nodes that carry classes or after
+    setting the class attribute without append_class.
+    """
+    if class_index is not None:
+        class_index.add_tree(node, deep=deep)
+
+
+def find_class(root, cls, tag=None, exclude=()):
+    """
+    Return nodes below root having the class token cls in document order
+
+    Uses the active class index for its tree, XPath otherwise.
+    """
+    if class_index is not None and class_index.root is root:
+        return class_index.find(cls, tag=tag, exclude=exclude)
+    nodes = class_token_xpath(root, cls=cls)
+    return [
+        node
+        for node in nodes
+        if (tag is None or node.tag == tag)
+        and not any(token in node.get("class").split() for token in exclude)
+    ]
+
+
 def append_class(node, cls):
     current_cls = node.get("class")
     if current_cls:
         node.set("class", current_cls + " " + cls)
     else:
         node.set("class", cls)
+    if class_index is not None:
+        class_index.add(node)
 
 
 def remove_class(node, cls):
@@ -203,6 +456,8 @@ def remove_class(node, cls):
         current_classes.remove(cls)
     except ValueError:
         return
+    if class_index is not None and cls not in current_classes:
+        class_index.discard(node, cls)
     class_str = " ".join(current_classes)
     if not class_str:
         del node.attrib["class"]
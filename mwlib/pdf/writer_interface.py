@@ -20,7 +20,30 @@ def patch_logging(output_filename):
     mwlib.utils.start_logging(fn)
 
 
-def writer(env, output, status_callback, debug=True, lang=None, x=False):
+def writer(
+    env,
+    output,
+    status_callback,
+    debug=True,
+    lang=None,
+    x=False,
+    profile=None,
+    workers=None,
+    filter_cache=None,
+    filter_cache_size=None,
+    prince_workers=None,
+    prince_max_jobs=None,
+    render_chunks=None,
+    measure_all=False,
+    stream_measurement=False,
+    measure_cache=None,
+    measure_cache_size=None,
+    single_pass=False,
+    css_cache=None,
+    prune_css=False,
+    subset_fonts=False,
+    math_workers=None,
+):
     if not lang:
         _locale = locale.getlocale(locale.LC_NUMERIC)
         if _locale:
@@ -28,7 +51,30 @@ def writer(env, output, status_callback, debug=True, lang=None, x=False):
     crop_marks = False
     if not x:
         patch_logging(output)
-    renderer = html2pdf.PrincePdfWriter(env, output, debug=debug, crop_marks=crop_marks, lang=lang)
+    profile_rate = float(profile) if profile else None
+    renderer = html2pdf.PrincePdfWriter(
+        env,
+        output,
+        debug=debug,
+        crop_marks=crop_marks,
+        lang=lang,
+        profile_rate=profile_rate,
+        workers=int(workers) if workers else 1,
+        filter_cache=filter_cache,
+        filter_cache_size=int(filter_cache_size) if filter_cache_size else 512,
+        prince_workers=int(prince_workers) if prince_workers else 0,
+        prince_max_jobs=int(prince_max_jobs) if prince_max_jobs else 50,
+        render_chunks=int(render_chunks) if render_chunks else 1,
+        measure_all=bool(measure_all),
+        stream_measurement=bool(stream_measurement),
+        measure_cache_dir=measure_cache,
+        measure_cache_size=int(measure_cache_size) if measure_cache_size else 64,
+        single_pass=bool(single_pass),
+        css_cache_dir=css_cache,
+        prune_css=bool(prune_css),
+        subset_fonts=bool(subset_fonts),
+        math_workers=int(math_workers) if math_workers else 0,
+    )
 
     try:
         renderer.render_zip()
@@ -46,4 +92,51 @@ writer.options = {
     "lang": {"help": "language of book and its containing text", "param": "LANG"},
     "debug": {"help": "turn debug mode on",},
     "x": {"help": "turn off forced file logging"},
+    "profile": {
+        "help": "profile the html filters of a fraction of the articles (0-1), "
+        "results are written to filter_profile.json next to render.log",
+        "param": "RATE",
+    },
+    "workers": {"help": "number of processes filtering articles", "param": "N"},
+    "filter_cache": {
+        "help": "directory of a cache of filtered articles shared between renders",
+        "param": "DIR",
+    },
+    "filter_cache_size": {"help": "maximum size of the filter cache in MB", "param": "MB"},
+    "prince_workers": {
+        "help": "number of prince processes kept running between renders, 0 starts a new "
+        "prince process for every render pass (default)",
+        "param": "N",
+    },
+    "prince_max_jobs": {
+        "help": "number of renders after which a prince process is replaced",
+        "param": "N",
+    },
+    "render_chunks": {
+        "help": "split the articles into N groups rendered in parallel and merge the PDFs",
+        "param": "N",
+    },
+    "measure_all": {"help": "measure the boxes of all nodes, not only of the resizable tables"},
+    "stream_measurement": {
+        "help": "parse the measurements while prince renders instead of writing a render log"
+    },
+    "measure_cache": {
+        "help": "directory of a cache of measured box sizes shared between renders",
+        "param": "DIR",
+    },
+    "measure_cache_size": {"help": "maximum size of the measure cache in MB", "param": "MB"},
+    "single_pass": {
+        "help": "resize tables after the first layout within one prince run, falls back to "
+        "two passes if that fails, ignored with render_chunks"
+    },
+    "css_cache": {
+        "help": "directory of the compiled stylesheets, defaults to ~/.cache/mwlib.pdf",
+        "param": "DIR",
+    },
+    "prune_css": {"help": "drop the style rules not matching any element of the book"},
+    "subset_fonts": {"help": "drop the font faces of scripts not used in the book"},
+    "math_workers": {
+        "help": "number of formulas rendered in parallel while the articles are filtered",
+        "param": "N",
+    },
 }
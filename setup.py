@@ -1,9 +1,13 @@
 #! /usr/bin/env python
 
 import os
+import subprocess
+import sys
+from distutils import log
 
 from setuptools import find_packages
 from setuptools import setup
+from setuptools.command.build_py import build_py
 
 install_requires = ["mwlib>=0.16.0", "tinycss2>=0.6.1", "cssutils>=1.0.2"]
 
@@ -14,6 +18,29 @@ def get_version():
     return str(d["version"])
 
 
+class build_py_stylesheets(build_py):
+    """
+    Precompile the stylesheets into the build, see mwlib.pdf.stylesheets.precompile
+
+    Compiling needs the dependencies of the package. Without them the stylesheets
+    are compiled when they are first used.
+    """
+
+    def run(self):
+        build_py.run(self)
+        if self.dry_run:
+            return
+        output_dir = os.path.join(self.build_lib, 'mwlib', 'pdf', 'css', 'compiled')
+        cmd = [sys.executable, '-m', 'mwlib.pdf.stylesheets', 'mwlib/pdf/css/base.scss', output_dir]
+        try:
+            returncode = subprocess.call(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+        except OSError as exc:
+            returncode = exc
+        if returncode != 0:
+            log.warn('precompiling the stylesheets failed ({}), they are compiled on first '
+                     'use'.format(returncode))
+
+
 def main():
     if os.path.exists('Makefile'):
         print 'Running make'
@@ -26,9 +53,11 @@ def main():
             'mwlib.writers': ['pdf = mwlib.pdf.writer_interface:writer'],
         },
         install_requires=install_requires,
+        cmdclass={'build_py': build_py_stylesheets},
         namespace_packages=['mwlib'],
         packages=find_packages(exclude=[]),
         include_package_data=True,
+        package_data={'mwlib.pdf': ['css/compiled/*']},
         url="https://github.com/pediapress/mwlib.pdf",
         description="MediaWiki HTML to PDF renderer")
 